@@ -1,4 +1,21 @@
-import math
+import os
+import time
+import heapq
+import functools
+from datetime import datetime
+import numpy as np
+from instrument_master import DEFAULT_LOT_SIZE
+from margin_engine import margin_engine
+from probability_engine import probability_engine
+from vol_surface import vol_surface
+from trading_calendar import trading_calendar
+from metrics import timed, SELLER_COMBINATIONS
+
+# Put spreads matched against their call-spread prefixes per probability-engine call
+CONDOR_BLOCK_SIZE = 32
+# Latency budget of each seller-strategy search in /analyze; past it the best combinations found
+# so far are returned, flagged "truncated" (0 disables the budget)
+SELLER_BUDGET_SEC = float(os.getenv("SELLER_BUDGET_MS", "250")) / 1000.0
 
 class AdvancedOptionsAnalyzer:
     """
@@ -52,12 +69,17 @@ class AdvancedOptionsAnalyzer:
         return {"rsi": round(rsi, 2), "macd": round(macd, 2), "trend": trend, "score": score}
         
 
-    def analyze_regime(self, spot_price, chain):
+    @timed("analyze_regime")
+    def analyze_regime(self, spot_price, chain, symbol=None):
         """
         Combines options data and technical analysis to determine the market regime.
         """
         technicals = self.analyze_technicals(spot_price)
         pcr = self.calculate_pcr(chain)
+        # Fitted smile of the chain: its ATM IV replaces the flat 20% assumption in POP/EV
+        volatility = vol_surface.analytics(symbol or getattr(chain, "symbol", None), spot_price, chain,
+                                           self._time_to_expiry(chain))
+        atm_iv = volatility["atm_iv"] if volatility else None
         
         regime_score = technicals['score']
         
@@ -89,181 +111,299 @@ class AdvancedOptionsAnalyzer:
             regime = "Mildly Bearish"
             signal = "Mild Bearish"
             
+        prediction_text = f"Regime: {regime}. Technicals indicate {technicals['trend']} (RSI: {technicals['rsi']}, MACD: {technicals['macd']}). Options PCR is {round(pcr, 2)} indicating {pcr_signal}."
+        if volatility:
+            prediction_text += f" ATM IV is {volatility['atm_iv'] * 100:.1f}% with a 25-delta skew of {volatility['skew_25d'] * 100:+.1f} pts"
+            prediction_text += f" (IV rank {volatility['iv_rank']})." if volatility["iv_rank"] is not None else "."
+
         return {
-            "prediction_text": f"Regime: {regime}. Technicals indicate {technicals['trend']} (RSI: {technicals['rsi']}, MACD: {technicals['macd']}). Options PCR is {round(pcr, 2)} indicating {pcr_signal}.",
+            "prediction_text": prediction_text,
             "signal": signal,
             "regime_score": regime_score,
             "pcr": round(pcr, 2),
-            "seller_recommendation": self.recommend_seller_strategy(regime_score, spot_price, chain)
+            "volatility": volatility,
+            "seller_recommendation": self.recommend_seller_strategy(regime_score, spot_price, chain, symbol=symbol,
+                                                                    deadline=SELLER_BUDGET_SEC, vol=atm_iv)
         }
         
-    def recommend_seller_strategy(self, regime_score, spot_price, chain):
+    @timed("recommend_seller_strategy")
+    def recommend_seller_strategy(self, regime_score, spot_price, chain, symbol=None, rank_by="ev",
+                                  top_k=10, deadline=None, vol=None, pop_model=None):
         """
         Calculates every possible option seller combination within the available chain
-        to find options that have a Probability of Profit (POP) > 70% based on Delta
-        and a positive Expected Value (EV).
-        """
-        def get_bs_delta(spot, strike, opt_type):
-            # Standard assumptions for Delta calc: 7 days to expiry, 20% IV, 7% risk-free rate
-            t = 7 / 365.0
-            vol = 0.20
-            r = 0.07
-            if spot <= 0 or strike <= 0:
-                return 0.5
-            
-            d1 = (math.log(spot / strike) + (r + 0.5 * vol**2) * t) / (vol * math.sqrt(t))
-            cdf_d1 = (1.0 + math.erf(d1 / math.sqrt(2.0))) / 2.0
-            
-            if opt_type == 'CE':
-                return cdf_d1
-            else:
-                return cdf_d1 - 1.0
+        to find options that have a Probability of Profit (POP) between 75% and 90% and
+        a positive Expected Value (EV). POP and EV come from the probability engine, which
+        evaluates the full multi-leg payoff at expiry (lognormal or Monte Carlo, see
+        `pop_model`) rather than approximating POP from the short leg's delta.
+        Margins for qualifying combinations are estimated in one batch so they can
+        also be ranked by return on margin (rank_by="rom").
 
-        def calculate_delta_pop(spot, short_strike, opt_type):
-            delta = get_bs_delta(spot, short_strike, opt_type)
-            return 100 * (1 - abs(delta))
+        When ranking by EV, the Iron Condor search is a branch-and-bound top-k: pairs whose
+        EV cannot beat the current k-th best are pruned. `deadline` is a latency budget in
+        seconds; when it runs out the best combinations found so far are returned and the
+        response is flagged with "truncated".
+        """
+        deadline_at = time.perf_counter() + deadline if deadline else None
+        truncated = False
 
         sorted_chain = sorted(chain, key=lambda x: x['strike'])
         valid_trades = []
-        lot_size = 50 
+        lot_size = getattr(chain, "lot_size", None) or DEFAULT_LOT_SIZE
+        t = self._time_to_expiry(chain)
+        score = functools.partial(probability_engine.evaluate, spot_price, t, vol=vol, model=pop_model)
         
         if regime_score >= 1: 
             strategy_name = "Bull Put Spread"
             rationale = "Bullish trend detected. Selling Puts below the spot price to collect premium."
             valid_strikes = [opt for opt in sorted_chain if opt['strike'] < spot_price]
-            
-            for i in range(len(valid_strikes)):
-                for j in range(i): 
-                    sell_leg = valid_strikes[i]
-                    buy_leg = valid_strikes[j]
-                    
-                    credit_per_share = sell_leg['pe_price'] - buy_leg['pe_price']
-                    if credit_per_share <= 0: continue
-                        
-                    strike_width = sell_leg['strike'] - buy_leg['strike']
-                    net_credit = credit_per_share * lot_size
-                    max_loss = (strike_width * lot_size) - net_credit
-                    if max_loss <= 0: continue
-                        
-                    # Calculate Delta POP
-                    pop_pct = calculate_delta_pop(spot_price, sell_leg['strike'], 'PE')
-                    pop_decimal = pop_pct / 100.0
-                    
-                    # Calculate Expected Value (EV)
-                    ev = (pop_decimal * net_credit) - ((1.0 - pop_decimal) * max_loss)
-                    
-                    if 75 <= pop_pct <= 90 and max_loss <= 4 * net_credit and ev > 0:
-                        rr_ratio = net_credit / max_loss
-                        valid_trades.append({
-                            "strikes": f"Sell {sell_leg['strike']} PE, Buy {buy_leg['strike']} PE",
-                            "net_credit": round(net_credit, 2),
-                            "max_loss": round(max_loss, 2),
-                            "rr_ratio": round(rr_ratio, 2),
-                            "pop": round(pop_pct, 1),
-                            "ev": round(ev, 2)
-                        })
+            combinations = len(valid_strikes) * (len(valid_strikes) - 1) // 2
+            # Sell the higher strike, buy the lower one
+            sell, buy = np.tril_indices(len(valid_strikes), -1)
+            valid_trades = self._score_verticals(valid_strikes, 'PE', sell, buy, lot_size, score)
                         
         elif regime_score <= -1: 
             strategy_name = "Bear Call Spread"
             rationale = "Bearish trend detected. Selling Calls above the spot price to collect premium safely."
             valid_strikes = [opt for opt in sorted_chain if opt['strike'] > spot_price]
-            
-            for i in range(len(valid_strikes)):
-                for j in range(i+1, len(valid_strikes)): 
-                    sell_leg = valid_strikes[i]
-                    buy_leg = valid_strikes[j]
-                    
-                    credit_per_share = sell_leg['ce_price'] - buy_leg['ce_price']
-                    if credit_per_share <= 0: continue
-                        
-                    strike_width = buy_leg['strike'] - sell_leg['strike']
-                    net_credit = credit_per_share * lot_size
-                    max_loss = (strike_width * lot_size) - net_credit
-                    if max_loss <= 0: continue
-                        
-                    # Calculate Delta POP
-                    pop_pct = calculate_delta_pop(spot_price, sell_leg['strike'], 'CE')
-                    pop_decimal = pop_pct / 100.0
-                    
-                    # Calculate Expected Value (EV)
-                    ev = (pop_decimal * net_credit) - ((1.0 - pop_decimal) * max_loss)
-                    
-                    if 75 <= pop_pct <= 90 and max_loss <= 4 * net_credit and ev > 0:
-                        rr_ratio = net_credit / max_loss
-                        valid_trades.append({
-                            "strikes": f"Sell {sell_leg['strike']} CE, Buy {buy_leg['strike']} CE",
-                            "net_credit": round(net_credit, 2),
-                            "max_loss": round(max_loss, 2),
-                            "rr_ratio": round(rr_ratio, 2),
-                            "pop": round(pop_pct, 1),
-                            "ev": round(ev, 2)
-                        })
+            combinations = len(valid_strikes) * (len(valid_strikes) - 1) // 2
+            # Sell the lower strike, buy the higher one
+            sell, buy = np.triu_indices(len(valid_strikes), 1)
+            valid_trades = self._score_verticals(valid_strikes, 'CE', sell, buy, lot_size, score)
                         
         else: 
             strategy_name = "Iron Condor"
             rationale = "Neutral consolidation detected. Selling an OTM Call Spread and OTM Put Spread."
             puts = [opt for opt in sorted_chain if opt['strike'] < spot_price]
             calls = [opt for opt in sorted_chain if opt['strike'] > spot_price]
+            combinations = len(puts) * (len(puts) - 1) // 2 + len(calls) * (len(calls) - 1) // 2
             
-            valid_put_spreads = []
-            for i in range(len(puts)):
-                for j in range(i):
-                    cps = puts[i]['pe_price'] - puts[j]['pe_price']
-                    if cps <= 0: continue
-                    width = puts[i]['strike'] - puts[j]['strike']
-                    pop = calculate_delta_pop(spot_price, puts[i]['strike'], 'PE')
-                    if pop >= 75:
-                        valid_put_spreads.append((puts[i], puts[j], cps, width, pop))
+            # Beyond its long strikes a condor is at max loss, so a condor can only reach 75% POP
+            # if each long strike alone leaves at least that much probability inside.
+            dist = probability_engine.distribution(spot_price, t, vol, pop_model)
+            put_spreads = self._side_spreads(puts, 'PE', *np.tril_indices(len(puts), -1), score)
+            call_spreads = self._side_spreads(calls, 'CE', *np.triu_indices(len(calls), 1), score)
+            put_tail = dist.cdf([sp[1]['strike'] for sp in put_spreads])
+            call_tail = 1.0 - dist.cdf([sp[1]['strike'] for sp in call_spreads])
+            put_spreads = [sp for sp, tail in zip(put_spreads, put_tail) if tail <= 0.25]
+            call_spreads = [sp for sp, tail in zip(call_spreads, call_tail) if tail <= 0.25]
             
-            valid_call_spreads = []
-            for i in range(len(calls)):
-                for j in range(i+1, len(calls)):
-                    cps = calls[i]['ce_price'] - calls[j]['ce_price']
-                    if cps <= 0: continue
-                    width = calls[j]['strike'] - calls[i]['strike']
-                    pop = calculate_delta_pop(spot_price, calls[i]['strike'], 'CE')
-                    if pop >= 75:
-                        valid_call_spreads.append((calls[i], calls[j], cps, width, pop))
+            # Expected payoff is linear in the legs, so a condor's EV is exactly the sum of its
+            # two sides' EVs. Visiting both sides by EV (descending) lets whole branches be cut
+            # once put EV + best remaining call EV drops below the k-th best condor found so far.
+            # Put spreads are taken in blocks: each one is matched against its call-spread prefix
+            # with numpy, and the exact four-leg POP of every pair that passes the cheaper
+            # filters is computed in one probability-engine call per block.
+            prune = rank_by != "rom"
+            put_spreads.sort(key=lambda sp: sp[4], reverse=True)
+            call_spreads.sort(key=lambda sp: sp[4], reverse=True)
+            call_credit = np.array([cs[2] for cs in call_spreads], dtype=float)
+            call_width = np.array([cs[3] for cs in call_spreads], dtype=float)
+            call_ev = np.array([cs[4] for cs in call_spreads], dtype=float)
+            call_short = np.array([cs[0]['strike'] for cs in call_spreads], dtype=float)
+            call_long = np.array([cs[1]['strike'] for cs in call_spreads], dtype=float)
+            neg_call_ev = -call_ev
+            best = []  # min-heap of (ev, sequence, trade) for the top-k
+            sequence = 0
+            threshold = 0.0  # EV must be positive regardless
+            exhausted = not len(call_ev)
+            position = 0
             
-            for ps in valid_put_spreads:
-                for cs in valid_call_spreads:
-                    total_credit_per_share = ps[2] + cs[2]
-                    max_width = max(ps[3], cs[3])
-                    net_credit = total_credit_per_share * lot_size
-                    max_loss = (max_width * lot_size) - net_credit
-                    if max_loss <= 0: continue
-                    
-                    # For Iron Condor, approximate POP as the product of both sides succeeding
-                    # or conservatively take the lowest probability side. We'll take the lowest.
-                    pop_pct = min(ps[4], cs[4])
-                    pop_decimal = pop_pct / 100.0
-                    
-                    ev = (pop_decimal * net_credit) - ((1.0 - pop_decimal) * max_loss)
+            while not exhausted and position < len(put_spreads):
+                if deadline_at and time.perf_counter() > deadline_at:
+                    truncated = True
+                    break
+                
+                block = []
+                for ps in put_spreads[position:position + CONDOR_BLOCK_SIZE]:
+                    if prune and (ps[4] + call_ev[0]) * lot_size <= threshold:
+                        exhausted = True
+                        break
+                    # Call spreads that can still beat the threshold form a prefix of the sorted list
+                    n = len(call_ev)
+                    if prune:
+                        n = int(np.searchsorted(neg_call_ev, ps[4] - threshold / lot_size, side='left'))
+                    combinations += n
                     
-                    if 75 <= pop_pct <= 90 and max_loss <= 4 * net_credit and ev > 0:
-                        rr_ratio = net_credit / max_loss
-                        valid_trades.append({
-                            "strikes": f"Puts: Sell {ps[0]['strike']}/Buy {ps[1]['strike']} | Calls: Sell {cs[0]['strike']}/Buy {cs[1]['strike']}",
-                            "net_credit": round(net_credit, 2),
-                            "max_loss": round(max_loss, 2),
-                            "rr_ratio": round(rr_ratio, 2),
-                            "pop": round(pop_pct, 1),
-                            "ev": round(ev, 2)
-                        })
+                    net_credit = (ps[2] + call_credit[:n]) * lot_size
+                    max_loss = (np.maximum(ps[3], call_width[:n]) * lot_size) - net_credit
+                    ev = (ps[4] + call_ev[:n]) * lot_size
+                    candidates = np.flatnonzero((max_loss > 0) & (max_loss <= 4 * net_credit) & (ev > threshold))
+                    if len(candidates):
+                        block.append((ps, candidates, net_credit[candidates], ev[candidates]))
+                position += CONDOR_BLOCK_SIZE
+                if not block:
+                    continue
+                
+                sizes = [len(b[1]) for b in block]
+                m = sum(sizes)
+                strikes = np.column_stack([
+                    np.repeat([b[0][0]['strike'] for b in block], sizes),
+                    np.repeat([b[0][1]['strike'] for b in block], sizes),
+                    np.concatenate([call_short[b[1]] for b in block]),
+                    np.concatenate([call_long[b[1]] for b in block]),
+                ])
+                credit = np.concatenate([b[2] for b in block]) / lot_size
+                pop_pct = 100 * score(strikes, np.tile(['PE', 'PE', 'CE', 'CE'], (m, 1)),
+                                      np.tile([-1, 1, -1, 1], (m, 1)), credit)["pop"]
+                
+                offset = 0
+                for (ps, candidates, _, ev), size in zip(block, sizes):
+                    pops = pop_pct[offset:offset + size]
+                    offset += size
+                    for k in np.flatnonzero((pops >= 75) & (pops <= 90)):
+                        if prune and ev[k] <= threshold:
+                            continue
+                        trade = self._condor_trade(ps, call_spreads[candidates[k]], lot_size, float(pops[k]))
+                        if not prune:
+                            valid_trades.append(trade)
+                            continue
+                        # Negative sequence keeps the earliest-found trade on EV ties
+                        sequence += 1
+                        heapq.heappush(best, (float(ev[k]), -sequence, trade))
+                        if len(best) > top_k:
+                            heapq.heappop(best)
+                        if len(best) == top_k:
+                            threshold = best[0][0]
+            
+            if prune:
+                valid_trades = [trade for _, _, trade in best]
 
+        SELLER_COMBINATIONS.observe(combinations, strategy=strategy_name)
+        
         if not valid_trades:
             return {
                 "strategy": "No Optimal Strategy Found",
                 "rationale": "Could not find any strategies with 75-90% PoP, positive EV, and Max Loss under 4x.",
-                "options": []
+                "options": [],
+                "combinations_evaluated": combinations,
+                "truncated": truncated
             }
             
-        # Sort entirely by highest Expected Value (EV) first
-        valid_trades.sort(key=lambda x: x['ev'], reverse=True)
-        top_10 = valid_trades[:10]
+        if rank_by == "rom":
+            self._attach_margins(valid_trades, symbol, spot_price, lot_size, t, vol)
+            valid_trades.sort(key=lambda x: x['rom'], reverse=True)
+            ranking_text = "Return on Margin (ROM)"
+            top_trades = valid_trades[:top_k]
+        else:
+            # Sort entirely by highest Expected Value (EV) first; only the winners need margins
+            valid_trades.sort(key=lambda x: x['ev'], reverse=True)
+            ranking_text = "Highest Positive Expected Value (EV)"
+            top_trades = valid_trades[:top_k]
+            self._attach_margins(top_trades, symbol, spot_price, lot_size, t, vol)
             
         return {
             "strategy": strategy_name,
-            "rationale": rationale + " Showing top 10 combinations strictly sorted by Highest Positive Expected Value (EV).",
-            "options": top_10
+            "rationale": rationale + f" Showing top {top_k} combinations strictly sorted by {ranking_text}.",
+            "options": top_trades,
+            "combinations_evaluated": combinations,
+            "truncated": truncated
+        }
+
+    def _time_to_expiry(self, chain):
+        """Years to the chain's expiry close; falls back to a one-week horizon when it is unknown."""
+        expiry = getattr(chain, "expiry", None)
+        if expiry is None:
+            return 7 / 365.0
+        if isinstance(expiry, datetime):
+            expiry = expiry.date()
+        return trading_calendar.calendar_days_to_expiry(expiry) / 365.0
+
+    def _side_spreads(self, strikes, opt_type, sell, buy, score):
+        """
+        Credit spreads for one side of a condor as (sell leg, buy leg, credit, width, ev),
+        credit/width/ev per share. Only spreads that collect a credit are kept.
+        """
+        price_key = 'ce_price' if opt_type == 'CE' else 'pe_price'
+        prices = np.array([opt[price_key] for opt in strikes], dtype=float)
+        values = np.array([opt['strike'] for opt in strikes], dtype=float)
+        credit = prices[sell] - prices[buy]
+        keep = credit > 0
+        sell, buy, credit = sell[keep], buy[keep], credit[keep]
+        if len(credit) == 0:
+            return []
+
+        n = len(credit)
+        ev = score(np.column_stack([values[sell], values[buy]]), np.full((n, 2), opt_type),
+                   np.tile([-1, 1], (n, 1)), credit)["expected_payoff"]
+        width = np.abs(values[sell] - values[buy])
+        return [(strikes[i], strikes[j], c, w, e)
+                for i, j, c, w, e in zip(sell.tolist(), buy.tolist(), credit.tolist(), width.tolist(), ev.tolist())]
+
+    def _score_verticals(self, strikes, opt_type, sell, buy, lot_size, score):
+        """Scores every (sell, buy) credit spread in one batch and returns the qualifying trades."""
+        price_key = 'ce_price' if opt_type == 'CE' else 'pe_price'
+        prices = np.array([opt[price_key] for opt in strikes], dtype=float)
+        values = np.array([opt['strike'] for opt in strikes], dtype=float)
+        credit = prices[sell] - prices[buy]
+        net_credit = credit * lot_size
+        max_loss = np.abs(values[sell] - values[buy]) * lot_size - net_credit
+        keep = np.flatnonzero((credit > 0) & (max_loss > 0) & (max_loss <= 4 * net_credit))
+        if len(keep) == 0:
+            return []
+
+        n = len(keep)
+        result = score(np.column_stack([values[sell[keep]], values[buy[keep]]]), np.full((n, 2), opt_type),
+                       np.tile([-1, 1], (n, 1)), credit[keep])
+        pop_pct = 100 * result["pop"]
+        ev = result["expected_payoff"] * lot_size
+
+        trades = []
+        for k in np.flatnonzero((pop_pct >= 75) & (pop_pct <= 90) & (ev > 0)):
+            sell_leg, buy_leg = strikes[sell[keep[k]]], strikes[buy[keep[k]]]
+            trades.append({
+                "strikes": f"Sell {sell_leg['strike']} {opt_type}, Buy {buy_leg['strike']} {opt_type}",
+                "net_credit": round(float(net_credit[keep[k]]), 2),
+                "max_loss": round(float(max_loss[keep[k]]), 2),
+                "rr_ratio": round(float(net_credit[keep[k]] / max_loss[keep[k]]), 2),
+                "pop": round(float(pop_pct[k]), 1),
+                "ev": round(float(ev[k]), 2),
+                "_legs": [(sell_leg, opt_type, -1), (buy_leg, opt_type, 1)]
+            })
+        return trades
+
+    def _condor_trade(self, ps, cs, lot_size, pop_pct):
+        """Builds the Iron Condor result row for a (put spread, call spread) pair."""
+        net_credit = (ps[2] + cs[2]) * lot_size
+        max_loss = (max(ps[3], cs[3]) * lot_size) - net_credit
+        ev = (ps[4] + cs[4]) * lot_size
+        return {
+            "strikes": f"Puts: Sell {ps[0]['strike']}/Buy {ps[1]['strike']} | Calls: Sell {cs[0]['strike']}/Buy {cs[1]['strike']}",
+            "net_credit": round(net_credit, 2),
+            "max_loss": round(max_loss, 2),
+            "rr_ratio": round(net_credit / max_loss, 2),
+            "pop": round(pop_pct, 1),
+            "ev": round(ev, 2),
+            "_legs": [(ps[0], 'PE', -1), (ps[1], 'PE', 1), (cs[0], 'CE', -1), (cs[1], 'CE', 1)]
         }
+
+    def _attach_margins(self, trades, symbol, spot_price, lot_size, t, vol=None):
+        """
+        Estimates SPAN-like margin for every candidate in a single batch, on the chain's
+        time to expiry `t` (years), and adds 'margin' and 'rom' (net credit as % of margin)
+        to each trade.
+        """
+        max_legs = max(len(trade['_legs']) for trade in trades)
+        strikes, types, quantities, prices = [], [], [], []
+        for trade in trades:
+            legs = trade.pop('_legs')
+            padding = max_legs - len(legs)
+            strikes.append([leg[0]['strike'] for leg in legs] + [legs[0][0]['strike']] * padding)
+            types.append([leg[1] for leg in legs] + ['CE'] * padding)
+            quantities.append([leg[2] * lot_size for leg in legs] + [0] * padding)
+            prices.append([leg[0]['ce_price' if leg[1] == 'CE' else 'pe_price'] for leg in legs] + [0.0] * padding)
+
+        margins = margin_engine.estimate_batch(symbol, spot_price, strikes, types, quantities, prices,
+                                               days_to_expiry=t * 365.0, iv=vol)["total"]
+        for trade, margin in zip(trades, margins):
+            trade["margin"] = round(float(margin), 2)
+            trade["rom"] = round(float(trade["net_credit"] / margin * 100), 2) if margin > 0 else 0.0
+
+
+# Lazily-built singleton (created during app startup, see main.lifespan)
+_analyzer = None
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = AdvancedOptionsAnalyzer()
+    return _analyzer
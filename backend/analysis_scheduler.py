@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from shared_cache import get_shared_cache
+from token_manager import IST
+from trading_calendar import trading_calendar
+from metrics import timer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WATCHLISTS_FILE = os.getenv("WATCHLISTS_FILE", os.path.join(BASE_DIR, "data", "watchlists.json"))
+# Seconds between scheduled recomputations of every configured (watchlist, strategy) pair
+ANALYSIS_REFRESH_SEC = float(os.getenv("ANALYSIS_REFRESH_SEC", "60"))
+# Default age limit for serving a cached /analyze result; requests can pass their own max_age
+ANALYSIS_MAX_AGE_SEC = float(os.getenv("ANALYSIS_MAX_AGE_SEC", "300"))
+# How long results stay in the shared cache at all (covers the overnight close)
+ANALYSIS_RESULT_TTL_SEC = 24 * 3600
+
+
+class AnalysisResultCache:
+    """
+    Versioned /analyze results in the shared cache, keyed by (strategy, stocks in request
+    order). Every store bumps the key's version, so clients can tell a refreshed result
+    from the one they already have.
+    """
+
+    def key(self, stocks, strategy):
+        digest = hashlib.sha1(json.dumps([strategy, list(stocks)]).encode()).hexdigest()[:16]
+        return f"analysis:{digest}"
+
+    def get(self, stocks, strategy):
+        """{"version", "computed_at", "digest", "data"} or None."""
+        return get_shared_cache().get(self.key(stocks, strategy))
+
+    def put(self, stocks, strategy, data):
+        cache = get_shared_cache()
+        key = self.key(stocks, strategy)
+        with cache.lock(key, ttl=30, timeout=30):
+            previous = cache.get(key)
+            entry = {
+                "version": (previous["version"] + 1) if previous else 1,
+                "computed_at": time.time(),
+                "digest": content_digest(data),
+                "data": data
+            }
+            cache.set(key, entry, ANALYSIS_RESULT_TTL_SEC)
+        return entry
+
+
+def content_digest(data):
+    """
+    Hash of a result's content. Versions restart with the process (memory cache) or the
+    entry's TTL, so only the content can tell two results apart across restarts and workers.
+    """
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+
+def with_age(entry, cached):
+    """Response metadata for a cached entry."""
+    return {
+        "data": entry["data"],
+        "cached": cached,
+        "version": entry["version"],
+        "computed_at": datetime.fromtimestamp(entry["computed_at"], IST).isoformat(),
+        "age_seconds": round(max(time.time() - entry["computed_at"], 0.0), 3)
+    }
+
+
+class AnalysisScheduler:
+    """
+    Background recomputation of the configured watchlists during market hours.
+
+    Watchlists come from WATCHLISTS_FILE: a list of {"stocks": [...], "strategy": "..."}.
+    Every worker runs the loop, but a pair is skipped when its cached result is younger than
+    the refresh interval or another worker is already computing it, so each pair is computed
+    once per interval regardless of the worker count.
+    """
+
+    def __init__(self, compute, watchlists_file=WATCHLISTS_FILE, interval=ANALYSIS_REFRESH_SEC,
+                 results=None):
+        self.compute = compute
+        self.watchlists_file = watchlists_file
+        self.interval = interval
+        self.results = results or result_cache
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watchlists(self):
+        try:
+            with open(self.watchlists_file) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logging.error(f"Failed to load watchlists from {self.watchlists_file}: {e}")
+            return []
+        return [entry for entry in entries if isinstance(entry, dict) and entry.get("stocks") and entry.get("strategy")]
+
+    def run_once(self):
+        """Recomputes every watchlist pair whose cached result is due. Returns how many ran."""
+        cache = get_shared_cache()
+        refreshed = 0
+        for entry in self.watchlists():
+            stocks, strategy = entry["stocks"], entry["strategy"]
+            if self._stop.is_set():
+                break
+            current = self.results.get(stocks, strategy)
+            if current and time.time() - current["computed_at"] < self.interval:
+                continue
+
+            key = self.results.key(stocks, strategy)
+            with cache.lock(f"{key}:compute", ttl=max(self.interval, 60), timeout=0) as acquired:
+                if not acquired:
+                    continue
+                try:
+                    with timer("analysis.precompute"):
+                        data = self.compute(stocks, strategy)
+                    self.results.put(stocks, strategy, data)
+                    refreshed += 1
+                except Exception as e:
+                    logging.error(f"Scheduled analysis failed for {strategy} {stocks}: {e}")
+        return refreshed
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="analysis-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if trading_calendar.is_market_open():
+                self.run_once()
+            self._stop.wait(self.interval)
+
+
+# Initialize singleton
+result_cache = AnalysisResultCache()
@@ -0,0 +1,312 @@
+import os
+import gzip
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+from fastapi import HTTPException, Response
+
+from metrics import timer
+
+# Bodies smaller than this are sent uncompressed (compression would not pay for itself)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Representations: plain JSON, column-major JSON (row keys sent once), MessagePack and
+# Arrow IPC. The last two need the optional msgpack / pyarrow packages.
+FORMATS = ("json", "columnar", "msgpack", "arrow")
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+# --- Typed response models ---
+
+class SellerOption(BaseModel):
+    strikes: str
+    net_credit: float
+    max_loss: float
+    rr_ratio: float
+    pop: float
+    ev: float
+    margin: Optional[float] = None
+    rom: Optional[float] = None
+
+
+class SellerRecommendation(BaseModel):
+    strategy: str
+    rationale: str
+    options: List[SellerOption]
+    combinations_evaluated: Optional[int] = None
+    truncated: bool = False
+
+
+class Headline(BaseModel):
+    title: str
+    sentiment: str
+
+
+class Sentiment(BaseModel):
+    score: float
+    mood: str
+    headlines: List[Headline]
+    catalysts: List[str]
+
+
+class Volatility(BaseModel):
+    atm_iv: float
+    put_25d_iv: float
+    call_25d_iv: float
+    skew_25d: float
+    iv_rank: Optional[float] = None
+    iv_history_days: int
+    model: str
+    fit_rmse: float
+    points: int
+
+
+class StrategyStats(BaseModel):
+    strategy_name: str
+    spot: float
+    lot_size: int
+    margin: float
+    roi: float
+    premium_paid: float
+    premium_received: float
+    # None when the profit is unbounded (see max_profit_unlimited)
+    max_profit: Optional[float] = None
+    max_profit_unlimited: bool = False
+    max_loss: float
+    strikes_involved: List[str]
+    commentary: str
+
+
+class StockAnalysis(BaseModel):
+    stock: str
+    spot: float
+    prediction: str
+    signal: str
+    pcr: float
+    volatility: Optional[Volatility] = None
+    seller_recommendation: SellerRecommendation
+    sentiment: Sentiment
+    stats: StrategyStats
+    # Upstreams that were unavailable and answered from their last good data
+    stale: List[str] = []
+
+
+class AnalysisResponse(BaseModel):
+    data: List[StockAnalysis]
+    cached: bool
+    version: int
+    computed_at: str
+    age_seconds: float
+    # Stocks in the full result; data holds the requested page of them
+    total: Optional[int] = None
+
+
+class Adjustment(BaseModel):
+    action: str
+    description: str
+    expiry: str
+    # Cash of the adjustment for the position's quantity (negative: a debit)
+    net_credit: float
+    pop: float
+    ev: float
+    ev_gain: float
+
+
+class PositionRow(BaseModel):
+    symbol: str
+    qty: int
+    avg_price: float
+    ltp: float
+    pnl: float
+    action: str
+    reason: str
+    underlying: str
+    underlying_price: float
+    expiry: Optional[str] = None
+    days_to_expiry: int
+    adjustments: List[Adjustment] = []
+
+
+class PositionsResponse(BaseModel):
+    data: List[PositionRow]
+    risk: Dict[str, Any]
+    # Roll suggestions hit their latency budget; some flagged legs have none
+    adjustments_truncated: bool = False
+    # Upstreams that were unavailable and answered from their last good data
+    stale: List[str] = []
+    total: Optional[int] = None
+
+
+# --- Views: pagination and field selection ---
+
+class View(BaseModel):
+    """How much of a response to send: a page of rows, selected fields and a representation."""
+    # Comma-separated row fields to keep; dotted paths reach into nested objects
+    # ("stock,signal,stats.roi,seller_recommendation.options")
+    fields: Optional[str] = None
+    offset: int = Field(0, ge=0)
+    limit: Optional[int] = Field(None, ge=1)
+    # Cap on seller_recommendation.options per stock
+    options_limit: Optional[int] = Field(None, ge=1)
+    format: Optional[str] = None
+
+    def signature(self):
+        """Short digest of everything that changes the representation, for the ETag."""
+        raw = f"{self.fields}|{self.offset}|{self.limit}|{self.options_limit}|{self.format}"
+        return hashlib.sha1(raw.encode()).hexdigest()[:10]
+
+
+def _field_tree(fields):
+    tree = {}
+    for path in fields.split(","):
+        node = tree
+        for part in path.strip().split("."):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def _select(value, tree):
+    """Keeps only the fields in `tree` (an empty subtree keeps the whole value)."""
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_select(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _select(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+
+def apply_view(payload, view):
+    """Pages `payload["data"]`, trims seller options and selects row fields. Adds "total"."""
+    rows = payload["data"]
+    end = None if view.limit is None else view.offset + view.limit
+    page = rows[view.offset:end]
+    if view.options_limit is not None:
+        page = [_trim_options(row, view.options_limit) for row in page]
+    if view.fields:
+        tree = _field_tree(view.fields)
+        page = [_select(row, tree) for row in page]
+    return {**payload, "data": page, "total": len(rows)}
+
+
+def _trim_options(row, limit):
+    recommendation = row.get("seller_recommendation")
+    if not recommendation:
+        return row
+    return {**row, "seller_recommendation": {**recommendation, "options": recommendation["options"][:limit]}}
+
+
+# --- Encoding ---
+
+def negotiate_format(request, view):
+    """The representation asked for by ?format= / the request body, else by the Accept header."""
+    fmt = (view.format or "").lower()
+    if not fmt:
+        accept = request.headers.get("accept", "")
+        if "msgpack" in accept:
+            fmt = "msgpack"
+        elif "apache.arrow" in accept:
+            fmt = "arrow"
+        else:
+            fmt = "json"
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=406, detail=f"Unsupported format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+def columnar(payload):
+    """Column-major copy of payload["data"]: {"columns": [...], "values": [[column]...]}."""
+    rows = payload["data"]
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    return {**payload, "data": {"columns": columns, "values": [[row.get(key) for row in rows] for key in columns]}}
+
+
+def encode(payload, fmt):
+    if fmt == "json":
+        return json.dumps(payload, separators=(",", ":")).encode()
+    if fmt == "columnar":
+        return json.dumps(columnar(payload), separators=(",", ":")).encode()
+    if fmt == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise HTTPException(status_code=406, detail="format=msgpack requires the 'msgpack' package (pip install msgpack)")
+        return msgpack.packb(payload, use_bin_type=True)
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="format=arrow requires the 'pyarrow' package (pip install pyarrow)")
+    # One record batch of the rows; nested values travel as JSON strings, metadata in the schema
+    rows = payload["data"]
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    table = pa.table({
+        key: [json.dumps(row.get(key)) if isinstance(row.get(key), (dict, list)) else row.get(key) for row in rows]
+        for key in columns
+    })
+    meta = {key: json.dumps(value) for key, value in payload.items() if key != "data"}
+    table = table.replace_schema_metadata(meta)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def compress(body, accept_encoding):
+    """(body, Content-Encoding or None): brotli when accepted and installed, else gzip."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+    if "br" in accepted:
+        try:
+            import brotli
+            return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+        except ImportError:
+            pass
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def etag_matches(request, etag):
+    """If-None-Match check (weak comparison, '*' matches anything)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept, Accept-Encoding"})
+
+
+def respond(request, payload, model, view, etag=None):
+    """
+    Validates `payload` against its response model, applies the view and returns the
+    encoded, compressed Response. `etag` (weak, representation-specific) should be
+    derived from the snapshot version; without one it is a digest of the body.
+    """
+    fmt = negotiate_format(request, view)
+    with timer("response.encode"):
+        payload = apply_view(model.model_validate(payload).model_dump(mode="json"), view)
+        body = encode(payload, fmt)
+        if etag is None:
+            etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}.{fmt}"'
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        body, content_encoding = compress(body, request.headers.get("accept-encoding", ""))
+
+    headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding"}
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    return Response(content=body, media_type=MEDIA_TYPES[fmt], headers=headers)
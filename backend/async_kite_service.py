@@ -0,0 +1,254 @@
+import os
+import csv
+import time
+import random
+import asyncio
+import logging
+from io import StringIO
+from datetime import date
+
+import httpx
+import kiteconnect.exceptions
+from dotenv import load_dotenv
+
+from instrument_master import InstrumentMaster, OptionChain
+from token_manager import token_manager
+
+load_dotenv()
+
+KITE_ROOT_URL = os.getenv("KITE_ROOT_URL", "https://api.kite.trade")
+
+# Published Kite Connect limits (requests per second) per endpoint group
+RATE_LIMITS = {
+    "quote": 1,
+    "historical": 3,
+    "order": 10,
+    "default": 10,
+}
+MAX_QUOTE_INSTRUMENTS = 500
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Async token bucket. acquire() waits until a token is available, so bursts above the
+    broker limit are smoothed out instead of being rejected with HTTP 429.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class QuoteCoalescer:
+    """
+    Merges concurrent quote() calls into shared batches. Callers that arrive while a batch
+    is being collected (or while the previous batch is in flight) ride on the next one, so
+    N simultaneous /analyze requests cost one rate-limited quote call instead of N.
+    """
+
+    def __init__(self, fetch, window=0.005, max_batch=MAX_QUOTE_INSTRUMENTS):
+        self.fetch = fetch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._flush_task = None
+
+    async def quote(self, instruments):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for inst in instruments:
+            if inst not in self._pending:
+                self._pending[inst] = loop.create_future()
+            futures.append(self._pending[inst])
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        quotes = {}
+        for inst, result in zip(instruments, results):
+            if isinstance(result, Exception):
+                raise result
+            if result is not None:
+                quotes[inst] = result
+        return quotes
+
+    async def _flush(self):
+        while self._pending:
+            await asyncio.sleep(self.window)
+            pending, self._pending = self._pending, {}
+            symbols = list(pending)
+
+            batches = [symbols[i:i + self.max_batch] for i in range(0, len(symbols), self.max_batch)]
+            for batch in batches:
+                try:
+                    data = await self.fetch(batch)
+                    for inst in batch:
+                        if not pending[inst].done():
+                            pending[inst].set_result(data.get(inst))
+                except Exception as e:
+                    for inst in batch:
+                        if not pending[inst].done():
+                            pending[inst].set_exception(e)
+
+
+class AsyncKiteService:
+    """
+    Asyncio-native Kite Connect client. Uses one pooled keep-alive HTTP session, per
+    endpoint-group token buckets matching the broker's request rates, jittered
+    exponential backoff on transient failures and a coalescing queue for quotes.
+    Method names mirror KiteService so callers can switch with `await`.
+    """
+
+    def __init__(self, api_key=None, access_token=None, root=KITE_ROOT_URL, max_retries=3, timeout=7.0,
+                 transport=None):
+        self.api_key = api_key or os.getenv("KITE_API_KEY")
+        self.access_token = access_token or token_manager.get_token()
+        self.root = root
+        self.max_retries = max_retries
+        self.timeout = timeout
+        # Optional httpx transport, e.g. httpx.ASGITransport(mock_broker.app) to run against the mock in-process
+        self.transport = transport
+        self.limiters = {group: TokenBucket(rate) for group, rate in RATE_LIMITS.items()}
+        self.quotes = QuoteCoalescer(self._fetch_quotes)
+        self.instrument_master = InstrumentMaster("NFO")
+        self._client = None
+        token_manager.subscribe(self.set_access_token)
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.root,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+                headers={"X-Kite-Version": "3"},
+                transport=self.transport
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method, path, group="default", params=None):
+        """
+        Rate-limited request with retries. Kite API errors are raised as the matching
+        kiteconnect exception (e.g. TokenException) so callers handle both clients alike.
+        """
+        headers = {}
+        if self.api_key and self.access_token:
+            headers["Authorization"] = f"token {self.api_key}:{self.access_token}"
+
+        limiter = self.limiters.get(group, self.limiters["default"])
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            try:
+                response = await self.client.request(method, path, params=params, headers=headers)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise kiteconnect.exceptions.NetworkException(str(e))
+                await self._backoff(attempt)
+                continue
+
+            if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                logging.warning(f"Kite {path} returned {response.status_code}, retrying (attempt {attempt + 1})")
+                await self._backoff(attempt)
+                continue
+
+            return self._parse(response)
+
+    async def _backoff(self, attempt):
+        # Full jitter: sleep uniformly in [0, base * 2^attempt]
+        await asyncio.sleep(random.uniform(0, 0.25 * (2 ** attempt)))
+
+    def _parse(self, response):
+        content_type = response.headers.get("content-type", "")
+        if "json" in content_type:
+            data = response.json()
+            if data.get("status") == "error" or data.get("error_type"):
+                exc = getattr(kiteconnect.exceptions, data.get("error_type") or "", kiteconnect.exceptions.GeneralException)
+                raise exc(data.get("message", "Unknown error"), code=response.status_code)
+            return data["data"]
+        if "csv" in content_type:
+            return response.text
+        raise kiteconnect.exceptions.DataException(f"Unknown Content-Type ({content_type})")
+
+    async def _fetch_quotes(self, instruments):
+        return await self._request("GET", "/quote", group="quote", params=[("i", inst) for inst in instruments])
+
+    async def quote(self, instruments):
+        return await self.quotes.quote(list(instruments))
+
+    async def get_ltp(self, instruments):
+        """Async counterpart of KiteService.get_ltp (bare symbols default to NSE)."""
+        formatted = [inst if ":" in inst else f"NSE:{inst}" for inst in instruments]
+        return await self.quote(formatted)
+
+    async def instruments(self, exchange="NFO"):
+        raw = await self._request("GET", f"/instruments/{exchange}")
+        return parse_instruments_csv(raw)
+
+    async def get_positions(self):
+        positions = await self._request("GET", "/portfolio/positions")
+        return positions.get("net", [])
+
+    async def get_option_chain(self, symbol, current_price, range_min, range_max, expiry=None):
+        """Async counterpart of KiteService.get_option_chain, sharing the daily instrument cache."""
+        if not self.instrument_master.is_fresh():
+            self.instrument_master.load(await self.instruments("NFO"))
+
+        symbol_instruments = [inst for inst in self.instrument_master.options_for(symbol)
+                              if range_min <= inst['strike'] <= range_max]
+        if not symbol_instruments:
+            return OptionChain(symbol=symbol)
+
+        current_expiry = min(inst['expiry'] for inst in symbol_instruments) if expiry is None else expiry
+        active_options = [inst for inst in symbol_instruments if inst['expiry'] == current_expiry]
+        if not active_options:
+            return OptionChain(symbol=symbol)
+        quotes = await self.quote([f"NFO:{inst['tradingsymbol']}" for inst in active_options])
+
+        strike_map = {}
+        for inst in active_options:
+            strike = inst['strike']
+            price = quotes.get(f"NFO:{inst['tradingsymbol']}", {}).get("last_price", 0)
+            row = strike_map.setdefault(strike, {"strike": strike, "ce_price": 0, "pe_price": 0})
+            row['ce_price' if inst['instrument_type'] == 'CE' else 'pe_price'] = price
+
+        spec = self.instrument_master.specs_for([symbol])[symbol]
+        return OptionChain(sorted(strike_map.values(), key=lambda x: x['strike']),
+                           symbol=symbol, expiry=current_expiry, **spec)
+
+
+def parse_instruments_csv(raw):
+    """Parses the Kite instrument dump CSV with the same typing as KiteConnect.instruments()."""
+    records = []
+    for row in csv.DictReader(StringIO(raw.strip())):
+        row["instrument_token"] = int(row["instrument_token"])
+        row["last_price"] = float(row["last_price"] or 0)
+        row["strike"] = float(row["strike"] or 0)
+        row["tick_size"] = float(row["tick_size"] or 0)
+        row["lot_size"] = int(row["lot_size"] or 0)
+        row["expiry"] = date.fromisoformat(row["expiry"]) if len(row["expiry"]) == 10 else None
+        records.append(row)
+    return records
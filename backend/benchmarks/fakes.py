@@ -0,0 +1,136 @@
+"""
+In-process stand-ins for the upstreams: a KiteConnect-shaped FakeKite over a
+SyntheticMarket, and a fake `yfinance` module installed into sys.modules.
+Both can inject latency so end-to-end runs see realistic upstream costs.
+"""
+import sys
+import time
+import types
+import random
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from synthetic import price_history
+
+HEADLINES = [
+    "{name} beats estimates as quarterly profit rises",
+    "{name} shares slip after weak guidance",
+    "Brokerages stay bullish on {name} ahead of earnings",
+    "{name} announces dividend, board approves buyback",
+    "Regulator probe weighs on {name}",
+    "{name} gains on strong order book",
+    "Analysts see limited upside for {name}",
+]
+
+
+class UpstreamCounter:
+    """Counts calls per upstream endpoint; shared by the fakes for per-request accounting."""
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def hit(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+
+
+class FakeKite:
+    """Implements the subset of KiteConnect used by KiteService."""
+
+    def __init__(self, market, latency_ms=0.0, counter=None):
+        self.market = market
+        self.latency_ms = latency_ms
+        self.counter = counter or UpstreamCounter()
+
+    def _wait(self, name):
+        self.counter.hit(f"kite.{name}")
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0 * random.uniform(0.5, 1.5))
+
+    def set_access_token(self, access_token):
+        pass
+
+    def instruments(self, exchange=None):
+        self._wait("instruments")
+        return [dict(inst) for inst in self.market.instruments]
+
+    def quote(self, instruments):
+        self._wait("quote")
+        if isinstance(instruments, str):
+            instruments = [instruments]
+        return self.market.quote(instruments)
+
+    def positions(self):
+        self._wait("positions")
+        return self.market.positions()
+
+
+def install_fake_yfinance(market, latency_ms=0.0, counter=None, seed=11):
+    """Registers a fake `yfinance` module; the app's deferred imports pick it up."""
+    counter = counter or UpstreamCounter()
+    rng = random.Random(seed)
+    module = types.ModuleType("yfinance")
+
+    def _wait(name):
+        counter.hit(f"yfinance.{name}")
+        if latency_ms:
+            time.sleep(latency_ms / 1000.0 * random.uniform(0.5, 1.5))
+
+    def _last_price(symbol):
+        base = symbol.replace(".NS", "")
+        if base in market.spots:
+            return market.spots[base]
+        if symbol == "^NSEI":
+            return market.spots.get("NIFTY 50", 22000.0)
+        if symbol == "^NSEBANK":
+            return market.spots.get("NIFTY BANK", 47000.0)
+        return 15.0 if symbol == "^INDIAVIX" else 1000.0
+
+    def _frame(symbol, bars):
+        closes = price_history(rng, _last_price(symbol), bars)
+        end = datetime.now().replace(second=0, microsecond=0)
+        index = pd.DatetimeIndex([end - timedelta(minutes=15 * (bars - 1 - i)) for i in range(bars)])
+        return pd.DataFrame({"Open": closes, "High": closes, "Low": closes, "Close": closes, "Volume": 0}, index=index)
+
+    class Ticker:
+        def __init__(self, symbol):
+            self.symbol = symbol
+
+        @property
+        def news(self):
+            _wait("news")
+            name = self.symbol.replace(".NS", "")
+            picks = rng.sample(HEADLINES, 5)
+            return [{"title": template.format(name=name)} for template in picks]
+
+        def history(self, period="5d", interval="15m"):
+            _wait("history")
+            return _frame(self.symbol, 2 if period == "2d" else 120)
+
+        @property
+        def calendar(self):
+            _wait("calendar")
+            return None
+
+    def download(tickers, period="5d", interval="15m", group_by="column", **kwargs):
+        _wait("download")
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        frames = {ticker: _frame(ticker, 2 if period == "2d" else 120) for ticker in tickers}
+        return pd.concat(frames, axis=1)
+
+    module.Ticker = Ticker
+    module.download = download
+    module._fake = True
+    sys.modules["yfinance"] = module
+    return module
@@ -0,0 +1,74 @@
+"""
+Import-time budget check for the API module.
+
+    python benchmarks/import_budget.py [--budget-ms 1500] [--module main]
+
+Imports the module in a fresh interpreter with `-X importtime`, fails if the cumulative
+import time exceeds the budget or if any dependency that must stay deferred (Selenium,
+yfinance, TextBlob/nltk, pandas) was pulled in at import time. The same check runs
+under pytest as tests/test_import_budget.py.
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED_MODULES = ["selenium", "webdriver_manager", "yfinance", "textblob", "nltk", "pandas", "generate_token"]
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module, runs=3):
+    """Best-of-N cumulative import time (ms) and the set of modules imported."""
+    best_ms, imported = None, set()
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=BACKEND_DIR, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+        total_us, names = 0, set()
+        for line in proc.stderr.splitlines():
+            match = _IMPORT_LINE.match(line)
+            if not match:
+                continue
+            names.add(match.group(4))
+            if match.group(4) == module and not match.group(3).strip(" "):
+                total_us = int(match.group(2))
+        ms = total_us / 1000.0
+        if best_ms is None or ms < best_ms:
+            best_ms, imported = ms, names
+    return best_ms, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    elapsed_ms, imported = measure(args.module, args.runs)
+    leaked = sorted(name for name in DEFERRED_MODULES if name in imported)
+
+    print(f"import {args.module}: {elapsed_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    failed = False
+    if elapsed_ms > args.budget_ms:
+        print(f"FAIL: import time over budget by {elapsed_ms - args.budget_ms:.0f} ms")
+        failed = True
+    if leaked:
+        print(f"FAIL: deferred dependencies imported eagerly: {', '.join(leaked)}")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
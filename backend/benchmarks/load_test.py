@@ -0,0 +1,246 @@
+"""
+Load test: replays a recorded /analyze + /positions request mix at increasing concurrency.
+
+    python benchmarks/load_test.py                                  # bundled dashboard mix
+    python benchmarks/load_test.py --concurrency 1,8,32 --duration 20
+    python benchmarks/load_test.py --mix requests.jsonl --kite-latency-ms 60 --news-latency-ms 400
+    python benchmarks/load_test.py --target http://localhost:8000   # a running instance
+
+Mixes are JSON lines of {"method", "path", "query", "body"}, as written by the app itself
+with REQUEST_LOG_FILE set (see metrics.py). By default the real app is served by an
+in-process uvicorn on a free port, with KiteService wired to FakeKite and yfinance
+replaced by the fake, both with injected latency. Each concurrency level runs that many
+closed-loop users, each replaying the mix from its own offset (optionally with think
+time) and revalidating with If-None-Match like the dashboard does.
+
+Reports throughput, p50/p95/p99 overall and per request kind, errors, and upstream calls
+per request (in-process only), so caching and batching changes can be measured end to end.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# Keep instrument/token caches out of the working tree, and keep background jobs that
+# would call the fake upstreams on their own out of the measurement
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="optrec-load-"))
+os.environ.setdefault("EVENT_CALENDAR", "0")
+
+import httpx  # noqa: E402
+
+from synthetic import SyntheticMarket  # noqa: E402
+from fakes import UpstreamCounter  # noqa: E402
+from run import wire_app, percentile  # noqa: E402
+
+DEFAULT_MIX = os.path.join(BENCH_DIR, "mixes", "dashboard.jsonl")
+
+
+def load_mix(path):
+    """The recorded requests, in order (only /analyze and /positions are replayed)."""
+    mix = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry["path"] in ("/analyze", "/positions"):
+                entry["kind"] = request_kind(entry)
+                mix.append(entry)
+    if not mix:
+        raise SystemExit(f"No /analyze or /positions requests in {path}")
+    return mix
+
+
+def request_kind(entry):
+    """Reporting bucket: method and path, with forced recomputes of /analyze kept apart."""
+    kind = f"{entry['method']} {entry['path']}"
+    try:
+        if entry.get("body") and json.loads(entry["body"]).get("force_refresh"):
+            kind += " (force)"
+    except (ValueError, AttributeError):
+        pass
+    return kind
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(app):
+    """Starts uvicorn for `app` on a background thread; returns (base_url, server)."""
+    import uvicorn
+
+    port = free_port()
+    # Singletons are wired by wire_app, so startup/shutdown hooks stay off
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           lifespan="off", access_log=False))
+    threading.Thread(target=server.run, name="load-test-server", daemon=True).start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise SystemExit("uvicorn did not start")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+class User(threading.Thread):
+    """One closed-loop dashboard user replaying the mix from `offset`."""
+
+    def __init__(self, base_url, mix, offset, stop_at, think_s, etags, results):
+        super().__init__(daemon=True)
+        self.client = httpx.Client(base_url=base_url, timeout=60.0,
+                                   headers={"Accept-Encoding": "gzip"})
+        self.mix = mix
+        self.position = offset
+        self.stop_at = stop_at
+        self.think_s = think_s
+        self.etags = {} if etags else None
+        self.results = results
+
+    def run(self):
+        try:
+            while time.perf_counter() < self.stop_at:
+                entry = self.mix[self.position % len(self.mix)]
+                self.position += 1
+                self.results.append(self.send(entry))
+                if self.think_s:
+                    time.sleep(self.think_s)
+        finally:
+            self.client.close()
+
+    def send(self, entry):
+        url = entry["path"] + (f"?{entry['query']}" if entry.get("query") else "")
+        headers = {}
+        cache_key = (entry["method"], url, entry.get("body"))
+        if self.etags is not None and cache_key in self.etags:
+            headers["If-None-Match"] = self.etags[cache_key]
+        if entry.get("body"):
+            headers["Content-Type"] = "application/json"
+
+        start = time.perf_counter()
+        try:
+            response = self.client.request(entry["method"], url, content=entry.get("body"), headers=headers)
+            status = response.status_code
+            if self.etags is not None and response.headers.get("etag"):
+                self.etags[cache_key] = response.headers["etag"]
+        except httpx.HTTPError:
+            status = 0
+        return entry["kind"], status, (time.perf_counter() - start) * 1000.0
+
+
+def summarize(samples, elapsed):
+    latencies = [ms for _, _, ms in samples]
+    errors = sum(1 for _, status, _ in samples if status == 0 or status >= 400)
+    return {
+        "requests": len(samples),
+        "throughput_per_s": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "errors": errors,
+        "not_modified": sum(1 for _, status, _ in samples if status == 304),
+    }
+
+
+def run_level(base_url, mix, concurrency, duration, think_s, etags, counter):
+    """Runs `concurrency` users for `duration` seconds; returns the level's report."""
+    results = []
+    if counter:
+        counter.reset()
+    stop_at = time.perf_counter() + duration
+    step = max(len(mix) // concurrency, 1)
+    users = [User(base_url, mix, i * step, stop_at, think_s, etags, results) for i in range(concurrency)]
+    start = time.perf_counter()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - start
+
+    report = {"concurrency": concurrency, **summarize(results, elapsed), "kinds": {}}
+    for kind in sorted({kind for kind, _, _ in results}):
+        report["kinds"][kind] = summarize([s for s in results if s[0] == kind], elapsed)
+    if counter:
+        calls = counter.snapshot()
+        report["upstream_calls_per_request"] = {
+            name: round(count / max(len(results), 1), 3) for name, count in sorted(calls.items())
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\nconcurrency {report['concurrency']}: {report['requests']} requests, "
+          f"{report['throughput_per_s']:.1f} req/s, {report['errors']} errors, {report['not_modified']} not modified")
+    print(f"  {'kind':30} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    rows = [("all", report)] + list(report["kinds"].items())
+    for kind, r in rows:
+        print(f"  {kind:30} {r['throughput_per_s']:>8.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {r['errors']:>7}")
+    calls = report.get("upstream_calls_per_request")
+    if calls:
+        print("  upstream calls/request: " + ", ".join(f"{name} {value:g}" for name, value in calls.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="recorded request mix (JSON lines)")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrent users per level")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of single-user traffic before measuring")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause between a user's requests")
+    parser.add_argument("--no-etags", action="store_true", help="do not revalidate with If-None-Match")
+    parser.add_argument("--target", help="base URL of a running instance instead of the in-process app")
+    parser.add_argument("--kite-latency-ms", type=float, default=40.0, help="injected latency per fake Kite call")
+    parser.add_argument("--news-latency-ms", type=float, default=250.0, help="injected latency per fake yfinance call")
+    parser.add_argument("--strikes", type=int, default=40, help="strikes on each side of ATM")
+    parser.add_argument("--expiries", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_out", help="also write the reports to this file")
+    args = parser.parse_args()
+
+    mix = load_mix(args.mix)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    etags = not args.no_etags
+    think_s = args.think_ms / 1000.0
+
+    counter = None
+    server = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        counter = UpstreamCounter()
+        market = SyntheticMarket(strikes_per_side=args.strikes, expiry_count=args.expiries, seed=args.seed)
+        app = wire_app(market, args.kite_latency_ms, args.news_latency_ms, counter)
+        base_url, server = serve(app)
+
+    print(f"{len(mix)} requests in mix from {args.mix}; target {base_url}")
+    if args.warmup:
+        run_level(base_url, mix, 1, args.warmup, 0.0, etags, counter)
+
+    reports = []
+    for level in levels:
+        report = run_level(base_url, mix, level, args.duration, think_s, etags, counter)
+        print_report(report)
+        reports.append(report)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"mix": args.mix, "target": base_url, "levels": reports}, f, indent=2)
+    if server:
+        server.should_exit = True
+    return 1 if any(report["errors"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Reproducible benchmark suite.
+
+    python benchmarks/run.py                      # run and compare against baselines.json
+    python benchmarks/run.py --update-baseline    # record new baselines
+    python benchmarks/run.py --filter engine --strikes 80 --expiries 4
+
+Runs the strategy engines and the /analyze and /positions endpoints against a seeded
+SyntheticMarket served through an in-process fake Kite and a fake yfinance module, then
+reports throughput and mean/p50/p99 latency. Exits non-zero if any case's p50 or mean
+regresses past the tolerance relative to the stored baseline; p99 is reported only, since
+at these iteration counts it is effectively the slowest sample (one GC pass moves it). Baselines are machine-specific: record
+them on the host that runs the comparison.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# Keep instrument/token caches out of the working tree
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="optrec-bench-"))
+
+from synthetic import SyntheticMarket  # noqa: E402
+from fakes import FakeKite, install_fake_yfinance  # noqa: E402
+
+BASELINE_FILE = os.path.join(BENCH_DIR, "baselines.json")
+STRATEGIES = ["Bull Call", "Bear Put", "Bear Call", "Bull Put", "Long Straddle"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure(func, iterations, warmup):
+    for i in range(warmup):
+        func(i)
+    samples = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "throughput_per_s": round(iterations / elapsed, 2),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "p50_ms": round(percentile(samples, 50), 4),
+        "p99_ms": round(percentile(samples, 99), 4),
+    }
+
+
+def build_cases(market, args):
+    from strategy_engine import calculate_strategy
+    from advanced_analyzer import AdvancedOptionsAnalyzer
+    from probability_engine import probability_engine
+
+    analyzer = AdvancedOptionsAnalyzer()
+    nifty = market.chain("NIFTY")
+    banknifty = market.chain("BANKNIFTY")
+    nifty_spot = market.spot_for("NIFTY")
+    bank_spot = market.spot_for("BANKNIFTY")
+
+    cases = {
+        "engine.calculate_strategy": lambda i: calculate_strategy(
+            STRATEGIES[i % len(STRATEGIES)], nifty, nifty_spot, symbol="NIFTY"),
+        "engine.analyze_regime": lambda i: analyzer.analyze_regime(nifty_spot, nifty, symbol="NIFTY"),
+        "engine.seller.bull_put": lambda i: analyzer.recommend_seller_strategy(1, nifty_spot, nifty, symbol="NIFTY"),
+        "engine.seller.bear_call": lambda i: analyzer.recommend_seller_strategy(-1, nifty_spot, nifty, symbol="NIFTY"),
+        "engine.seller.iron_condor": lambda i: analyzer.recommend_seller_strategy(0, nifty_spot, nifty, symbol="NIFTY"),
+        "engine.seller.iron_condor_banknifty": lambda i: analyzer.recommend_seller_strategy(
+            0, bank_spot, banknifty, symbol="BANKNIFTY"),
+    }
+
+    # 5000 random condors around NIFTY, scored by each probability model
+    rng = np.random.default_rng(args.seed)
+    short_put = nifty_spot - rng.integers(1, 20, 5000) * 50
+    short_call = nifty_spot + rng.integers(1, 20, 5000) * 50
+    condor_strikes = np.column_stack([short_put, short_put - 500, short_call, short_call + 500])
+    condor_types = np.tile(["PE", "PE", "CE", "CE"], (5000, 1))
+    condor_qty = np.tile([-1, 1, -1, 1], (5000, 1))
+    condor_credit = rng.uniform(20, 120, 5000)
+    for model in ("lognormal", "montecarlo"):
+        cases[f"engine.probability.{model}"] = lambda i, model=model: probability_engine.evaluate(
+            nifty_spot, 7 / 365.0, condor_strikes, condor_types, condor_qty, condor_credit, model=model)
+
+    # One scan's worth of uncached headlines (200) through the configured sentiment backend
+    from sentiment_models import create_backend
+    from fakes import HEADLINES
+    backend = create_backend()
+    headlines = [template.format(name=f"{name} {n}") for n in range(6)
+                 for name in market.underlyings for template in HEADLINES][:200]
+    cases["engine.sentiment.score_200"] = lambda i: backend.score(headlines)
+
+    if not args.skip_api:
+        client, stocks = build_api_client(market, args)
+        # force_refresh measures the full pipeline; api.analyze_cached the result-cache hit
+        payload = {"stocks": stocks, "strategy": "Bull Put", "force_refresh": True}
+        cached_payload = {"stocks": stocks, "strategy": "Bull Put"}
+
+        def analyze(i):
+            response = client.post("/analyze", json=payload)
+            assert response.status_code == 200, response.text
+
+        def analyze_cached(i):
+            response = client.post("/analyze", json=cached_payload)
+            assert response.status_code == 200, response.text
+
+        def positions(i):
+            response = client.get("/positions")
+            assert response.status_code == 200, response.text
+
+        cases["api.analyze"] = analyze
+        cases["api.analyze_cached"] = analyze_cached
+        cases["api.positions"] = positions
+    return cases
+
+
+def wire_app(market, kite_latency_ms=0.0, news_latency_ms=0.0, counter=None):
+    """The real app, with KiteService wired to FakeKite and yfinance replaced by the fake."""
+    install_fake_yfinance(market, latency_ms=news_latency_ms, counter=counter)
+
+    import kite_service
+    import main
+
+    service = kite_service.KiteService()
+    service.kite = FakeKite(market, latency_ms=kite_latency_ms, counter=counter)
+    kite_service._kite_service = service
+    return main.app
+
+
+def build_api_client(market, args):
+    from fastapi.testclient import TestClient
+
+    app = wire_app(market, args.upstream_latency_ms, args.upstream_latency_ms)
+    client = TestClient(app)
+    stocks = [name for name in market.underlyings if name not in ("NIFTY", "BANKNIFTY")][:args.stocks]
+    return client, stocks
+
+
+def compare(results, baselines, tolerance):
+    """Returns a list of human-readable regressions in p50 or mean latency past `tolerance`."""
+    regressions = []
+    for name, result in results.items():
+        base = baselines.get(name)
+        if not base:
+            continue
+        for key in ("p50_ms", "mean_ms"):
+            # Ignore sub-50µs noise on very fast cases
+            limit = base[key] * (1 + tolerance) + 0.05
+            if result[key] > limit:
+                regressions.append(f"{name}: {key} {result[key]:.3f} ms > {limit:.3f} ms (baseline {base[key]:.3f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--strikes", type=int, default=40, help="strikes on each side of ATM")
+    parser.add_argument("--expiries", type=int, default=3)
+    parser.add_argument("--skew", type=float, default=-0.25)
+    parser.add_argument("--stocks", type=int, default=5, help="stocks per /analyze request")
+    parser.add_argument("--upstream-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--filter", default="", help="only run cases containing this substring")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("BENCH_TOLERANCE", "0.5")))
+    parser.add_argument("--json", dest="json_out", help="also write results to this file")
+    args = parser.parse_args()
+
+    market = SyntheticMarket(strikes_per_side=args.strikes, expiry_count=args.expiries,
+                             skew=args.skew, seed=args.seed)
+    cases = {name: func for name, func in build_cases(market, args).items() if args.filter in name}
+
+    results = {}
+    print(f"{'case':42} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, func in cases.items():
+        results[name] = measure(func, args.iterations, args.warmup)
+        r = results[name]
+        print(f"{name:42} {r['throughput_per_s']:>10.1f} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        baselines = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baselines = json.load(f)
+        baselines.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baselines written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline file; run with --update-baseline to create one.")
+        return
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
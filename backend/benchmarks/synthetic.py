@@ -0,0 +1,147 @@
+"""
+Synthetic, seeded market data for benchmarks: option chains with a volatility skew over
+several expiries, an instrument dump in the kite.instruments() shape and open positions.
+"""
+import math
+import random
+from datetime import date, timedelta
+
+import numpy as np
+
+from risk_engine import bs_greeks, option_symbol
+from instrument_master import OptionChain
+
+# underlying -> (spot symbol on NSE, spot price, strike step, lot size)
+DEFAULT_UNDERLYINGS = {
+    "NIFTY": ("NIFTY 50", 22000.0, 50, 25),
+    "BANKNIFTY": ("NIFTY BANK", 47000.0, 100, 15),
+    "RELIANCE": ("RELIANCE", 2900.0, 20, 250),
+    "TCS": ("TCS", 3900.0, 50, 175),
+    "INFY": ("INFY", 1650.0, 20, 400),
+    "HDFCBANK": ("HDFCBANK", 1500.0, 10, 550),
+    "SBIN": ("SBIN", 760.0, 5, 1500),
+}
+
+
+def skewed_iv(spot, strikes, atm_iv=0.16, skew=-0.25, smile=0.8):
+    """Quadratic smile in log-moneyness: downside skew plus wing curvature."""
+    k = np.log(np.asarray(strikes, dtype=float) / spot)
+    return np.maximum(atm_iv + skew * k + smile * k ** 2, 0.05)
+
+
+class SyntheticMarket:
+    """
+    Deterministic market snapshot. Everything is generated from `seed`, so two runs with
+    the same configuration see exactly the same chains and positions.
+    """
+
+    def __init__(self, underlyings=None, strikes_per_side=40, expiry_count=3, atm_iv=0.16,
+                 skew=-0.25, smile=0.8, seed=42, today=None):
+        self.underlyings = underlyings or DEFAULT_UNDERLYINGS
+        self.strikes_per_side = strikes_per_side
+        self.atm_iv = atm_iv
+        self.skew = skew
+        self.smile = smile
+        self.rng = random.Random(seed)
+        self.today = today or date.today()
+        first = self.today + timedelta(days=(3 - self.today.weekday()) % 7 or 7)
+        self.expiries = [first + timedelta(weeks=i) for i in range(expiry_count)]
+        self.spots = {spot_symbol: spot for spot_symbol, spot, _, _ in self.underlyings.values()}
+        self.instruments = self._build_instruments()
+        self.by_symbol = {f"NFO:{inst['tradingsymbol']}": inst for inst in self.instruments}
+        self._prices = self._price_all()
+
+    def spot_for(self, name):
+        return self.spots[self.underlyings[name][0]]
+
+    def _strikes(self, name):
+        _, spot, step, _ = self.underlyings[name]
+        atm = round(spot / step) * step
+        return [atm + i * step for i in range(-self.strikes_per_side, self.strikes_per_side + 1)]
+
+    def _build_instruments(self):
+        records = []
+        token = 100000
+        for name, (_, _, _, lot_size) in self.underlyings.items():
+            for expiry in self.expiries:
+                for strike in self._strikes(name):
+                    for opt_type in ("CE", "PE"):
+                        token += 1
+                        records.append({
+                            "instrument_token": token,
+                            "exchange_token": str(token // 256),
+                            "tradingsymbol": option_symbol(name, expiry, strike, opt_type),
+                            "name": name,
+                            "last_price": 0.0,
+                            "expiry": expiry,
+                            "strike": float(strike),
+                            "tick_size": 0.05,
+                            "lot_size": lot_size,
+                            "instrument_type": opt_type,
+                            "segment": "NFO-OPT",
+                            "exchange": "NFO",
+                        })
+        return records
+
+    def _price_all(self):
+        """Prices every contract once, vectorized, rounded to the tick."""
+        spot = np.array([self.spot_for(inst["name"]) for inst in self.instruments])
+        strike = np.array([inst["strike"] for inst in self.instruments])
+        t = np.array([max((inst["expiry"] - self.today).days, 1) for inst in self.instruments]) / 365.0
+        is_call = np.array([inst["instrument_type"] == "CE" for inst in self.instruments])
+        iv = skewed_iv(spot, strike, self.atm_iv, self.skew, self.smile) * (1 + 0.1 * np.sqrt(t))
+        prices = np.maximum(np.round(bs_greeks(spot, strike, t, iv, is_call)["price"] * 20) / 20, 0.05)
+        return {f"NFO:{inst['tradingsymbol']}": float(p) for inst, p in zip(self.instruments, prices)}
+
+    def quote(self, instruments):
+        data = {}
+        for inst in instruments:
+            exchange, _, symbol = inst.partition(":")
+            if exchange == "NSE" and symbol in self.spots:
+                price = self.spots[symbol]
+            elif inst in self._prices:
+                price = self._prices[inst]
+            else:
+                continue
+            data[inst] = {"last_price": price, "ohlc": {"open": price, "high": price, "low": price, "close": price}}
+        return data
+
+    def chain(self, name, expiry_index=0):
+        """Nearest-expiry chain in the shape KiteService.get_option_chain returns."""
+        expiry = self.expiries[expiry_index]
+        rows = {}
+        for inst in self.instruments:
+            if inst["name"] != name or inst["expiry"] != expiry:
+                continue
+            row = rows.setdefault(inst["strike"], {"strike": inst["strike"], "ce_price": 0, "pe_price": 0})
+            row["ce_price" if inst["instrument_type"] == "CE" else "pe_price"] = self._prices[f"NFO:{inst['tradingsymbol']}"]
+        _, _, _, lot_size = self.underlyings[name]
+        return OptionChain(sorted(rows.values(), key=lambda r: r["strike"]), symbol=name, expiry=expiry, lot_size=lot_size)
+
+    def positions(self, count=20):
+        """Net positions across the universe, alternating short and long legs."""
+        picks = self.rng.sample(self.instruments, min(count, len(self.instruments)))
+        net = []
+        for i, inst in enumerate(picks):
+            ltp = self._prices[f"NFO:{inst['tradingsymbol']}"]
+            qty = inst["lot_size"] * (-1 if i % 2 == 0 else 1) * self.rng.randint(1, 3)
+            avg = round(ltp * self.rng.uniform(0.7, 1.3), 2)
+            net.append({
+                "tradingsymbol": inst["tradingsymbol"],
+                "instrument_token": inst["instrument_token"],
+                "exchange": "NFO",
+                "product": "NRML",
+                "quantity": qty,
+                "average_price": avg,
+                "last_price": ltp,
+                "pnl": round((ltp - avg) * qty, 2),
+            })
+        return {"net": net, "day": []}
+
+
+def price_history(rng, last_price, bars=120, vol_per_bar=0.002):
+    """Random-walk closes ending near last_price (for fake yfinance history)."""
+    closes = [last_price]
+    for _ in range(bars - 1):
+        closes.append(closes[-1] / math.exp(rng.gauss(0, vol_per_bar)))
+    return list(reversed(closes))
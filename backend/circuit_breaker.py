@@ -0,0 +1,185 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from shared_cache import get_shared_cache
+from metrics import registry
+
+# Consecutive failures (errors or timeouts) that open a breaker
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+# Seconds an open breaker fails fast before letting one probe call through (half-open)
+BREAKER_RESET_SEC = float(os.getenv("BREAKER_RESET_SEC", "30"))
+# Upstream calls in flight per breaker; calls beyond this queue and count against the timeout
+BREAKER_MAX_CONCURRENCY = int(os.getenv("BREAKER_MAX_CONCURRENCY", "16"))
+# How long the last good response of each call is kept as the degraded-mode fallback
+LAST_GOOD_TTL_SEC = float(os.getenv("LAST_GOOD_TTL_SEC", str(24 * 3600)))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = registry.gauge("optrec_breaker_state", "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open).")
+BREAKER_CALLS = registry.counter("optrec_breaker_calls_total", "Upstream calls through a circuit breaker, by result.")
+STALE_SERVED = registry.counter("optrec_stale_served_total", "Last-good values served in place of a failed upstream call.")
+
+# Upstreams that served a stale value during the current unit of work (see stale_tracking)
+_stale_upstreams = ContextVar("stale_upstreams", default=None)
+
+# Every breaker by upstream name, for health reporting
+BREAKERS = {}
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was rejected by an open breaker, timed out or failed."""
+
+
+@contextmanager
+def stale_tracking():
+    """Collects the names of the upstreams that fell back to a last-good value inside the block."""
+    served = set()
+    token = _stale_upstreams.set(served)
+    try:
+        yield served
+    finally:
+        _stale_upstreams.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Guards one upstream (Kite, yfinance). Each call runs on the breaker's own small thread
+    pool and is abandoned after `timeout` seconds, so a hung upstream costs a request at most
+    the timeout. After `failure_threshold` consecutive failures the breaker opens and calls
+    fail immediately; once `reset_timeout` has passed a single probe call is let through
+    (half-open) and its outcome closes or re-opens the breaker.
+
+    Exceptions in `ignore` (e.g. an expired token) are the caller's to handle: they propagate
+    unchanged and do not count as upstream failures.
+
+    remember()/last_good() keep each call's last good response in the shared cache, so
+    callers can degrade to it (marked stale) while the upstream is down.
+    """
+
+    def __init__(self, name, timeout, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_SEC,
+                 max_concurrency=BREAKER_MAX_CONCURRENCY, ignore=()):
+        self.name = name
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.ignore = tuple(ignore)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"upstream-{name}")
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        BREAKERS[name] = self
+        BREAKER_STATE.set(0, upstream=name)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def _set_state(self, state):
+        if state != self._state:
+            logging.warning(f"Circuit breaker '{self.name}': {self._state} -> {state}")
+        self._state = state
+        BREAKER_STATE.set(STATE_VALUES[state], upstream=self.name)
+
+    def _admit(self):
+        """Whether a call may go upstream now; in half-open only one probe at a time."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def _record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._failures = 0
+                self._set_state(CLOSED)
+                return
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def call(self, func, *args, timeout=None, **kwargs):
+        """
+        func(*args, **kwargs) under the breaker, within `timeout` seconds (default: the
+        breaker's); raises UpstreamUnavailable when it cannot be served.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not self._admit():
+            BREAKER_CALLS.inc(upstream=self.name, result="rejected")
+            raise UpstreamUnavailable(f"{self.name} circuit is open")
+
+        future = self._executor.submit(func, *args, **kwargs)
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._record(False)
+            BREAKER_CALLS.inc(upstream=self.name, result="timeout")
+            raise UpstreamUnavailable(f"{self.name} call timed out after {timeout:g}s")
+        except self.ignore:
+            # Not the upstream's fault; release a half-open probe slot without a verdict
+            with self._lock:
+                self._probing = False
+            BREAKER_CALLS.inc(upstream=self.name, result="ignored")
+            raise
+        except Exception as e:
+            self._record(False)
+            BREAKER_CALLS.inc(upstream=self.name, result="error")
+            raise UpstreamUnavailable(f"{self.name} call failed: {e}") from e
+
+        self._record(True)
+        BREAKER_CALLS.inc(upstream=self.name, result="ok")
+        return result
+
+    def remember(self, values):
+        """Stores {key: value} as the last good responses for later degraded reads."""
+        if values:
+            get_shared_cache().set_many({f"lastgood:{self.name}:{key}": value for key, value in values.items()},
+                                        LAST_GOOD_TTL_SEC)
+
+    def last_good(self, keys):
+        """{key: value} for the keys with a remembered value; marks the current work stale if any."""
+        prefix = f"lastgood:{self.name}:"
+        found = get_shared_cache().get_many([prefix + key for key in keys])
+        values = {key[len(prefix):]: value for key, value in found.items()}
+        if values:
+            STALE_SERVED.inc(len(values), upstream=self.name)
+            served = _stale_upstreams.get()
+            if served is not None:
+                served.add(self.name)
+        return values
+
+    def call_with_fallback(self, key, func, *args, **kwargs):
+        """call() for a single-valued response; on failure the last good value for `key`, else re-raises."""
+        try:
+            result = self.call(func, *args, **kwargs)
+        except UpstreamUnavailable:
+            fallback = self.last_good([key])
+            if key in fallback:
+                logging.warning(f"{self.name} unavailable; serving last good '{key}'")
+                return fallback[key]
+            raise
+        self.remember({key: result})
+        return result
+
+
+def breaker_states():
+    """{upstream: state} for every breaker."""
+    return {name: breaker.state for name, breaker in BREAKERS.items()}
@@ -0,0 +1,266 @@
+import os
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from instrument_master import CACHE_DIR, INDEX_SPOT_SYMBOLS, spot_symbol
+from shared_cache import get_shared_cache
+from token_manager import IST
+from market_data import yf_symbol, yfinance_breaker
+from trading_calendar import trading_calendar
+import session_replay
+from metrics import timer
+
+RBI_POLICY_FILE = os.getenv(
+    "RBI_POLICY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rbi_policy_dates.json")
+)
+# Parallel yfinance calendar requests during the daily bulk refresh
+EVENT_FETCH_CONCURRENCY = int(os.getenv("EVENT_FETCH_CONCURRENCY", "8"))
+# Time of day (IST) the background refresh rebuilds the calendar
+EVENT_REFRESH_HOUR_IST = 7
+
+# Events that apply to every underlying are stored under this symbol
+MARKET_WIDE = "*"
+EVENT_TYPES = ("earnings", "dividend", "expiry", "rbi_policy")
+
+
+class EventCalendar:
+    """
+    Daily snapshot of known events - earnings, ex-dividend dates, F&O expiries and RBI
+    policy decisions - for the whole F&O universe, indexed by date and by symbol so the
+    exit checks do a dictionary lookup instead of a network call per position.
+
+    The snapshot is rebuilt in bulk once a day (in the background, concurrently across
+    symbols) and persisted to CACHE_DIR, so restarts and other workers reuse it. Lookups
+    never fetch: before the first build they simply find no events.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, rbi_file=RBI_POLICY_FILE):
+        # None keeps the snapshot in memory only (no disk cache)
+        self.cache_dir = cache_dir
+        self.rbi_file = rbi_file
+        # universe() -> {underlying name: [expiry dates]}, e.g. from the instrument master
+        self.universe = None
+        self._lock = threading.Lock()
+        self._loaded_on = None
+        self._by_date = {}
+        self._by_symbol = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def set_universe(self, universe):
+        self.universe = universe
+
+    def _cache_path(self, day):
+        return os.path.join(self.cache_dir, f"events_{day.isoformat()}.json")
+
+    # --- Lookups ---
+
+    def events_for(self, symbol, start, end, types=EVENT_TYPES):
+        """Events for a symbol (plus market-wide ones) dated start..end inclusive, in date order."""
+        self._load_cached()
+        matches = []
+        for key in (symbol, MARKET_WIDE):
+            for event in self._by_symbol.get(key, []):
+                if start <= event["date"] <= end and event["type"] in types:
+                    matches.append(event)
+        return sorted(matches, key=lambda event: event["date"])
+
+    def events_on(self, day):
+        self._load_cached()
+        return list(self._by_date.get(day, []))
+
+    # --- Building ---
+
+    def _load_cached(self):
+        """Indexes today's snapshot from disk if it exists and is not indexed yet (no network)."""
+        today = trading_calendar.now().date()
+        if self._loaded_on == today:
+            return
+        with self._lock:
+            if self._loaded_on == today:
+                return
+            events = self._read_cache(today)
+            if events is None:
+                return
+            self._build_index(events)
+            self._loaded_on = today
+
+    def refresh(self, force=False):
+        """Builds today's snapshot; the shared lock makes one worker build it while the others wait and read it."""
+        today = trading_calendar.now().date()
+        if not force and self._loaded_on == today:
+            return
+        if not force and self._read_cache(today) is not None:
+            self._load_cached()
+            return
+
+        with get_shared_cache().lock(f"events:{today.isoformat()}", ttl=900, timeout=900):
+            if force or self._read_cache(today) is None:
+                self._rebuild(today)
+        self._load_cached()
+
+    def _rebuild(self, today):
+        with timer("events.refresh"):
+            universe = self.universe() if self.universe else {}
+            events = self._expiry_events(universe) + self._rbi_events() + self._corporate_events(universe, today)
+        self._write_cache(today, events)
+        with self._lock:
+            self._build_index(events)
+            self._loaded_on = today
+        logging.info(f"Event calendar refreshed: {len(events)} events for {len(universe)} underlyings.")
+
+    def _expiry_events(self, universe):
+        events = []
+        for name, expiries in universe.items():
+            for expiry in sorted(set(expiries)):
+                events.append({"date": expiry, "symbol": spot_symbol(name), "type": "expiry",
+                               "description": f"{name} F&O expiry"})
+        return events
+
+    def _rbi_events(self):
+        try:
+            with open(self.rbi_file) as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.warning(f"RBI policy dates not loaded ({self.rbi_file}): {e}")
+            return []
+        events = [{"date": date.fromisoformat(day), "symbol": MARKET_WIDE, "type": "rbi_policy",
+                   "description": "RBI monetary policy decision"}
+                  for period, days in data.items() if not period.startswith("_") for day in days]
+        if not any(event["date"] >= trading_calendar.now().date() for event in events):
+            logging.warning(f"No upcoming RBI policy dates in {self.rbi_file}; add the current MPC schedule")
+        return events
+
+    def _corporate_events(self, universe, today):
+        """Earnings and ex-dividend dates for every stock underlying, fetched concurrently."""
+        stocks = [name for name in universe if name not in INDEX_SPOT_SYMBOLS]
+        if not stocks:
+            return []
+        # Deferred import: yfinance is only needed for the daily refresh
+        yf = session_replay.yfinance()
+
+        def fetch(name):
+            try:
+                # Last good calendar when yfinance is down; an open breaker fails the rest fast
+                return name, yfinance_breaker.call_with_fallback(f"calendar:{name}", lambda: yf.Ticker(yf_symbol(name)).calendar)
+            except Exception as e:
+                logging.warning(f"Calendar fetch failed for {name}: {e}")
+                return name, None
+
+        events = []
+        with ThreadPoolExecutor(max_workers=EVENT_FETCH_CONCURRENCY) as pool:
+            for name, calendar in pool.map(fetch, stocks):
+                for event_type, day in _parse_yf_calendar(calendar):
+                    if day >= today:
+                        events.append({"date": day, "symbol": name, "type": event_type,
+                                       "description": f"{name} {event_type.replace('_', ' ')}"})
+        return events
+
+    def _build_index(self, events):
+        by_date = {}
+        by_symbol = {}
+        for event in events:
+            by_date.setdefault(event["date"], []).append(event)
+            by_symbol.setdefault(event["symbol"], []).append(event)
+        for symbol_events in by_symbol.values():
+            symbol_events.sort(key=lambda event: event["date"])
+        self._by_date = by_date
+        self._by_symbol = by_symbol
+
+    def _read_cache(self, day):
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(day)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                events = json.load(f)
+            for event in events:
+                event["date"] = date.fromisoformat(event["date"])
+            return events
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable event cache {path}: {e}")
+            return None
+
+    def _write_cache(self, day, events):
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._cache_path(day)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump([{**event, "date": event["date"].isoformat()} for event in events], f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Failed to persist event calendar: {e}")
+
+    # --- Background refresh ---
+
+    def start_daily_refresh(self):
+        """Builds today's snapshot now if missing, then again every morning at 07:00 IST."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="event-calendar", daemon=True)
+        self._thread.start()
+
+    def stop_daily_refresh(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Event calendar refresh failed: {e}")
+            now = datetime.now(IST)
+            wake_at = now.replace(hour=EVENT_REFRESH_HOUR_IST, minute=0, second=0, microsecond=0)
+            if wake_at <= now:
+                wake_at += timedelta(days=1)
+            self._stop.wait((wake_at - now).total_seconds())
+
+
+def _parse_yf_calendar(calendar):
+    """(event type, date) pairs from Ticker.calendar, which is a dict in newer yfinance and a DataFrame in older."""
+    if calendar is None:
+        return []
+    if hasattr(calendar, "to_dict"):
+        if getattr(calendar, "empty", True):
+            return []
+        # Older yfinance: one column per value, event names in the index
+        calendar = {key: list(values.values()) for key, values in calendar.T.to_dict().items()}
+
+    pairs = []
+    for key, event_type in (("Earnings Date", "earnings"), ("Ex-Dividend Date", "dividend")):
+        values = calendar.get(key)
+        if values is None:
+            continue
+        for value in values if isinstance(values, (list, tuple)) else [values]:
+            day = _as_date(value)
+            if day:
+                pairs.append((event_type, day))
+    return pairs
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if hasattr(value, "date"):
+        try:
+            return value.date()
+        except Exception:
+            return None
+    return None
+
+
+# Initialize singleton
+# A recorded or replayed session (see session_replay.py) builds its own snapshot from the
+# session's upstream responses instead of sharing today's disk cache with live servers
+event_calendar = EventCalendar(cache_dir=None if session_replay.active() else CACHE_DIR)
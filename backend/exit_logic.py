@@ -1,8 +1,77 @@
-import yfinance as yf
-import pandas as pd
-from datetime import datetime, timedelta
+import re
 import logging
+from metrics import timed
+from instrument_master import spot_symbol
+from trading_calendar import trading_calendar
+from event_calendar import event_calendar
+from risk_engine import parse_option_symbol
+from market_data import history_loader
 
+# Used when a position's contract is not in the instrument master (avoids a false EXIT on time)
+DEFAULT_DAYS_TO_EXPIRY = 10
+# Bars behind the VIX and 20-SMA checks: 15-minute candles over 5 sessions
+VIX_SYMBOL = "INDIA VIX"
+TREND_BARS = {"period": "5d", "interval": "15m"}
+
+def prefetch_exit_data(underlyings):
+    """
+    Loads the bars check_my_exit needs for a whole book in one bulk request, so the
+    per-position checks that follow are cache hits.
+    """
+    history_loader.bars(sorted(set(underlyings)) + [VIX_SYMBOL], **TREND_BARS)
+
+def underlying_for(tradingsymbol):
+    """
+    Best guess of the NSE spot symbol behind an option tradingsymbol
+    (NIFTY24FEB22000CE -> "NIFTY 50", RELIANCE24FEB2400CE -> "RELIANCE").
+    """
+    if "NIFTY" in tradingsymbol and "BANK" not in tradingsymbol:
+        return "NIFTY 50"
+    if "BANKNIFTY" in tradingsymbol:
+        return "NIFTY BANK"
+    # Regex to find the alphabetical prefix
+    match = re.match(r"([A-Z]+)", tradingsymbol)
+    return match.group(1) if match else "NIFTY 50"
+
+def position_contract(pos, instrument_master=None):
+    """
+    Contract details of a Kite position: derivative name, underlying spot symbol, strike,
+    option type, expiry, trading days to expiry (exchange holidays excluded, for the exit
+    rules) and fractional calendar days (for the Greeks). Resolved through the instrument master's
+    token map; when the contract is unknown, the tradingsymbol is parsed and the expiry
+    assumed DEFAULT_DAYS_TO_EXPIRY away.
+    """
+    tradingsymbol = pos["tradingsymbol"]
+    inst = None
+    if instrument_master is not None:
+        try:
+            inst = instrument_master.contract_for(pos.get("instrument_token"), tradingsymbol)
+        except Exception as e:
+            logging.warning(f"Instrument master lookup failed for {tradingsymbol}: {e}")
+
+    if inst is not None and inst.get("expiry"):
+        return {
+            "name": inst["name"],
+            "underlying": spot_symbol(inst["name"]),
+            "strike": float(inst.get("strike") or 0.0),
+            "option_type": inst.get("instrument_type"),
+            "expiry": inst["expiry"],
+            "days_to_expiry": trading_calendar.trading_days_to_expiry(inst["expiry"]),
+            "calendar_days": trading_calendar.calendar_days_to_expiry(inst["expiry"])
+        }
+
+    parsed = parse_option_symbol(tradingsymbol)
+    return {
+        "name": parsed[0] if parsed else None,
+        "underlying": underlying_for(tradingsymbol),
+        "strike": parsed[1] if parsed else 0.0,
+        "option_type": parsed[2] if parsed else ("CE" if "CE" in tradingsymbol else "PE"),
+        "expiry": None,
+        "days_to_expiry": DEFAULT_DAYS_TO_EXPIRY,
+        "calendar_days": float(DEFAULT_DAYS_TO_EXPIRY)
+    }
+
+@timed("check_my_exit")
 def check_my_exit(
     position_type: str,  # "CE" or "PE"
     bias: str,           # "LONG" or "SHORT" (Net Quantity > 0 is LONG, < 0 is SHORT)
@@ -18,9 +87,8 @@ def check_my_exit(
     2. Profit/Loss Targets
     3. India VIX Spikes
     4. Technical Trend (20-SMA)
-    5. Event Risk (Earnings)
+    5. Event Risk (Earnings, RBI policy)
     """
-    
     reasons = []
     should_exit = False
     
@@ -54,17 +122,23 @@ def check_my_exit(
         if current_price >= (entry_price * 2.0):
              return {"action": "EXIT", "reason": "Profit Target Reached (100% Return)"}
 
+    # Bars for the VIX and trend checks; after prefetch_exit_data these are cache hits
+    bars = history_loader.bars([underlying_symbol, VIX_SYMBOL], **TREND_BARS)
+
     # --- 3. VIX WATCH (Safety Guardrail) ---
     try:
-        vix = yf.Ticker("^INDIAVIX")
-        vix_hist = vix.history(period="2d")
-        if len(vix_hist) >= 2:
-            prev_close = vix_hist['Close'].iloc[-2]
-            curr_vix = vix_hist['Close'].iloc[-1]
-            vix_change = ((curr_vix - prev_close) / prev_close) * 100
-            
-            if vix_change > 10.0:
-                 return {"action": "EXIT", "reason": f"VIX Spike Detected (+{round(vix_change, 1)}%)"}
+        vix_hist = bars.get(VIX_SYMBOL)
+        if vix_hist is not None and len(vix_hist) >= 2:
+            # Change against the previous session's last close
+            sessions = vix_hist.index.date
+            prev_session = vix_hist[sessions < sessions[-1]]
+            if len(prev_session):
+                prev_close = prev_session['Close'].iloc[-1]
+                curr_vix = vix_hist['Close'].iloc[-1]
+                vix_change = ((curr_vix - prev_close) / prev_close) * 100
+
+                if vix_change > 10.0:
+                     return {"action": "EXIT", "reason": f"VIX Spike Detected (+{round(vix_change, 1)}%)"}
     except Exception as e:
         logging.warning(f"Failed to fetch VIX data: {e}")
 
@@ -73,27 +147,20 @@ def check_my_exit(
     # Validating this strictly via yfinance might be delayed. 
     # We will use a simplified check: If CURRENT price + Prev 15min Close are both violating SMA.
     try:
-        # Fetch intraday data for underlying
-        # yfinance format for NSE symbols often needs suffix. 
-        # Assuming underlying_symbol is like "RELIANCE" or "NIFTY 50"
-        yf_symbol = f"{underlying_symbol}.NS" if "NIFTY" not in underlying_symbol else "^NSEI" 
-        if "BANKNIFTY" in underlying_symbol: yf_symbol = "^NSEBANK"
-            
-        ticker = yf.Ticker(yf_symbol)
-        # Fetch enough data for 20 SMA (e.g. 5 days of 15m data)
-        df = ticker.history(period="5d", interval="15m")
+        # Intraday bars for the underlying (symbol mapping to yfinance lives in market_data)
+        df = bars.get(underlying_symbol)
+        if df is None:
+            raise ValueError("no bars returned")
         
         if len(df) > 20:
-            df['SMA_20'] = df['Close'].rolling(window=20).mean()
+            # The frame is shared through the cache, so the SMA is computed on the side
+            sma = df['Close'].rolling(window=20).mean()
             
-            last_candle = df.iloc[-1]
-            prev_candle = df.iloc[-2]
+            sma_last = sma.iloc[-1]
+            sma_prev = sma.iloc[-2]
             
-            sma_last = last_candle['SMA_20']
-            sma_prev = prev_candle['SMA_20']
-            
-            close_last = last_candle['Close']
-            close_prev = prev_candle['Close']
+            close_last = df['Close'].iloc[-1]
+            close_prev = df['Close'].iloc[-2]
             
             # Logic:
             # Long Bias (e.g. Short Put / Long Call) -> Bullish -> Exit if Price < SMA
@@ -135,25 +202,15 @@ def check_my_exit(
         logging.warning(f"Failed to fetch Technical data for {underlying_symbol}: {e}")
 
     # --- 5. CALENDAR WATCH (Event Risk) ---
-    try:
-        # Check Earnings
-        stock = yf.Ticker(yf_symbol)
-        calendar = stock.calendar
-        
-        # yfinance calendar format varies. Safe check.
-        if calendar is not None and not calendar.empty:
-            # Check if there is an earnings date tomorrow
-            # This is complex to parse generically for all stocks, simplified for now
-            pass 
-            
-        # Time check for 3:00 PM
-        now = datetime.now()
-        if now.hour == 15 and now.minute >= 0:
-             # Strictly check if earnings tomorrow? 
-             # For now, we will skip hard implementation without reliable earnings implementation
-             pass
-             
-    except Exception:
-        pass
+    # From 3:00 PM, exit ahead of earnings or an RBI policy decision due by the next session.
+    # Events come from the daily cached calendar, so this is a lookup, not a network call.
+    now = trading_calendar.now()
+    if now.hour >= 15:
+        today = now.date()
+        events = event_calendar.events_for(underlying_symbol, today, trading_calendar.next_trading_day(today),
+                                           types=("earnings", "rbi_policy"))
+        if events:
+            event = events[0]
+            return {"action": "EXIT", "reason": f"Event Risk ({event['description']} on {event['date'].isoformat()})"}
 
     return {"action": "HOLD", "reason": "All checks passed"}
@@ -0,0 +1,197 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+from exit_logic import check_my_exit, position_contract, prefetch_exit_data
+from shared_cache import get_shared_cache
+from token_manager import IST
+from trading_calendar import trading_calendar
+from metrics import registry, timer
+
+# Seconds between polls of positions and quotes
+EXIT_MONITOR_INTERVAL_SEC = float(os.getenv("EXIT_MONITOR_INTERVAL_SEC", "5"))
+# Bar length for the indicator-based checks (VIX, 20-SMA on 15m candles): positions are
+# re-evaluated at every bar close even when their prices did not move
+EXIT_MONITOR_BAR_SEC = int(os.getenv("EXIT_MONITOR_BAR_SEC", str(15 * 60)))
+# Hysteresis: consecutive EXIT verdicts before a HOLD position flips to EXIT (and fires),
+# and consecutive HOLD verdicts before an EXIT position is considered recovered
+EXIT_CONFIRMATIONS = int(os.getenv("EXIT_MONITOR_CONFIRMATIONS", "2"))
+HOLD_CONFIRMATIONS = int(os.getenv("EXIT_MONITOR_HOLD_CONFIRMATIONS", "3"))
+EXIT_WEBHOOK_URL = os.getenv("EXIT_WEBHOOK_URL")
+
+STATE_KEY = "exit-monitor:state"
+STATE_TTL_SEC = 7 * 24 * 3600
+
+EXIT_ALERTS = registry.counter("optrec_exit_alerts_total", "HOLD to EXIT transitions fired by the exit monitor.")
+EXIT_EVALUATIONS = registry.counter("optrec_exit_monitor_positions_total",
+                                    "Positions seen by the exit monitor, by whether they were re-evaluated.")
+
+
+class ExitMonitor:
+    """
+    Background exit monitoring for the open book.
+
+    Each cycle fetches positions, the underlyings' prices and their bars in one call
+    each, then runs check_my_exit only for positions whose inputs changed since their
+    last evaluation (option price, entry, quantity, days to expiry, or a new bar for the
+    indicator checks) or that have a state change pending confirmation.
+    Verdicts go through a per-position state machine with hysteresis, and a HOLD -> EXIT
+    transition fires exactly one alert (log line, plus a webhook POST when
+    EXIT_WEBHOOK_URL is set).
+
+    State lives in the shared cache and cycles run under a shared lock, so with several
+    workers only one evaluates at a time and alerts are not duplicated.
+    """
+
+    def __init__(self, kite_service_getter, interval=EXIT_MONITOR_INTERVAL_SEC, webhook_url=EXIT_WEBHOOK_URL,
+                 exit_confirmations=EXIT_CONFIRMATIONS, hold_confirmations=HOLD_CONFIRMATIONS,
+                 bar_seconds=EXIT_MONITOR_BAR_SEC, check=check_my_exit):
+        self.kite_service_getter = kite_service_getter
+        self.interval = interval
+        self.webhook_url = webhook_url
+        self.exit_confirmations = exit_confirmations
+        self.hold_confirmations = hold_confirmations
+        self.bar_seconds = bar_seconds
+        self.check = check
+        self._thread = None
+        self._stop = threading.Event()
+
+    def fingerprint(self, pos, days_to_expiry, now):
+        """
+        Everything check_my_exit depends on. The underlying price is left out: the checks
+        only use it through the bar data, which the bar index already covers.
+        """
+        return [pos["last_price"], pos["average_price"], pos["quantity"], days_to_expiry,
+                int(now // self.bar_seconds)]
+
+    def run_once(self, now=None):
+        """One monitoring cycle. Returns the alerts fired (empty if another worker holds the cycle)."""
+        cache = get_shared_cache()
+        with cache.lock(STATE_KEY, ttl=max(self.interval * 4, 60), timeout=0) as acquired:
+            if not acquired:
+                return []
+            with timer("exit_monitor.cycle"):
+                state = cache.get(STATE_KEY) or {}
+                alerts = self._evaluate(state, now or time.time())
+                cache.set(STATE_KEY, state, STATE_TTL_SEC)
+        for alert in alerts:
+            self._fire(alert)
+        return alerts
+
+    def _evaluate(self, state, now):
+        kite_service = self.kite_service_getter()
+        positions = [pos for pos in kite_service.get_positions() if pos.get("quantity")]
+
+        stale = set(state) - {pos["tradingsymbol"] for pos in positions}
+        for symbol in stale:
+            del state[symbol]
+
+        changed = []
+        for pos in positions:
+            entry = state.get(pos["tradingsymbol"])
+            contract = position_contract(pos, getattr(kite_service, "instrument_master", None))
+            fingerprint = self.fingerprint(pos, contract["days_to_expiry"], now)
+            # A pending flip (streak > 0) is re-checked even if nothing moved, so it can confirm
+            if entry and entry["fingerprint"] == fingerprint and not entry["streak"]:
+                EXIT_EVALUATIONS.inc(result="unchanged")
+                continue
+            EXIT_EVALUATIONS.inc(result="evaluated")
+            changed.append((pos, contract, fingerprint))
+
+        if not changed:
+            return []
+
+        # One quote call for all underlyings that need a fresh evaluation
+        underlyings = sorted({contract["underlying"] for _, contract, _ in changed})
+        ltp_data = kite_service.get_ltp(underlyings)
+        prefetch_exit_data(underlyings)
+
+        alerts = []
+        for pos, contract, fingerprint in changed:
+            symbol = pos["tradingsymbol"]
+            underlying = contract["underlying"]
+            quote = ltp_data.get(underlying) or ltp_data.get(f"NSE:{underlying}") or {}
+            verdict = self.check(
+                position_type=contract["option_type"],
+                bias="LONG" if pos["quantity"] > 0 else "SHORT",
+                current_price=pos["last_price"],
+                entry_price=pos["average_price"],
+                days_to_expiry=contract["days_to_expiry"],
+                underlying_symbol=underlying,
+                underlying_price=quote.get("last_price", 0)
+            )
+            entry = state.setdefault(symbol, {"state": "HOLD", "streak": 0, "reason": None})
+            entry["fingerprint"] = fingerprint
+            if self._transition(entry, verdict):
+                alerts.append({
+                    "event": "exit_signal",
+                    "symbol": symbol,
+                    "reason": verdict["reason"],
+                    "qty": pos["quantity"],
+                    "ltp": pos["last_price"],
+                    "avg_price": pos["average_price"],
+                    "underlying": underlying,
+                    "underlying_price": quote.get("last_price", 0),
+                    "at": datetime.fromtimestamp(now, IST).isoformat()
+                })
+        return alerts
+
+    def _transition(self, entry, verdict):
+        """
+        Advances one position's state machine. Returns True only on the HOLD -> EXIT edge.
+        A verdict that disagrees with the current state must repeat (exit_confirmations or
+        hold_confirmations times in a row) before the state flips.
+        """
+        wanted = verdict["action"]
+        if wanted == entry["state"]:
+            entry["streak"] = 0
+            if wanted == "EXIT":
+                entry["reason"] = verdict["reason"]
+            return False
+
+        entry["streak"] += 1
+        needed = self.exit_confirmations if wanted == "EXIT" else self.hold_confirmations
+        if entry["streak"] < needed:
+            return False
+
+        entry["state"] = wanted
+        entry["streak"] = 0
+        entry["reason"] = verdict["reason"] if wanted == "EXIT" else None
+        return wanted == "EXIT"
+
+    def _fire(self, alert):
+        EXIT_ALERTS.inc(reason=alert["reason"])
+        logging.warning(f"EXIT signal for {alert['symbol']} (qty {alert['qty']}): {alert['reason']}")
+        if not self.webhook_url:
+            return
+        try:
+            import httpx
+            httpx.post(self.webhook_url, json=alert, timeout=5.0).raise_for_status()
+        except Exception as e:
+            logging.error(f"Exit alert webhook failed for {alert['symbol']}: {e}")
+
+    def snapshot(self):
+        """Current per-position monitor state, for the API."""
+        state = get_shared_cache().get(STATE_KEY) or {}
+        return {symbol: {"state": entry["state"], "reason": entry["reason"]} for symbol, entry in state.items()}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="exit-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if trading_calendar.is_market_open():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logging.error(f"Exit monitor cycle failed: {e}")
+            self._stop.wait(self.interval)
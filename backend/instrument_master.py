@@ -0,0 +1,245 @@
+import os
+import json
+import logging
+import threading
+from datetime import date, datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(BASE_DIR, "cache"))
+FREEZE_QTY_FILE = os.getenv("FREEZE_QTY_FILE", os.path.join(BASE_DIR, "data", "freeze_qty.json"))
+
+DEFAULT_LOT_SIZE = 50
+DEFAULT_TICK_SIZE = 0.05
+
+# Derivative underlying name -> NSE spot symbol, where they differ (indices)
+INDEX_SPOT_SYMBOLS = {
+    "NIFTY": "NIFTY 50",
+    "BANKNIFTY": "NIFTY BANK",
+    "FINNIFTY": "NIFTY FIN SERVICE",
+    "MIDCPNIFTY": "NIFTY MID SELECT",
+}
+
+
+def spot_symbol(name):
+    """NSE symbol to quote for a derivative's underlying (NIFTY -> "NIFTY 50", RELIANCE -> "RELIANCE")."""
+    return INDEX_SPOT_SYMBOLS.get(name, name)
+
+
+class OptionChain(list):
+    """
+    List of {"strike", "ce_price", "pe_price"} rows that also carries the contract
+    specification of the underlying, so sizing math never has to guess the lot size.
+    """
+
+    def __init__(self, rows=(), symbol=None, expiry=None, lot_size=DEFAULT_LOT_SIZE,
+                 tick_size=DEFAULT_TICK_SIZE, freeze_qty=None):
+        super().__init__(rows)
+        self.symbol = symbol
+        self.expiry = expiry
+        self.lot_size = lot_size
+        self.tick_size = tick_size
+        self.freeze_qty = freeze_qty
+
+
+class InstrumentMaster:
+    """
+    Daily cache of the exchange instrument dump. The dump is downloaded at most once per
+    day (and persisted to disk so restarts skip the download), then indexed per underlying
+    so option filtering and contract-spec lookups are dictionary hits on the hot path.
+    """
+
+    def __init__(self, exchange="NFO", loader=None, cache_dir=CACHE_DIR, shared_cache=None):
+        self.exchange = exchange
+        self.loader = loader
+        # None keeps the dump in memory only (no disk cache)
+        self.cache_dir = cache_dir
+        # Optional shared_cache.CacheBackend: with several workers only one of them downloads
+        self.shared_cache = shared_cache
+        self._lock = threading.Lock()
+        self._loaded_on = None
+        self._instruments = []
+        self._options_by_name = {}
+        self._specs_by_name = {}
+        self._by_token = {}
+        self._by_symbol = {}
+        self._freeze_qty = self._load_freeze_qty()
+
+    def set_loader(self, loader):
+        """loader() must return the raw instrument list, e.g. lambda: kite.instruments("NFO")."""
+        self.loader = loader
+
+    def _cache_path(self, day):
+        return os.path.join(self.cache_dir, f"instruments_{self.exchange}_{day.isoformat()}.json")
+
+    def _load_freeze_qty(self):
+        try:
+            with open(FREEZE_QTY_FILE) as f:
+                return {k: v for k, v in json.load(f).items() if not k.startswith("_")}
+        except Exception as e:
+            logging.warning(f"Freeze quantity file not loaded ({FREEZE_QTY_FILE}): {e}")
+            return {}
+
+    def is_fresh(self):
+        """True when today's dump is indexed, or can be read from today's disk cache."""
+        if self._loaded_on == date.today():
+            return True
+        instruments = self._read_cache(date.today())
+        if instruments is None:
+            return False
+        self.load(instruments, persist=False)
+        return True
+
+    def load(self, instruments, persist=True):
+        """Indexes an instrument dump fetched elsewhere (e.g. by the async client) as today's master."""
+        today = date.today()
+        with self._lock:
+            if persist:
+                self._write_cache(today, instruments)
+            self._build_index(instruments)
+            self._loaded_on = today
+
+    def ensure_loaded(self):
+        """Loads today's instrument dump from the disk cache, or the loader if it is stale."""
+        today = date.today()
+        if self._loaded_on == today:
+            return
+
+        with self._lock:
+            if self._loaded_on == today:
+                return
+
+            instruments = self._read_cache(today)
+            if instruments is None:
+                instruments = self._fetch(today)
+
+            self._build_index(instruments)
+            self._loaded_on = today
+
+    def _fetch(self, day):
+        """
+        Downloads the day's dump through the loader. With a shared cache, workers take a lock
+        first, so one of them downloads while the others wait and then read its copy (from
+        the disk cache, or from the shared cache when workers are on different hosts).
+        """
+        if self.loader is None:
+            raise Exception("Instrument master has no loader configured")
+        if self.shared_cache is None:
+            instruments = self.loader()
+            self._write_cache(day, instruments)
+            return instruments
+
+        key = f"instruments:{self.exchange}:{day.isoformat()}"
+        with self.shared_cache.lock(key, ttl=300, timeout=300):
+            instruments = self._read_cache(day)
+            if instruments is None and self.shared_cache.distributed:
+                instruments = self.shared_cache.get(key)
+                if instruments is not None:
+                    self._write_cache(day, instruments)
+            if instruments is None:
+                instruments = self.loader()
+                self._write_cache(day, instruments)
+                if self.shared_cache.distributed:
+                    self.shared_cache.set(key, instruments, ttl=24 * 3600)
+        return instruments
+
+    def _read_cache(self, day):
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(day)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                instruments = json.load(f)
+            for inst in instruments:
+                if inst.get("expiry"):
+                    inst["expiry"] = date.fromisoformat(inst["expiry"])
+            return instruments
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable instrument cache {path}: {e}")
+            return None
+
+    def _write_cache(self, day, instruments):
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._cache_path(day)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(instruments, f, default=_json_default)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Failed to persist instrument master: {e}")
+
+    def _build_index(self, instruments):
+        options_by_name = {}
+        specs_by_name = {}
+        by_token = {}
+        by_symbol = {}
+        for inst in instruments:
+            if inst.get("instrument_token") is not None:
+                by_token[int(inst["instrument_token"])] = inst
+            if inst.get("tradingsymbol"):
+                by_symbol[inst["tradingsymbol"]] = inst
+            name = inst.get("name")
+            if not name:
+                continue
+            if inst.get("instrument_type") in ("CE", "PE"):
+                options_by_name.setdefault(name, []).append(inst)
+            if name not in specs_by_name and inst.get("lot_size"):
+                specs_by_name[name] = {
+                    "lot_size": int(inst["lot_size"]),
+                    "tick_size": float(inst.get("tick_size") or DEFAULT_TICK_SIZE),
+                    "freeze_qty": self._freeze_qty.get(name)
+                }
+
+        self._instruments = instruments
+        self._options_by_name = options_by_name
+        self._specs_by_name = specs_by_name
+        self._by_token = by_token
+        self._by_symbol = by_symbol
+
+    def instruments(self):
+        self.ensure_loaded()
+        return self._instruments
+
+    def options_for(self, name):
+        """All CE/PE contracts of an underlying (empty list if it has no options)."""
+        self.ensure_loaded()
+        return self._options_by_name.get(name, [])
+
+    def expiries(self):
+        """{underlying name: sorted option expiries} across today's dump."""
+        self.ensure_loaded()
+        return {name: sorted({inst["expiry"] for inst in options if inst.get("expiry")})
+                for name, options in self._options_by_name.items()}
+
+    def contract_for(self, instrument_token=None, tradingsymbol=None):
+        """
+        The instrument record (name, expiry, strike, instrument_type, lot_size, ...) for a
+        token or tradingsymbol, or None if today's dump does not list it.
+        """
+        self.ensure_loaded()
+        if instrument_token is not None:
+            inst = self._by_token.get(int(instrument_token))
+            if inst is not None:
+                return inst
+        return self._by_symbol.get(tradingsymbol) if tradingsymbol else None
+
+    def specs_for(self, names):
+        """
+        Batch contract-spec lookup: {name: {"lot_size", "tick_size", "freeze_qty"}}.
+        Unknown names fall back to the defaults.
+        """
+        self.ensure_loaded()
+        return {name: self._specs_by_name.get(name) or self._default_spec(name) for name in names}
+
+    def _default_spec(self, name):
+        return {"lot_size": DEFAULT_LOT_SIZE, "tick_size": DEFAULT_TICK_SIZE, "freeze_qty": self._freeze_qty.get(name)}
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
@@ -3,11 +3,26 @@ import logging
 from kiteconnect import KiteConnect
 from dotenv import load_dotenv
 import kiteconnect.exceptions
-from generate_token import generate_token
+from token_manager import token_manager
+from instrument_master import CACHE_DIR, InstrumentMaster, OptionChain
+from shared_cache import get_shared_cache
+from circuit_breaker import CircuitBreaker, UpstreamUnavailable
+from metrics import timed, timer
+import session_replay
 
 # Load environment variables
 load_dotenv()
 
+# Quotes fetched by any worker are reused for this long (0 disables quote caching)
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL_SEC", "1"))
+# Longest a single Kite REST call may take before the request moves on (and the breaker counts a failure)
+KITE_TIMEOUT_SEC = float(os.getenv("KITE_TIMEOUT_SEC", "5"))
+# The daily NFO instrument dump is several MB
+INSTRUMENTS_TIMEOUT_SEC = float(os.getenv("KITE_INSTRUMENTS_TIMEOUT_SEC", "30"))
+
+# An expired token is handled by the callers (refresh and retry), not counted against Kite
+kite_breaker = CircuitBreaker("kite", KITE_TIMEOUT_SEC, ignore=(kiteconnect.exceptions.TokenException,))
+
 class KiteService:
     """
     Live service to interact with the Zerodha Kite Connect API.
@@ -15,9 +30,18 @@ class KiteService:
     def __init__(self):
         self.api_key = os.getenv("KITE_API_KEY")
         self.api_secret = os.getenv("KITE_API_SECRET")
-        self.access_token = os.getenv("KITE_ACCESS_TOKEN")
+        # Persisted token from an earlier login today wins over the one in the environment
+        self.access_token = token_manager.get_token()
         self.kite = None
-        if self.api_key:
+        self.cache = get_shared_cache()
+        # A recorded or replayed session (see session_replay.py) never shares today's dump on disk
+        self.instrument_master = InstrumentMaster("NFO", loader=self._download_instruments, shared_cache=self.cache,
+                                                  cache_dir=None if session_replay.active() else CACHE_DIR)
+        token_manager.subscribe(self._on_new_token)
+        if session_replay.replaying():
+            # Offline: every broker response comes from the recorded session
+            self.kite = session_replay.replay_kite()
+        elif self.api_key:
             self.init_kite()
         else:
             logging.warning("Kite API credentials not found in environment.")
@@ -25,7 +49,11 @@ class KiteService:
     def init_kite(self):
         """Initializes the KiteConnect object with the current access token."""
         try:
-            self.kite = KiteConnect(api_key=self.api_key)
+            # KITE_ROOT_URL lets the service point at the local mock broker (see mock_broker.py)
+            root = os.getenv("KITE_ROOT_URL")
+            kite = KiteConnect(api_key=self.api_key, root=root) if root else KiteConnect(api_key=self.api_key)
+            # REPLAY_MODE=record keeps every response for offline replays
+            self.kite = session_replay.wrap_kite(kite)
             if self.access_token:
                 self.kite.set_access_token(self.access_token)
                 logging.info("KiteConnect initialized successfully with existing token.")
@@ -34,24 +62,57 @@ class KiteService:
         except Exception as e:
             logging.error(f"Failed to initialize KiteConnect: {e}")
 
-    def refresh_token(self):
-        """Triggers the automated headless Selenium login to fetch a new token."""
-        if not os.getenv("ZERODHA_TOTP_SECRET"):
-            logging.warning("Cannot auto-refresh token: ZERODHA_TOTP_SECRET not found in environment.")
-            return False
+    def _download_instruments(self):
+        with timer("kite.instruments"):
+            return kite_breaker.call(self.kite.instruments, "NFO", timeout=INSTRUMENTS_TIMEOUT_SEC)
 
-        logging.info("Triggering automated TOTP login to refresh Kite Token...")
-        try:
-            new_token = generate_token()
-            if new_token:
-                self.access_token = new_token
-                self.init_kite()
-                logging.info("Successfully refreshed Kite Token implicitly!")
-                return True
-        except Exception as e:
-            logging.error(f"Failed to auto-refresh token: {e}")
+    def _quote(self, instruments):
+        """
+        kite.quote() through the shared cache: instruments quoted by any worker within the
+        last QUOTE_CACHE_TTL seconds are served from the cache, only the rest go upstream.
+        If Kite is down or slow, the last good quotes are served instead (marked stale).
+        """
+        cached = self.cache.get_many([f"quote:{inst}" for inst in instruments]) if QUOTE_CACHE_TTL > 0 else {}
+        quotes = {inst: cached[f"quote:{inst}"] for inst in instruments if f"quote:{inst}" in cached}
+        missing = [inst for inst in instruments if inst not in quotes]
+        if missing:
+            try:
+                fresh = kite_breaker.call(self.kite.quote, missing)
+            except UpstreamUnavailable:
+                fallback = kite_breaker.last_good([f"quote:{inst}" for inst in missing])
+                if not fallback:
+                    raise
+                logging.warning(f"Kite quotes unavailable; serving {len(fallback)} last good quotes")
+                fresh = {key.split(":", 1)[1]: quote for key, quote in fallback.items()}
+            else:
+                if QUOTE_CACHE_TTL > 0:
+                    self.cache.set_many({f"quote:{inst}": quote for inst, quote in fresh.items()}, QUOTE_CACHE_TTL)
+                kite_breaker.remember({f"quote:{inst}": quote for inst, quote in fresh.items()})
+            quotes.update(fresh)
+        return quotes
+
+    def _on_new_token(self, access_token):
+        """Called by the token manager after any refresh, including background renewals."""
+        self.access_token = access_token
+        if self.kite:
+            self.kite.set_access_token(access_token)
+        elif self.api_key:
+            self.init_kite()
+
+    @timed("kite.refresh_token")
+    def refresh_token(self):
+        """
+        Asks the token manager for a new token. Only one login runs at a time; parallel
+        requests that hit an expired token wait for that login instead of starting their own.
+        """
+        new_token = token_manager.refresh(stale_token=self.access_token)
+        if new_token:
+            self._on_new_token(new_token)
+            logging.info("Successfully refreshed Kite Token implicitly!")
+            return True
         return False
 
+    @timed("kite.get_ltp")
     def get_ltp(self, instruments):
         """
         Fetch real Last Traded Price from Zerodha.
@@ -69,12 +130,12 @@ class KiteService:
                 formatted_instruments.append(inst)
                 
         try:
-            return self.kite.quote(formatted_instruments)
+            return self._quote(formatted_instruments)
         except kiteconnect.exceptions.TokenException:
             logging.warning("Token expired during get_ltp. Attempting auto-refresh...")
             if self.refresh_token():
                 try: 
-                    return self.kite.quote(formatted_instruments)
+                    return self._quote(formatted_instruments)
                 except Exception as e:
                     logging.error(f"Error fetching LTP after token refresh: {e}")
             return {}
@@ -82,33 +143,32 @@ class KiteService:
             logging.error(f"Error fetching LTP: {e}")
             return {}
 
-    def get_option_chain(self, symbol, current_price, range_min, range_max):
+    @timed("kite.get_option_chain")
+    def get_option_chain(self, symbol, current_price, range_min, range_max, expiry=None):
         """
         Fetch real active option chain data from Zerodha within a specific range.
         Note: This requires querying the NFO instruments dump and then fetching live quotes.
+        Defaults to the nearest expiry; pass `expiry` (a date) for another one.
         """
         if not self.kite:
             raise Exception("Kite API not initialized")
             
-        options_data = []
+        options_data = OptionChain(symbol=symbol)
         try:
-            # 1. Fetch all NFO instruments
-            # In a production app, this should be cached daily rather than fetched per request
-            instruments = self.kite.instruments("NFO")
-            
-            # 2. Filter for our specific underlying symbol, and only Options (CE/PE)
+            # 1. NFO instruments come from the daily cached master, indexed per underlying
+            # 2. Filter for our specific underlying symbol within the strike range
             # Find closest expiry first
-            symbol_instruments = [inst for inst in instruments 
-                                if inst['name'] == symbol 
-                                and inst['instrument_type'] in ['CE', 'PE'] 
-                                and range_min <= inst['strike'] <= range_max]
+            symbol_instruments = [inst for inst in self.instrument_master.options_for(symbol)
+                                if range_min <= inst['strike'] <= range_max]
             
             if not symbol_instruments:
-                return []
+                return options_data
                 
             # Group by expiry date, then map strikes
             expiries = sorted(list(set([inst['expiry'] for inst in symbol_instruments])))
-            current_expiry = expiries[0] # Just look at the nearest expiry
+            current_expiry = expiries[0] if expiry is None else expiry # Nearest expiry unless one was asked for
+            if current_expiry not in expiries:
+                return options_data
             
             active_options = [inst for inst in symbol_instruments if inst['expiry'] == current_expiry]
             
@@ -116,7 +176,8 @@ class KiteService:
             trading_symbols = [f"NFO:{inst['tradingsymbol']}" for inst in active_options]
             
             # Fetch real-time prices for these specific strikes
-            quotes = self.kite.quote(trading_symbols)
+            with timer("kite.quote"):
+                quotes = self._quote(trading_symbols)
             
             # 4. Parse response into our expected format
             strike_map = {}
@@ -133,19 +194,25 @@ class KiteService:
                 else:
                     strike_map[strike]['pe_price'] = price
                     
-            options_data = list(strike_map.values())
-            options_data.sort(key=lambda x: x['strike'])
+            spec = self.instrument_master.specs_for([symbol])[symbol]
+            options_data = OptionChain(
+                sorted(strike_map.values(), key=lambda x: x['strike']),
+                symbol=symbol,
+                expiry=current_expiry,
+                **spec
+            )
             
         except kiteconnect.exceptions.TokenException:
             logging.warning("Token expired during get_option_chain. Attempting auto-refresh...")
             if self.refresh_token():
                 # Recursively try exactly once if refresh succeeds
-                return self.get_option_chain(symbol, current_price, range_min, range_max)
+                return self.get_option_chain(symbol, current_price, range_min, range_max, expiry)
         except Exception as e:
             logging.error(f"Error fetching option chain: {e}")
             
         return options_data
 
+    @timed("kite.get_positions")
     def get_positions(self):
         """
         Fetch all open Day and Overnight positions.
@@ -154,7 +221,7 @@ class KiteService:
             raise Exception("Kite API not initialized")
             
         try:
-            positions = self.kite.positions()
+            positions = kite_breaker.call_with_fallback("positions", self.kite.positions)
             # Combine net and day positions? Usually 'net' contains the actual open book.
             # We will focus on 'net' which gives the overall consolidated view.
             return positions.get("net", [])
@@ -162,7 +229,7 @@ class KiteService:
             logging.warning("Token expired during get_positions. Attempting auto-refresh...")
             if self.refresh_token():
                 try:
-                    return self.kite.positions().get("net", [])
+                    return kite_breaker.call_with_fallback("positions", self.kite.positions).get("net", [])
                 except Exception as e:
                     logging.error(f"Error fetching positions after token refresh: {e}")
             return []
@@ -170,5 +237,11 @@ class KiteService:
             logging.error(f"Error fetching positions: {e} | Type: {type(e)}")
             return []
 
-# Initialize singleton
-kite_service = KiteService()
+# Lazily-built singleton (created during app startup, see main.lifespan)
+_kite_service = None
+
+def get_kite_service():
+    global _kite_service
+    if _kite_service is None:
+        _kite_service = KiteService()
+    return _kite_service
@@ -1,22 +1,86 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+import os
+import logging
+import threading
+from fastapi import FastAPI, HTTPException, Query, Request
 from typing import List, Optional
-import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
-import random
 
 # Import local modules
-from kite_service import kite_service
+# Heavy dependencies (Selenium, yfinance, TextBlob) are imported on first use inside these
+# modules, and the service singletons are built in `lifespan`, not at import time.
+from kite_service import get_kite_service
+from token_manager import token_manager
 from strategy_engine import calculate_strategy
-from advanced_analyzer import AdvancedOptionsAnalyzer
-from sentiment_analyzer import sentiment_service
-from exit_logic import check_my_exit
+from advanced_analyzer import get_analyzer
+from sentiment_analyzer import get_sentiment_service
+from exit_logic import check_my_exit, position_contract, prefetch_exit_data
+from risk_engine import risk_engine
+from roll_engine import roll_engine, is_rollable
+from analysis_scheduler import AnalysisScheduler, result_cache, with_age, content_digest, ANALYSIS_MAX_AGE_SEC
+from exit_monitor import ExitMonitor
+from event_calendar import event_calendar
+from vol_surface import vol_surface
+from circuit_breaker import stale_tracking, breaker_states
+import session_replay
+from api_responses import (AnalysisResponse, PositionsResponse, View, negotiate_format, etag_matches,
+                           not_modified, respond)
+import metrics
 from datetime import datetime
-import re
 
-analyzer = AdvancedOptionsAnalyzer()
+# WARMUP=1 pre-loads the deferred dependencies and today's instrument master in the
+# background after startup, so the first real request does not pay for them.
+WARMUP = os.getenv("WARMUP", "0") == "1"
+# ANALYSIS_PRECOMPUTE=1 recomputes the watchlists in data/watchlists.json during market hours,
+# so /analyze for those pairs is served from the result cache.
+ANALYSIS_PRECOMPUTE = os.getenv("ANALYSIS_PRECOMPUTE", "0") == "1"
+# EXIT_MONITOR=1 re-checks the open book in the background and alerts on new EXIT signals
+EXIT_MONITOR = os.getenv("EXIT_MONITOR", "0") == "1"
+# EVENT_CALENDAR=0 disables the daily bulk refresh of earnings/dividend/expiry/RBI dates
+# used by the exit checks (it needs Kite for the F&O universe)
+EVENT_CALENDAR = os.getenv("EVENT_CALENDAR", "1") == "1"
 
-app = FastAPI(title="F&O Options Analyzer")
+exit_monitor = ExitMonitor(get_kite_service)
+
+def warm_up():
+    try:
+        get_sentiment_service().warm_up()
+        vol_surface.warm_up()
+        kite_service = get_kite_service()
+        if kite_service.kite:
+            kite_service.instrument_master.ensure_loaded()
+        logging.info("Warm-up completed.")
+    except Exception as e:
+        logging.warning(f"Warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    get_kite_service()
+    get_analyzer()
+    get_sentiment_service()
+    
+    # Renew the Kite token in the background right after the daily rollover
+    if os.getenv("ZERODHA_TOTP_SECRET"):
+        token_manager.start_background_renewal()
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    scheduler = AnalysisScheduler(run_analysis)
+    if ANALYSIS_PRECOMPUTE:
+        scheduler.start()
+    if EXIT_MONITOR:
+        exit_monitor.start()
+    kite_service = get_kite_service()
+    if EVENT_CALENDAR and kite_service.kite:
+        event_calendar.set_universe(kite_service.instrument_master.expiries)
+        event_calendar.start_daily_refresh()
+    yield
+    event_calendar.stop_daily_refresh()
+    session_replay.flush()
+    exit_monitor.stop()
+    scheduler.stop()
+    token_manager.stop_background_renewal()
+
+app = FastAPI(title="F&O Options Analyzer", lifespan=lifespan)
 
 # Allowing CORS for frontend integration
 app.add_middleware(
@@ -25,140 +89,182 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "ETag"],
 )
 
-class AnalysisRequest(BaseModel):
+# Per-stage timers, /metrics endpoint, opt-in Server-Timing header and sampled profiling
+metrics.install(app)
+
+class AnalysisRequest(View):
+    # View fields (fields, offset, limit, options_limit, format) trim the response
     stocks: List[str]
     strategy: str
+    # Recompute even if a cached result is fresh enough
+    force_refresh: bool = False
+    # Oldest cached result (seconds) the caller accepts; defaults to ANALYSIS_MAX_AGE_SEC
+    max_age: Optional[float] = None
 
 @app.get("/")
 def read_root():
-    return {"status": "ok", "message": "Options Analyzer API is running"}
+    return {"status": "ok", "message": "Options Analyzer API is running", "upstreams": breaker_states(),
+            "replay": session_replay.REPLAY_MODE}
+
+@app.post("/analyze", response_model=AnalysisResponse)
+def analyze_options(req: AnalysisRequest, request: Request):
+    """
+    Serves the newest cached result for (stocks, strategy) when it is recent enough, with
+    its version and age; otherwise (or with force_refresh) computes, caches and returns it.
+    The ETag follows the result content, so a poll with If-None-Match gets a bodiless 304
+    until the result changes.
+    """
+    return analysis_response(request, req.stocks, req.strategy, req.force_refresh, req.max_age, req)
+
+@app.get("/analyze", response_model=AnalysisResponse)
+def analyze_options_polling(request: Request, stocks: str, strategy: str, max_age: Optional[float] = None,
+                            fields: Optional[str] = None, offset: int = Query(0, ge=0),
+                            limit: Optional[int] = Query(None, ge=1), options_limit: Optional[int] = Query(None, ge=1),
+                            format: Optional[str] = None):
+    """Cache-friendly form of POST /analyze for dashboards (stocks comma-separated, never forces a refresh)."""
+    view = View(fields=fields, offset=offset, limit=limit, options_limit=options_limit, format=format)
+    return analysis_response(request, [s.strip() for s in stocks.split(",") if s.strip()], strategy, False,
+                             max_age, view)
 
-@app.post("/analyze")
-def analyze_options(req: AnalysisRequest):
+def analysis_response(request, stocks, strategy, force_refresh, max_age, view):
+    max_age = ANALYSIS_MAX_AGE_SEC if max_age is None else max_age
+    response = None
+    if not force_refresh:
+        entry = result_cache.get(stocks, strategy)
+        if entry:
+            response = with_age(entry, cached=True)
+            if response["age_seconds"] > max_age:
+                response = None
+    if response is None:
+        entry = result_cache.put(stocks, strategy, run_analysis(stocks, strategy))
+        response = with_age(entry, cached=False)
+
+    # Weak ETag: result content + representation (view and format), not the encoding
+    digest = entry.get("digest") or content_digest(entry["data"])
+    etag = f'W/"{digest}.{view.signature()}.{negotiate_format(request, view)}"'
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return respond(request, response, AnalysisResponse, view, etag)
+
+def run_analysis(stocks, strategy):
+    kite_service = get_kite_service()
+    analyzer = get_analyzer()
+    sentiment_service = get_sentiment_service()
     results = []
     
-    # 1. Fetch Current LTPs
-    ltps = kite_service.get_ltp(req.stocks)
+    with stale_tracking() as shared_stale:
+        # 1. Fetch Current LTPs
+        ltps = kite_service.get_ltp(stocks)
+        # 2. Natural Language Sentiment for every priced stock, headlines scored in one batch
+        sentiments = sentiment_service.analyze_many([stock for stock in stocks
+                                                     if stock in ltps or f"NSE:{stock}" in ltps])
     
-    for stock in req.stocks:
-        # Zerodha returns keys prefixed with the exchange (e.g. NSE:RELIANCE)
-        spot_prefix = f"NSE:{stock}"
+    for stock in stocks:
+        with stale_tracking() as stale:
+            row = analyze_stock(stock, strategy, ltps, sentiments.get(stock), kite_service, analyzer)
+        if row:
+            # Upstreams that were down and answered from their last good data
+            row["stale"] = sorted(shared_stale | stale)
+            results.append(row)
         
-        if stock in ltps:
-            current_price = ltps[stock]["last_price"]
-        elif spot_prefix in ltps:
-            current_price = ltps[spot_prefix]["last_price"]
-        else:
-            continue
+    return results
 
+def analyze_stock(stock, strategy, ltps, sentiment_data, kite_service, analyzer):
+    # Zerodha returns keys prefixed with the exchange (e.g. NSE:RELIANCE)
+    spot_prefix = f"NSE:{stock}"
+    
+    if stock in ltps:
+        current_price = ltps[stock]["last_price"]
+    elif spot_prefix in ltps:
+        current_price = ltps[spot_prefix]["last_price"]
+    else:
+        return None
+
+    
+    # Calculate dynamic strike range (+/- 20% of LTP for Deep OTM analysis)
+    range_min = current_price * 0.80
+    range_max = current_price * 1.20
+    
+    # 3. Get real option chain around this range
+    chain = kite_service.get_option_chain(stock, current_price, range_min, range_max)
+    
+    # 4. Predict direction using the robust Advanced Strategy Engine
+    regime_data = analyzer.analyze_regime(current_price, chain, symbol=stock)
+    prediction_text = regime_data["prediction_text"]
+    pred_signal = regime_data["signal"]
+    
+    # 5. Calculate Payoffs/ROIs
+    volatility = regime_data["volatility"]
+    strategy_stats = calculate_strategy(strategy, chain, current_price, symbol=stock,
+                                        iv=volatility["atm_iv"] if volatility else None)
+    
+    if "error" in strategy_stats:
+        return None
         
-        # Calculate dynamic strike range (+/- 20% of LTP for Deep OTM analysis)
-        range_min = current_price * 0.80
-        range_max = current_price * 1.20
-        
-        # 2. Get real option chain around this range
-        chain = kite_service.get_option_chain(stock, current_price, range_min, range_max)
-        
-        # 3. Predict direction using the robust Advanced Strategy Engine
-        regime_data = analyzer.analyze_regime(current_price, chain)
-        prediction_text = regime_data["prediction_text"]
-        pred_signal = regime_data["signal"]
-        
-        # 4. Fetch Natural Language Sentiment
-        sentiment_data = sentiment_service.analyze_ticker(stock)
-        
-        # 5. Calculate Payoffs/ROIs
-        strategy_stats = calculate_strategy(req.strategy, chain, current_price)
-        
-        if "error" in strategy_stats:
-            continue
-            
-        results.append({
-            "stock": stock,
-            "spot": round(current_price, 2),
-            "prediction": prediction_text,
-            "signal": pred_signal,
-            "pcr": regime_data["pcr"],
-            "seller_recommendation": regime_data["seller_recommendation"],
-            "sentiment": sentiment_data,
-            "stats": strategy_stats
-        })
-        
-    return {"data": results}
+    return {
+        "stock": stock,
+        "spot": round(current_price, 2),
+        "prediction": prediction_text,
+        "signal": pred_signal,
+        "pcr": regime_data["pcr"],
+        "volatility": regime_data["volatility"],
+        "seller_recommendation": regime_data["seller_recommendation"],
+        "sentiment": sentiment_data,
+        "stats": strategy_stats
+    }
 
-@app.get("/positions")
-def get_positions_analysis():
+@app.get("/positions", response_model=PositionsResponse)
+def get_positions_analysis(request: Request, fields: Optional[str] = None, offset: int = Query(0, ge=0),
+                           limit: Optional[int] = Query(None, ge=1), format: Optional[str] = None):
     """
     Fetch open positions and run Exit Logic on them.
     """
+    with stale_tracking() as stale:
+        payload = analyze_positions()
+    # Upstreams that were down and answered from their last good data
+    payload["stale"] = sorted(stale)
+    view = View(fields=fields, offset=offset, limit=limit, format=format)
+    return respond(request, payload, PositionsResponse, view)
+
+def analyze_positions():
+    kite_service = get_kite_service()
     raw_positions = kite_service.get_positions()
     analyzed_positions = []
+    risk_legs = []
+    roll_legs = []
     
-    # 1. Fetch live prices for all underlying symbols in one go (optimization possible, but loop is fine for now)
-    # Actually, let's process each position
+    # Expiry, strike and underlying come from the instrument master's token map
+    contracts = [position_contract(pos, kite_service.instrument_master) for pos in raw_positions]
     
-    for pos in raw_positions:
-        # Parse Symbol and Expiry
-        # Zerodha Symbol Format: NIFTY24FEB22000CE or RELIANCE24FEB2400CE
-        # We need to extract: Underlying, Expiry Date, Strike (to calc delta if needed)
-        
+    # Fetch live prices for all underlying symbols in one go
+    underlyings = sorted({contract["underlying"] for contract in contracts})
+    ltp_data = kite_service.get_ltp(underlyings) if underlyings else {}
+    # ...and their bars for the VIX/trend checks in one bulk history request
+    if underlyings:
+        prefetch_exit_data(underlyings)
+    
+    for pos, contract in zip(raw_positions, contracts):
         tradingsymbol = pos['tradingsymbol']
-        instrument_type = pos['instrument_token'] # We might need this, but 'tradingsymbol' is easier to parse manually if needed
-        
-        # Simple parsing logic (This is fragile, ideally use instrument_token master list)
-        # But for "NIFTY" or "BANKNIFTY", it's standard. 
-        # For stocks "RELIANCE", it works too.
+        underlying = contract["underlying"]
         
-        # Fetch Underlying LTP
         # pos['last_price'] is the Option Price. We need Underlying Price.
-        # We can try to guess underlying symbol.
-        
-        underlying = "NIFTY 50" # Default fallback? No.
-        if "NIFTY" in tradingsymbol and "BANK" not in tradingsymbol:
-             underlying = "NIFTY 50"
-        elif "BANKNIFTY" in tradingsymbol:
-             underlying = "NIFTY BANK"
-        else:
-             # Extract from tradingsymbol? E.g. RELIANCE24...
-             # Regex to find the alphabetical prefix
-             match = re.match(r"([A-Z]+)", tradingsymbol)
-             if match:
-                 underlying = match.group(1)
-        
-        # Fetch Real Underlying Price
-        ltp_data = kite_service.get_ltp([underlying])
         underlying_price = 0
         if underlying in ltp_data:
              underlying_price = ltp_data[underlying]['last_price']
         elif f"NSE:{underlying}" in ltp_data:
              underlying_price = ltp_data[f"NSE:{underlying}"]['last_price']
-             
-        # Days to Expiry? 
-        # Zerodha API response usually has 'expiry' field in datetime format if we used 'net' properly?
-        # Actually 'net' positions list might NOT have expiry date directly stringified.
-        # It's better to fetch instrument master or parse string.
-        # Let's mock expiry parsing or rely on manual check for now if complex.
-        # Wait, strictly speaking we can't easily parse expiry from "NIFTY24FEB..." without a library or efficient regex.
-        # For now, let's assume we can get it or default to a safe value (to test logic).
-        # IMPROVEMENT: Use `kite.instruments()` to map token to details. Expensive to call every time.
-        # Hack: Assume 10 days if unknown to avoid false positive EXIT on time.
-        days_to_expiry = 10 
-        
-        # Exit Check
-        # entry_price = pos['average_price']
-        # current_price = pos['last_price']
-        # quantity = pos['quantity']
         
         bias = "LONG" if pos['quantity'] > 0 else "SHORT"
         
         exit_decision = check_my_exit(
-            position_type="CE" if "CE" in tradingsymbol else "PE",
+            position_type=contract["option_type"],
             bias=bias,
             current_price=pos['last_price'],
             entry_price=pos['average_price'],
-            days_to_expiry=days_to_expiry,
+            days_to_expiry=contract["days_to_expiry"],
             underlying_symbol=underlying,
             underlying_price=underlying_price
         )
@@ -172,10 +278,52 @@ def get_positions_analysis():
             "action": exit_decision['action'],
             "reason": exit_decision['reason'],
             "underlying": underlying,
-            "underlying_price": underlying_price
+            "underlying_price": underlying_price,
+            "expiry": contract["expiry"].isoformat() if contract["expiry"] else None,
+            "days_to_expiry": contract["days_to_expiry"]
         })
         
-    return {"data": analyzed_positions}
+        # Collect the leg for the portfolio-level Greeks pass
+        if contract["option_type"] in ("CE", "PE") and contract["strike"] and pos['quantity'] != 0:
+            risk_legs.append({
+                "symbol": tradingsymbol,
+                "underlying": underlying,
+                "spot": underlying_price,
+                "strike": contract["strike"],
+                "option_type": contract["option_type"],
+                "quantity": pos['quantity'],
+                "days_to_expiry": contract["calendar_days"]
+            })
+            # Short legs stopped out on P&L or trend get roll/adjustment suggestions
+            if is_rollable(bias, exit_decision):
+                roll_legs.append({
+                    "symbol": tradingsymbol,
+                    "name": contract["name"],
+                    "spot": underlying_price,
+                    "strike": contract["strike"],
+                    "option_type": contract["option_type"],
+                    "expiry": contract["expiry"],
+                    "quantity": pos['quantity'],
+                    "entry_price": pos['average_price'],
+                    "ltp": pos['last_price']
+                })
+    
+    adjustments, adjustments_truncated = roll_engine.suggest(roll_legs, kite_service) if roll_legs else ({}, False)
+    for row in analyzed_positions:
+        row["adjustments"] = adjustments.get(row["symbol"], [])
+    return {"data": analyzed_positions, "risk": risk_engine.analyze(risk_legs),
+            "adjustments_truncated": adjustments_truncated}
+
+@app.get("/sentiment/stats")
+def get_sentiment_stats():
+    """Headline scoring backend, headlines scored, cache hits and inference throughput."""
+    return get_sentiment_service().stats()
+
+@app.get("/exit-monitor")
+def get_exit_monitor_state():
+    """Per-position HOLD/EXIT state as tracked by the background exit monitor."""
+    return {"enabled": EXIT_MONITOR, "positions": exit_monitor.snapshot()}
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
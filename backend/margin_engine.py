@@ -0,0 +1,154 @@
+import os
+import json
+import logging
+import numpy as np
+
+from risk_engine import bs_greeks, DEFAULT_IV
+
+RISK_PARAMS_FILE = os.getenv(
+    "RISK_PARAMS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "risk_params.json")
+)
+
+# Standard SPAN scenario set: (fraction of price scan range, vol direction, fraction of loss covered)
+# 14 regular scenarios plus the two extreme moves that are only partially covered.
+SPAN_SCENARIOS = [
+    (0.0, 1, 1.0), (0.0, -1, 1.0),
+    (1 / 3, 1, 1.0), (1 / 3, -1, 1.0), (-1 / 3, 1, 1.0), (-1 / 3, -1, 1.0),
+    (2 / 3, 1, 1.0), (2 / 3, -1, 1.0), (-2 / 3, 1, 1.0), (-2 / 3, -1, 1.0),
+    (1.0, 1, 1.0), (1.0, -1, 1.0), (-1.0, 1, 1.0), (-1.0, -1, 1.0),
+    (None, 0, None), (None, 0, None),  # Extreme up / down, filled from the risk parameters
+]
+
+
+class MarginEstimator:
+    """
+    Local SPAN-like margin estimator. Prices every leg of every candidate across the
+    16 SPAN risk scenarios in one broadcast pass, so hedged structures (spreads, condors)
+    automatically get their hedge benefit and thousands of candidates can be margined
+    without calling the broker's margin API.
+    """
+
+    def __init__(self, params_file=RISK_PARAMS_FILE):
+        self.params_file = params_file
+        self._params = {}
+        self._params_mtime = None
+        self._ensure_loaded()
+
+    def _ensure_loaded(self):
+        """Reloads the risk-parameter file only when it changed on disk."""
+        try:
+            mtime = os.path.getmtime(self.params_file)
+        except OSError:
+            if self._params_mtime is None:
+                logging.warning(f"Risk parameter file not found at {self.params_file}. Using built-in defaults.")
+                self._params = {}
+                self._params_mtime = 0
+            return
+
+        if mtime == self._params_mtime:
+            return
+        try:
+            with open(self.params_file) as f:
+                self._params = json.load(f)
+            self._params_mtime = mtime
+        except Exception as e:
+            logging.error(f"Failed to load risk parameters from {self.params_file}: {e}")
+
+    def params_for(self, symbol):
+        """Risk parameters for an underlying, with per-symbol overrides on top of the defaults."""
+        self._ensure_loaded()
+        params = {
+            "price_scan_pct": 0.10,
+            "vol_scan": 0.04,
+            "exposure_pct": 0.035,
+            "short_option_min_pct": 0.0,
+            "extreme_move_multiple": 2.0,
+            "extreme_move_cover": 0.35,
+        }
+        params.update(self._params.get("default", {}))
+        params.update(self._params.get(symbol, {}))
+        return params
+
+    def estimate(self, symbol, spot, legs, days_to_expiry=7, iv=None):
+        """
+        Margin for a single multi-leg structure.
+        legs: list of dicts with strike, option_type ("CE"/"PE"), quantity (signed units) and price.
+        """
+        if not legs:
+            return {"span": 0.0, "exposure": 0.0, "premium": 0.0, "total": 0.0}
+
+        batch = self.estimate_batch(
+            symbol, spot,
+            strikes=[[leg["strike"] for leg in legs]],
+            option_types=[[leg["option_type"] for leg in legs]],
+            quantities=[[leg["quantity"] for leg in legs]],
+            prices=[[leg.get("price", 0.0) for leg in legs]],
+            days_to_expiry=days_to_expiry,
+            iv=iv
+        )
+        return {key: round(float(value[0]), 2) for key, value in batch.items()}
+
+    def estimate_batch(self, symbol, spot, strikes, option_types, quantities, prices, days_to_expiry=7, iv=None):
+        """
+        Margins for N candidate structures of up to K legs each. All leg inputs are (N, K)
+        array-likes; unused leg slots should carry quantity 0.
+        Returns a dict of (N,) arrays: span, exposure, premium and total.
+        """
+        params = self.params_for(symbol)
+
+        strikes = np.asarray(strikes, dtype=float)
+        qty = np.asarray(quantities, dtype=float)
+        prices = np.asarray(prices, dtype=float)
+        is_call = np.asarray(option_types) == "CE"
+        vol = iv or DEFAULT_IV
+        t = max(days_to_expiry, 0) / 365.0
+
+        if strikes.size == 0:
+            empty = np.zeros(len(strikes))
+            return {"span": empty, "exposure": empty, "premium": empty, "total": empty}
+
+        # Scenario grid -> (S,) arrays of spot moves, vol moves and loss cover
+        psr = params["price_scan_pct"]
+        moves, vol_moves, covers = [], [], []
+        extreme_sign = 1
+        for move, vol_dir, cover in SPAN_SCENARIOS:
+            if move is None:
+                moves.append(extreme_sign * params["extreme_move_multiple"] * psr)
+                vol_moves.append(0.0)
+                covers.append(params["extreme_move_cover"])
+                extreme_sign = -1
+            else:
+                moves.append(move * psr)
+                vol_moves.append(vol_dir * params["vol_scan"])
+                covers.append(cover)
+        moves = np.array(moves)
+        vol_moves = np.array(vol_moves)
+        covers = np.array(covers)
+
+        # Shapes: (N, S, K)
+        base = bs_greeks(spot, strikes, t, vol, is_call)["price"]
+        scenario_spot = spot * (1.0 + moves)[None, :, None]
+        scenario_vol = np.maximum(vol + vol_moves, 0.01)[None, :, None]
+        shocked = bs_greeks(scenario_spot, strikes[:, None, :], t, scenario_vol, is_call[:, None, :])["price"]
+
+        scenario_loss = -((shocked - base[:, None, :]) * qty[:, None, :]).sum(axis=2) * covers[None, :]
+        span = np.maximum(scenario_loss.max(axis=1), 0.0)
+
+        short_qty = np.where(qty < 0, -qty, 0.0).sum(axis=1)
+        span = np.maximum(span, params["short_option_min_pct"] * spot * short_qty)
+
+        # Exposure margin is charged on the notional of the short legs, hedged or not
+        exposure = params["exposure_pct"] * spot * short_qty
+
+        # Net premium to be paid upfront (debit structures only)
+        premium = np.maximum((prices * qty).sum(axis=1), 0.0)
+
+        has_short = short_qty > 0
+        total = np.where(has_short, span + exposure + premium, premium)
+        span = np.where(has_short, span, 0.0)
+
+        return {"span": span, "exposure": exposure, "premium": premium, "total": total}
+
+
+# Initialize singleton
+margin_engine = MarginEstimator()
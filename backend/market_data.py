@@ -0,0 +1,117 @@
+import os
+import logging
+
+from instrument_master import INDEX_SPOT_SYMBOLS, spot_symbol
+from shared_cache import get_shared_cache
+from circuit_breaker import CircuitBreaker, UpstreamUnavailable
+from metrics import registry, timer
+import session_replay
+
+# Seconds historical bars stay in the shared cache (well inside one 15-minute bar)
+HISTORY_CACHE_TTL_SEC = float(os.getenv("HISTORY_CACHE_TTL_SEC", "60"))
+# Parallel per-ticker requests yfinance makes inside one bulk download
+HISTORY_FETCH_CONCURRENCY = int(os.getenv("HISTORY_FETCH_CONCURRENCY", "8"))
+# Longest a yfinance call (bulk download, news, calendar) may take before callers degrade
+YFINANCE_TIMEOUT_SEC = float(os.getenv("YFINANCE_TIMEOUT_SEC", "10"))
+
+# NSE spot symbols (as quoted by Kite) whose Yahoo Finance ticker is not "<symbol>.NS"
+YF_INDEX_SYMBOLS = {
+    "NIFTY 50": "^NSEI",
+    "NIFTY BANK": "^NSEBANK",
+    "NIFTY FIN SERVICE": "NIFTY_FIN_SERVICE.NS",
+    "NIFTY MID SELECT": "NIFTY_MID_SELECT.NS",
+    "INDIA VIX": "^INDIAVIX",
+}
+
+# Shared by every yfinance caller (history, news sentiment, event calendar)
+yfinance_breaker = CircuitBreaker("yfinance", YFINANCE_TIMEOUT_SEC)
+
+HISTORY_REQUESTS = registry.counter("optrec_history_symbols_total",
+                                    "Symbols requested from the bulk history loader, by cache result.")
+
+
+def yf_symbol(symbol):
+    """
+    Yahoo Finance ticker for an NSE symbol in any of the forms used around the app:
+    "RELIANCE", "NSE:RELIANCE", derivative names ("NIFTY", "BANKNIFTY") and Kite index
+    names ("NIFTY 50", "NIFTY BANK"). Tickers already in Yahoo form pass through.
+    """
+    symbol = symbol.replace("NSE:", "").strip()
+    if symbol.startswith("^") or symbol.endswith(".NS"):
+        return symbol
+    symbol = spot_symbol(symbol) if symbol in INDEX_SPOT_SYMBOLS else symbol
+    return YF_INDEX_SYMBOLS.get(symbol, f"{symbol}.NS")
+
+
+class HistoryLoader:
+    """
+    Historical bars for many symbols at once. Symbols missing from the shared cache are
+    fetched together in one yfinance bulk download (which fans out over its own thread
+    pool), so a refresh across N underlyings costs one upstream request instead of N and
+    every worker reuses the result for HISTORY_CACHE_TTL_SEC. While yfinance is failing the
+    last good bars are served (stale) rather than none.
+    """
+
+    def __init__(self, ttl=HISTORY_CACHE_TTL_SEC, concurrency=HISTORY_FETCH_CONCURRENCY):
+        self.ttl = ttl
+        self.concurrency = concurrency
+
+    def bars(self, symbols, period="5d", interval="15m"):
+        """{symbol: OHLCV DataFrame} for the requested symbols; symbols without data are left out."""
+        tickers = {symbol: yf_symbol(symbol) for symbol in symbols}
+        keys = {ticker: f"history:{ticker}:{period}:{interval}" for ticker in set(tickers.values())}
+
+        cache = get_shared_cache()
+        found = cache.get_many(list(keys.values()))
+        frames = {ticker: found[key] for ticker, key in keys.items() if key in found}
+        missing = sorted(ticker for ticker in keys if ticker not in frames)
+        HISTORY_REQUESTS.inc(len(frames), result="hit")
+
+        if missing:
+            HISTORY_REQUESTS.inc(len(missing), result="miss")
+            fetched = self._download(missing, period, interval)
+            if fetched:
+                cache.set_many({keys[ticker]: frame for ticker, frame in fetched.items()}, self.ttl)
+                yfinance_breaker.remember({keys[ticker]: frame for ticker, frame in fetched.items()})
+            else:
+                fallback = yfinance_breaker.last_good([keys[ticker] for ticker in missing])
+                fetched = {ticker: fallback[keys[ticker]] for ticker in missing if keys[ticker] in fallback}
+            frames.update(fetched)
+
+        return {symbol: frames[ticker] for symbol, ticker in tickers.items() if ticker in frames}
+
+    def _download(self, tickers, period, interval):
+        # Deferred import: yfinance (and pandas under it) is only needed once bars are fetched
+        yf = session_replay.yfinance()
+
+        def download():
+            data = yf.download(tickers, period=period, interval=interval, group_by="ticker",
+                               threads=self.concurrency, progress=False, auto_adjust=False)
+            # yfinance reports per-ticker failures by leaving them out; nothing at all is a failure
+            if data is None or data.empty:
+                raise ValueError("empty response")
+            return data
+
+        try:
+            with timer("yfinance.download"):
+                data = yfinance_breaker.call(download)
+        except UpstreamUnavailable as e:
+            logging.warning(f"Bulk history download failed for {len(tickers)} symbols: {e}")
+            return {}
+
+        frames = {}
+        for ticker in tickers:
+            if data.columns.nlevels > 1:
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                frame = data[ticker]
+            else:
+                frame = data
+            frame = frame.dropna(how="all")
+            if not frame.empty:
+                frames[ticker] = frame
+        return frames
+
+
+# Initialize singleton
+history_loader = HistoryLoader()
@@ -0,0 +1,423 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from instrument_master import CACHE_DIR
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Fraction of requests to run under the stack sampler (0 disables), and where profiles go
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(CACHE_DIR, "profiles"))
+# Always add Server-Timing; otherwise only when the client sends `X-Server-Timing: 1`
+SERVER_TIMING_ALWAYS = os.getenv("SERVER_TIMING", "0") == "1"
+# Append every /analyze and /positions request (method, path, query, body) to this JSON-lines
+# file, to be replayed by benchmarks/load_test.py. Unset disables recording.
+REQUEST_LOG_FILE = os.getenv("REQUEST_LOG_FILE")
+RECORDED_PATHS = ("/analyze", "/positions")
+# With a cross-process shared cache (CACHE_BACKEND sqlite/redis) every worker publishes its
+# metrics there this often, and /metrics serves the sum over all live workers
+METRICS_PUBLISH_SEC = float(os.getenv("METRICS_PUBLISH_SEC", "5"))
+# A worker that has not published for this long (e.g. it exited) drops out of the totals
+METRICS_WORKER_TTL_SEC = 3 * METRICS_PUBLISH_SEC
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Per-request list of (stage, seconds), read by the Server-Timing middleware
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _escape_label(value):
+    """Label value escaped for the text exposition format (backslash, double quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, snapshots):
+        """One series set from several workers' snapshots: counts add up."""
+        merged = {}
+        for _, values in snapshots:
+            for key, value in values.items():
+                merged[key] = merged.get(key, 0.0) + value
+        return merged
+
+    def expose(self, values=None):
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+    def merge(self, snapshots):
+        """Gauges are per-process state (e.g. a breaker's), so each worker keeps its own series."""
+        return {tuple(sorted(key + (("worker", worker),))): value
+                for worker, values in snapshots for key, value in values.items()}
+
+    def expose(self, values=None):
+        lines = super().expose(values)
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {**series, "counts": list(series["counts"])} for key, series in self._series.items()}
+
+    def merge(self, snapshots):
+        """One series set from several workers' snapshots: bucket counts, sums and counts add up."""
+        merged = {}
+        for _, all_series in snapshots:
+            for key, series in all_series.items():
+                total = merged.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+                total["counts"] = [a + b for a, b in zip(total["counts"], series["counts"])]
+                total["sum"] += series["sum"]
+                total["count"] += series["count"]
+        return merged
+
+    def expose(self, all_series=None):
+        all_series = self.snapshot() if all_series is None else all_series
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in all_series.items():
+            for bound, count in zip(self.buckets, series["counts"]):
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class Registry:
+    """Minimal Prometheus registry rendering the text exposition format (v0.0.4)."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        return self._metrics.get(name) or self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self._metrics.get(name) or self.register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._metrics.get(name) or self.register(Histogram(name, help_text, buckets))
+
+    def snapshot(self):
+        """{metric name: series}, picklable, for publishing to other workers."""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def render(self, workers=None):
+        """
+        This process's metrics, or with `workers` ({worker id: snapshot()}) the totals over
+        all of them.
+        """
+        lines = []
+        for name, metric in self._metrics.items():
+            if workers is None:
+                lines.extend(metric.expose())
+            else:
+                lines.extend(metric.expose(metric.merge(
+                    [(worker, snapshot[name]) for worker, snapshot in workers.items() if name in snapshot])))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_DURATION = registry.histogram("optrec_stage_duration_seconds", "Time spent in each hot-path stage.")
+STAGE_ERRORS = registry.counter("optrec_stage_errors_total", "Exceptions raised out of each hot-path stage.")
+HTTP_DURATION = registry.histogram("optrec_http_request_duration_seconds", "End-to-end HTTP request latency.")
+# path label of requests that matched no route
+UNMATCHED_PATH = "<unmatched>"
+SELLER_COMBINATIONS = registry.histogram(
+    "optrec_seller_combinations_evaluated", "Spread/condor combinations evaluated per seller search.",
+    buckets=(10, 100, 1000, 10000, 100000, 1000000)
+)
+
+
+def observe_stage(stage, seconds):
+    STAGE_DURATION.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timer(stage):
+    """Times a block into optrec_stage_duration_seconds{stage=...} and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator form of timer()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(timings):
+    """Server-Timing value, summing repeated stages (e.g. one get_option_chain per stock)."""
+    totals, counts = {}, {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+        counts[stage] = counts.get(stage, 0) + 1
+    parts = []
+    for stage, seconds in totals.items():
+        name = stage.replace(".", "_")
+        parts.append(f'{name};dur={seconds * 1000:.1f};desc="{stage} x{counts[stage]}"')
+    return ", ".join(parts)
+
+
+# --- Cross-worker aggregation ---
+
+_WORKERS_KEY = "metrics:workers"
+
+
+def _worker_cache():
+    """The shared cache when workers can see each other's entries, else None (single process)."""
+    # Deferred import: shared_cache itself registers metrics
+    from shared_cache import CACHE_BACKEND, get_shared_cache
+    return get_shared_cache() if CACHE_BACKEND != "memory" else None
+
+
+def publish_metrics(cache):
+    """Stores this worker's snapshot and keeps it listed among the live workers."""
+    cache.set(f"metrics:worker:{WORKER_ID}", registry.snapshot(), METRICS_WORKER_TTL_SEC)
+    with cache.lock(_WORKERS_KEY, ttl=5, timeout=2) as acquired:
+        if not acquired:
+            return
+        now = time.time()
+        workers = {worker: seen for worker, seen in (cache.get(_WORKERS_KEY) or {}).items()
+                   if now - seen < METRICS_WORKER_TTL_SEC}
+        workers[WORKER_ID] = now
+        cache.set(_WORKERS_KEY, workers, METRICS_WORKER_TTL_SEC)
+
+
+def render_metrics():
+    """The /metrics body: totals over every live worker when they share a cache, else this process's."""
+    cache = _worker_cache()
+    if cache is None:
+        return registry.render()
+    publish_metrics(cache)
+    workers = list(cache.get(_WORKERS_KEY) or {})
+    snapshots = cache.get_many([f"metrics:worker:{worker}" for worker in workers])
+    found = {worker: snapshots[f"metrics:worker:{worker}"] for worker in workers
+             if f"metrics:worker:{worker}" in snapshots}
+    # Our own numbers as of now, not as of the cache round trip
+    found[WORKER_ID] = registry.snapshot()
+    return registry.render(found)
+
+
+def _publish_loop():
+    while True:
+        time.sleep(METRICS_PUBLISH_SEC)
+        try:
+            publish_metrics(_worker_cache())
+        except Exception as e:
+            logging.warning(f"Publishing worker metrics failed: {e}")
+
+
+def install(app):
+    """
+    Adds the timing/profiling middleware and the /metrics endpoint to a FastAPI app. With
+    several workers on a sqlite/redis shared cache, any worker's /metrics reports the totals
+    over all of them (gauges per worker, labelled `worker`).
+    """
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def metrics_middleware(request: Request, call_next):
+        if REQUEST_LOG_FILE and request.url.path in RECORDED_PATHS:
+            await record_request(request)
+        timings = []
+        token = _request_timings.set(timings)
+        profiler = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = start_profile()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            _request_timings.reset(token)
+            if profiler:
+                stop_profile(profiler, request.url.path)
+            # Route templates only: raw URLs of unmatched requests (404 probes) would make unbounded series
+            route = request.scope.get("route")
+            HTTP_DURATION.observe(time.perf_counter() - start, method=request.method,
+                                  path=getattr(route, "path", UNMATCHED_PATH), status=status)
+
+        if timings and (SERVER_TIMING_ALWAYS or request.headers.get("x-server-timing") == "1"):
+            response.headers["Server-Timing"] = server_timing_header(timings)
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+    from shared_cache import CACHE_BACKEND
+    if CACHE_BACKEND != "memory":
+        threading.Thread(target=_publish_loop, name="metrics-publisher", daemon=True).start()
+
+
+_request_log_lock = threading.Lock()
+
+
+async def record_request(request):
+    """Appends the request to REQUEST_LOG_FILE in the load-test replay format."""
+    body = await request.body()
+    entry = {
+        "t": round(time.time(), 3),
+        "method": request.method,
+        "path": request.url.path,
+        "query": request.url.query,
+        "body": body.decode("utf-8", "replace") if body else None,
+    }
+    try:
+        with _request_log_lock, open(REQUEST_LOG_FILE, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        logging.warning(f"Request log write failed ({REQUEST_LOG_FILE}): {e}")
+
+
+# --- Sampling profiler hooks ---
+# Hooks are (start, stop) callables. The default pair is a wall-clock stack sampler that
+# snapshots every thread (sync endpoints run in the threadpool, not the event loop thread)
+# and writes collapsed stacks, ready for flamegraph.pl / speedscope. Replace them with
+# register_profiler(...) to plug in pyinstrument, py-spy triggers, etc.
+class StackSampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def _sampler_start():
+    return StackSampler().start()
+
+
+def _sampler_stop(sampler, label):
+    stacks = sampler.stop()
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = label.strip("/").replace("/", "_") or "root"
+        with open(os.path.join(PROFILE_DIR, f"{name}_{int(time.time() * 1000)}.folded"), "w") as f:
+            for stack, count in stacks.items():
+                f.write(f"{stack} {count}\n")
+    except Exception as e:
+        logging.warning(f"Failed to write profile for {label}: {e}")
+
+
+_profiler_hooks = {"start": _sampler_start, "stop": _sampler_stop}
+
+
+def register_profiler(start, stop):
+    """start() -> handle; stop(handle, label) persists it."""
+    _profiler_hooks["start"] = start
+    _profiler_hooks["stop"] = stop
+
+
+def start_profile():
+    return _profiler_hooks["start"]()
+
+
+def stop_profile(handle, label):
+    _profiler_hooks["stop"](handle, label)
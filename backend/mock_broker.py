@@ -0,0 +1,204 @@
+"""
+Local mock of the Kite Connect REST API for tests, benchmarks and offline development.
+
+    python mock_broker.py            # serves on :8001
+    KITE_ROOT_URL=http://localhost:8001 KITE_API_KEY=mock KITE_ACCESS_TOKEN=mock uvicorn main:app
+
+Serves a deterministic synthetic universe (instrument dump, quotes, positions) in the
+same envelope Kite uses, with optional injected latency, token expiry and rate limits.
+"""
+import os
+import csv
+import time
+import random
+import asyncio
+from io import StringIO
+from datetime import date, timedelta
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from risk_engine import bs_greeks, option_symbol
+from async_kite_service import RATE_LIMITS
+
+# underlying -> (spot symbol on NSE, spot price, strike step, lot size)
+UNIVERSE = {
+    "NIFTY": ("NIFTY 50", 22000.0, 50, 25),
+    "BANKNIFTY": ("NIFTY BANK", 47000.0, 100, 15),
+    "RELIANCE": ("RELIANCE", 2900.0, 20, 250),
+    "TCS": ("TCS", 3900.0, 50, 175),
+    "INFY": ("INFY", 1650.0, 20, 400),
+    "HDFCBANK": ("HDFCBANK", 1500.0, 10, 550),
+    "SBIN": ("SBIN", 760.0, 5, 1500),
+}
+STRIKES_PER_SIDE = 30
+MOCK_IV = 0.18
+# Open book: a short OTM call and a long OTM put (strike steps from ATM) on the nearest expiry of each
+POSITION_UNDERLYINGS = ("NIFTY", "BANKNIFTY", "RELIANCE")
+POSITION_OTM_STEPS = 3
+
+LATENCY_MS = float(os.getenv("MOCK_BROKER_LATENCY_MS", "0"))
+ENFORCE_LIMITS = os.getenv("MOCK_BROKER_ENFORCE_LIMITS") == "1"
+
+
+def expiries(today=None, count=2):
+    """Next `count` weekly Thursday expiries."""
+    today = today or date.today()
+    first = today + timedelta(days=(3 - today.weekday()) % 7 or 7)
+    return [first + timedelta(weeks=i) for i in range(count)]
+
+
+def build_instruments(today=None):
+    """Synthetic NFO instrument dump with the same fields as kite.instruments("NFO")."""
+    records = []
+    token = 100000
+    for name, (_, spot, step, lot_size) in UNIVERSE.items():
+        atm = round(spot / step) * step
+        for expiry in expiries(today):
+            for i in range(-STRIKES_PER_SIDE, STRIKES_PER_SIDE + 1):
+                strike = atm + i * step
+                for opt_type in ("CE", "PE"):
+                    token += 1
+                    records.append({
+                        "instrument_token": token,
+                        "exchange_token": str(token // 256),
+                        "tradingsymbol": option_symbol(name, expiry, strike, opt_type),
+                        "name": name,
+                        "last_price": 0.0,
+                        "expiry": expiry,
+                        "strike": float(strike),
+                        "tick_size": 0.05,
+                        "lot_size": lot_size,
+                        "instrument_type": opt_type,
+                        "segment": "NFO-OPT",
+                        "exchange": "NFO",
+                    })
+    return records
+
+
+class MockMarket:
+    """Holds the synthetic universe and prices quotes from a slowly drifting spot."""
+
+    def __init__(self, seed=7):
+        self.rng = random.Random(seed)
+        self.instruments = build_instruments()
+        self.by_symbol = {f"NFO:{inst['tradingsymbol']}": inst for inst in self.instruments}
+        self.spots = {spot_symbol: spot for spot_symbol, spot, _, _ in UNIVERSE.values()}
+        self.token_expired = False
+
+    def tick(self):
+        for symbol in self.spots:
+            self.spots[symbol] *= 1 + self.rng.gauss(0, 0.0005)
+
+    def spot_for(self, name):
+        return self.spots[UNIVERSE[name][0]]
+
+    def quote(self, instruments):
+        data = {}
+        for inst in instruments:
+            exchange, _, symbol = inst.partition(":")
+            if exchange == "NSE" and symbol in self.spots:
+                data[inst] = self._quote_payload(self.spots[symbol])
+            elif inst in self.by_symbol:
+                contract = self.by_symbol[inst]
+                days = max((contract["expiry"] - date.today()).days, 0)
+                price = float(bs_greeks(self.spot_for(contract["name"]), contract["strike"], days / 365.0,
+                                        MOCK_IV, contract["instrument_type"] == "CE")["price"])
+                data[inst] = self._quote_payload(round(max(price, 0.05) * 20) / 20)
+        return data
+
+    def _quote_payload(self, price):
+        return {"last_price": round(price, 2), "ohlc": {"open": price, "high": price, "low": price, "close": price}}
+
+    def _position_legs(self):
+        """(contract, lots) for each underlying in POSITION_UNDERLYINGS."""
+        legs = []
+        for name in POSITION_UNDERLYINGS:
+            _, spot, step, _ = UNIVERSE[name]
+            atm = round(spot / step) * step
+            nearest = min(inst["expiry"] for inst in self.instruments if inst["name"] == name)
+            wanted = {("CE", atm + POSITION_OTM_STEPS * step): -1, ("PE", atm - POSITION_OTM_STEPS * step): 1}
+            legs.extend((inst, wanted[(inst["instrument_type"], inst["strike"])]) for inst in self.instruments
+                        if inst["name"] == name and inst["expiry"] == nearest
+                        and (inst["instrument_type"], inst["strike"]) in wanted)
+        return legs
+
+    def positions(self):
+        net = []
+        for inst, lots in self._position_legs():
+            ltp = self.quote([f"NFO:{inst['tradingsymbol']}"])[f"NFO:{inst['tradingsymbol']}"]["last_price"]
+            qty = inst["lot_size"] * lots
+            avg = round(ltp * (1.1 if qty < 0 else 0.9), 2)
+            net.append({
+                "tradingsymbol": inst["tradingsymbol"],
+                "instrument_token": inst["instrument_token"],
+                "exchange": "NFO",
+                "product": "NRML",
+                "quantity": qty,
+                "average_price": avg,
+                "last_price": ltp,
+                "pnl": round((ltp - avg) * qty, 2),
+            })
+        return {"net": net, "day": []}
+
+
+market = MockMarket()
+app = FastAPI(title="Mock Kite Connect")
+_last_call = {}
+
+
+def _ok(data):
+    return JSONResponse({"status": "success", "data": data})
+
+
+def _error(error_type, message, status_code):
+    return JSONResponse({"status": "error", "error_type": error_type, "message": message}, status_code=status_code)
+
+
+@app.middleware("http")
+async def broker_behaviour(request: Request, call_next):
+    if LATENCY_MS:
+        await asyncio.sleep(LATENCY_MS / 1000.0 * (0.5 + random.random()))
+    if market.token_expired and not request.url.path.startswith("/_mock"):
+        return _error("TokenException", "Incorrect `api_key` or `access_token`.", 403)
+    if ENFORCE_LIMITS:
+        group = "quote" if request.url.path.startswith("/quote") else "default"
+        now = time.monotonic()
+        if now - _last_call.get(group, 0) < 1.0 / RATE_LIMITS[group]:
+            return _error("NetworkException", "Too many requests", 429)
+        _last_call[group] = now
+    return await call_next(request)
+
+
+@app.get("/quote")
+def quote(request: Request):
+    market.tick()
+    return _ok(market.quote(request.query_params.getlist("i")))
+
+
+@app.get("/instruments/{exchange}")
+def instruments(exchange: str):
+    out = StringIO()
+    fields = list(market.instruments[0].keys())
+    writer = csv.DictWriter(out, fieldnames=fields)
+    writer.writeheader()
+    if exchange == "NFO":
+        writer.writerows(market.instruments)
+    return PlainTextResponse(out.getvalue(), media_type="text/csv")
+
+
+@app.get("/portfolio/positions")
+def positions():
+    return _ok(market.positions())
+
+
+@app.post("/_mock/expire_token")
+def expire_token(expired: bool = True):
+    """Test hook: make every API call fail with TokenException until reset."""
+    market.token_expired = expired
+    return {"token_expired": expired}
+
+
+if __name__ == "__main__":
+    uvicorn.run("mock_broker:app", host="0.0.0.0", port=int(os.getenv("MOCK_BROKER_PORT", "8001")))
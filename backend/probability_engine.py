@@ -0,0 +1,180 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.special import ndtr
+
+from risk_engine import RISK_FREE_RATE, DEFAULT_IV, MIN_TIME_TO_EXPIRY
+
+# "lognormal" (closed form) or "montecarlo" (simulated terminal prices)
+POP_MODEL = os.getenv("POP_MODEL", "lognormal")
+MC_PATHS = int(os.getenv("MC_PATHS", "50000"))
+MC_SEED = int(os.getenv("MC_SEED", "7"))
+# Distributions kept per (model, spot, vol, time to expiry)
+DISTRIBUTION_CACHE_SIZE = 64
+
+
+class LognormalDistribution:
+    """Risk-neutral lognormal terminal price: ln S_T ~ N(ln S + (r - vol^2/2) t, vol^2 t)."""
+
+    def __init__(self, spot, vol, t, r=RISK_FREE_RATE):
+        t = max(t, MIN_TIME_TO_EXPIRY)
+        self.forward = spot * np.exp(r * t)
+        self.std = max(vol, 1e-6) * np.sqrt(t)
+        self.mean = self.forward
+
+    def _d2(self, x):
+        with np.errstate(divide="ignore"):
+            return (np.log(self.forward / x) - 0.5 * self.std ** 2) / self.std
+
+    def cdf(self, x):
+        """P(S_T <= x); broadcasts, handles x = 0 and x = inf."""
+        x = np.asarray(x, dtype=float)
+        return ndtr(-self._d2(x))
+
+    def upper_mean(self, x):
+        """E[S_T; S_T > x], the partial expectation above x."""
+        x = np.asarray(x, dtype=float)
+        return self.forward * ndtr(self._d2(x) + self.std)
+
+
+class EmpiricalDistribution:
+    """
+    Monte Carlo terminal prices from antithetic normal draws. Samples are kept sorted with
+    prefix sums, so probabilities and partial expectations are lookups (searchsorted)
+    instead of a pass over every path for every candidate.
+    """
+
+    def __init__(self, spot, vol, t, r=RISK_FREE_RATE, paths=MC_PATHS, seed=MC_SEED, batch_size=65536):
+        t = max(t, MIN_TIME_TO_EXPIRY)
+        rng = np.random.default_rng(seed)
+        drift = (r - 0.5 * vol ** 2) * t
+        std = vol * np.sqrt(t)
+
+        half = max(paths // 2, 1)
+        batches = []
+        for start in range(0, half, batch_size):
+            z = rng.standard_normal(min(batch_size, half - start))
+            batches.append(spot * np.exp(drift + std * z))
+            batches.append(spot * np.exp(drift - std * z))  # Antithetic pair
+
+        self.samples = np.sort(np.concatenate(batches))
+        self.count = len(self.samples)
+        self._suffix = np.concatenate([np.cumsum(self.samples[::-1])[::-1], [0.0]])
+        self.mean = self._suffix[0] / self.count
+
+    def cdf(self, x):
+        x = np.asarray(x, dtype=float)
+        return np.searchsorted(self.samples, x, side="right") / self.count
+
+    def upper_mean(self, x):
+        x = np.asarray(x, dtype=float)
+        return self._suffix[np.searchsorted(self.samples, x, side="right")] / self.count
+
+
+class ProbabilityEngine:
+    """
+    Probability of profit and expected payoff at expiry for arbitrary multi-leg option
+    positions. Payoffs of vanilla legs are piecewise linear in the terminal price with
+    knots at the strikes, so both quantities reduce to distribution lookups at a handful
+    of points per candidate:
+
+      - expected payoff: E[(S-K)+] = E[S; S>K] - K P(S>K) and the put analogue,
+      - POP: the profitable intervals between knots (and past the last one) are found
+        from the payoff at each knot, then measured with the CDF.
+
+    Everything broadcasts over (candidates, legs), so thousands of spreads or condors are
+    scored in one call. Terminal distributions are cached per (model, spot, vol, expiry).
+    """
+
+    def __init__(self, model=POP_MODEL, paths=MC_PATHS, seed=MC_SEED, cache_size=DISTRIBUTION_CACHE_SIZE):
+        self.model = model
+        self.paths = paths
+        self.seed = seed
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def distribution(self, spot, t, vol=None, model=None):
+        model = model or self.model
+        vol = DEFAULT_IV if vol is None else vol
+        key = (model, round(float(spot), 4), round(float(vol), 6), round(float(t), 8))
+        with self._lock:
+            dist = self._cache.get(key)
+            if dist is not None:
+                self._cache.move_to_end(key)
+                return dist
+
+        if model == "montecarlo":
+            dist = EmpiricalDistribution(spot, vol, t, paths=self.paths, seed=self.seed)
+        elif model == "lognormal":
+            dist = LognormalDistribution(spot, vol, t)
+        else:
+            raise ValueError(f"Unknown probability model: {model}")
+
+        with self._lock:
+            self._cache[key] = dist
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dist
+
+    def evaluate(self, spot, t, strikes, option_types, quantities, credit, vol=None, model=None):
+        """
+        Scores N candidate structures of K legs each.
+
+        strikes, option_types ("CE"/"PE") and quantities (signed, per share: -1 short, +1 long)
+        are (N, K); pad unused legs with quantity 0. credit is the net premium received per
+        share, shape (N,). Returns {"pop": P(payoff > 0), "expected_payoff": E[payoff]}, both
+        (N,) and per share.
+        """
+        dist = self.distribution(spot, t, vol, model)
+        strikes = np.atleast_2d(np.asarray(strikes, dtype=float))
+        is_call = np.atleast_2d(np.asarray(option_types) == "CE")
+        qty = np.atleast_2d(np.asarray(quantities, dtype=float))
+        credit = np.asarray(credit, dtype=float).reshape(-1)
+
+        # Expected payoff, leg by leg
+        above = 1.0 - dist.cdf(strikes)
+        upper = dist.upper_mean(strikes)
+        call_value = upper - strikes * above
+        put_value = strikes * (1.0 - above) - (dist.mean - upper)
+        expected = credit + np.sum(qty * np.where(is_call, call_value, put_value), axis=1)
+
+        # Payoff at the knots: S = 0 and every strike, in ascending order
+        knots = np.concatenate([np.zeros((len(credit), 1)), np.sort(strikes, axis=1)], axis=1)
+        values = self.payoff(knots, strikes, is_call, qty, credit)
+        slope_right = np.sum(np.where(is_call, qty, 0.0), axis=1)
+
+        a, b = knots[:, :-1], knots[:, 1:]
+        va, vb = values[:, :-1], values[:, 1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            root = a + (b - a) * va / (va - vb)
+        lo = np.where(va > 0, a, root)
+        hi = np.where(vb > 0, b, root)
+        inside = (va > 0) | (vb > 0)
+        pop = np.sum(np.where(inside, dist.cdf(np.where(inside, hi, 0.0)) - dist.cdf(np.where(inside, lo, 0.0)), 0.0), axis=1)
+
+        # Beyond the highest strike the payoff moves with the net call quantity
+        last = knots[:, -1]
+        v_last = values[:, -1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cross = last - v_last / slope_right
+        ray_lo = np.where(v_last > 0, last, np.where(slope_right > 0, cross, np.inf))
+        ray_hi = np.where(slope_right >= 0, np.inf, np.where(v_last > 0, cross, last))
+        ray_hi = np.where(slope_right == 0, np.where(v_last > 0, np.inf, last), ray_hi)
+        pop += np.maximum(dist.cdf(ray_hi) - dist.cdf(np.minimum(ray_lo, ray_hi)), 0.0)
+
+        return {"pop": np.clip(pop, 0.0, 1.0), "expected_payoff": expected}
+
+    @staticmethod
+    def payoff(prices, strikes, is_call, qty, credit):
+        """Payoff at expiry per share for (N, P) terminal prices."""
+        prices = prices[:, :, None]
+        intrinsic = np.where(is_call[:, None, :], np.maximum(prices - strikes[:, None, :], 0.0),
+                             np.maximum(strikes[:, None, :] - prices, 0.0))
+        return credit[:, None] + np.sum(qty[:, None, :] * intrinsic, axis=2)
+
+
+# Initialize singleton
+probability_engine = ProbabilityEngine()
@@ -0,0 +1,183 @@
+import re
+from datetime import timedelta
+import numpy as np
+from scipy.special import ndtr
+
+# Model defaults, kept in line with the assumptions used by the seller screener
+RISK_FREE_RATE = 0.07
+DEFAULT_IV = 0.20
+MIN_TIME_TO_EXPIRY = 1.0 / (365.0 * 24.0)  # One hour, avoids division by zero on expiry day
+
+# Monthly contracts: NIFTY24FEB22000CE | Weekly contracts: NIFTY2421522000CE (YY, M, DD)
+_MONTHLY_SYMBOL = re.compile(r"^([A-Z&\-]+)(\d{2})([A-Z]{3})(\d+(?:\.\d+)?)(CE|PE)$")
+_WEEKLY_SYMBOL = re.compile(r"^([A-Z&\-]+)(\d{2})([1-9OND])(\d{2})(\d+(?:\.\d+)?)(CE|PE)$")
+
+
+def parse_option_symbol(tradingsymbol):
+    """
+    Best-effort parse of a Zerodha option tradingsymbol into (underlying, strike, option_type).
+    Returns None when the symbol is not an option contract.
+    """
+    match = _MONTHLY_SYMBOL.match(tradingsymbol)
+    if match:
+        return match.group(1), float(match.group(4)), match.group(5)
+
+    match = _WEEKLY_SYMBOL.match(tradingsymbol)
+    if match:
+        return match.group(1), float(match.group(5)), match.group(6)
+
+    return None
+
+
+def option_symbol(name, expiry, strike, option_type):
+    """
+    Zerodha tradingsymbol of an option contract. The last expiry of a month uses the monthly
+    format (NIFTY24FEB22000CE), earlier weekly expiries the YY-M-DD one (NIFTY2421522000CE).
+    """
+    strike = int(strike) if float(strike).is_integer() else strike
+    if (expiry + timedelta(weeks=1)).month != expiry.month:
+        return f"{name}{expiry:%y%b}{strike}{option_type}".upper()
+    month = "123456789OND"[expiry.month - 1]
+    return f"{name}{expiry:%y}{month}{expiry:%d}{strike}{option_type}"
+
+
+def bs_greeks(spot, strike, t, vol, is_call, r=RISK_FREE_RATE):
+    """
+    Vectorized Black-Scholes price and Greeks. Every argument broadcasts as a numpy array,
+    so a whole book (or a whole scenario grid) is evaluated in a single pass.
+
+    Theta is returned per calendar day and Vega per 1 volatility point (1%).
+    """
+    spot = np.asarray(spot, dtype=float)
+    strike = np.asarray(strike, dtype=float)
+    t = np.maximum(np.asarray(t, dtype=float), MIN_TIME_TO_EXPIRY)
+    vol = np.maximum(np.asarray(vol, dtype=float), 1e-4)
+    is_call = np.asarray(is_call, dtype=bool)
+
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(spot / strike) + (r + 0.5 * vol ** 2) * t) / (vol * sqrt_t)
+    d2 = d1 - vol * sqrt_t
+
+    pdf_d1 = np.exp(-0.5 * d1 ** 2) / np.sqrt(2.0 * np.pi)
+    discount = np.exp(-r * t)
+
+    cdf_d1 = ndtr(d1)
+    cdf_d2 = ndtr(d2)
+
+    call_price = spot * cdf_d1 - strike * discount * cdf_d2
+    put_price = call_price - spot + strike * discount  # Put-call parity
+
+    price = np.where(is_call, call_price, put_price)
+    delta = np.where(is_call, cdf_d1, cdf_d1 - 1.0)
+    gamma = pdf_d1 / (spot * vol * sqrt_t)
+    vega = spot * pdf_d1 * sqrt_t / 100.0
+
+    decay = -(spot * pdf_d1 * vol) / (2.0 * sqrt_t)
+    call_theta = decay - r * strike * discount * cdf_d2
+    put_theta = decay + r * strike * discount * ndtr(-d2)
+    theta = np.where(is_call, call_theta, put_theta) / 365.0
+
+    return {"price": price, "delta": delta, "gamma": gamma, "theta": theta, "vega": vega}
+
+
+class PortfolioRiskEngine:
+    """
+    Computes Greeks for every open leg in one vectorized pass, aggregates them per
+    underlying and for the whole book, and produces a spot x IV shock P&L matrix.
+    """
+
+    GREEKS = ("delta", "gamma", "theta", "vega")
+
+    def __init__(self, spot_shocks=None, vol_shocks=None):
+        # Default grid: +/-10% spot in 1% steps, +/-30% (relative) IV in 5% steps
+        self.spot_shocks = np.asarray(spot_shocks if spot_shocks is not None else np.linspace(-0.10, 0.10, 21))
+        self.vol_shocks = np.asarray(vol_shocks if vol_shocks is not None else np.linspace(-0.30, 0.30, 13))
+
+    def analyze(self, legs):
+        """
+        legs: list of dicts with keys
+            underlying, spot, strike, option_type ("CE"/"PE"), quantity (signed, in units),
+            days_to_expiry and optionally iv (decimal).
+        Returns per-leg, per-underlying and portfolio Greeks plus the scenario P&L matrix.
+        """
+        legs = [leg for leg in legs if leg.get("spot", 0) > 0 and leg.get("strike", 0) > 0]
+        if not legs:
+            return self._empty()
+
+        underlyings, underlying_idx = np.unique([leg["underlying"] for leg in legs], return_inverse=True)
+        spot = np.array([leg["spot"] for leg in legs], dtype=float)
+        strike = np.array([leg["strike"] for leg in legs], dtype=float)
+        qty = np.array([leg["quantity"] for leg in legs], dtype=float)
+        t = np.array([leg["days_to_expiry"] for leg in legs], dtype=float) / 365.0
+        vol = np.array([leg.get("iv") or DEFAULT_IV for leg in legs], dtype=float)
+        is_call = np.array([leg["option_type"] == "CE" for leg in legs])
+
+        greeks = bs_greeks(spot, strike, t, vol, is_call)
+        position_greeks = {name: greeks[name] * qty for name in self.GREEKS}
+
+        by_underlying = {}
+        for name in self.GREEKS:
+            sums = np.bincount(underlying_idx, weights=position_greeks[name], minlength=len(underlyings))
+            for u, value in zip(underlyings, sums):
+                by_underlying.setdefault(str(u), {})[name] = round(float(value), 4)
+
+        portfolio = {name: round(float(position_greeks[name].sum()), 4) for name in self.GREEKS}
+
+        per_leg = []
+        for i, leg in enumerate(legs):
+            per_leg.append({
+                "symbol": leg.get("symbol"),
+                "underlying": leg["underlying"],
+                **{name: round(float(position_greeks[name][i]), 4) for name in self.GREEKS}
+            })
+
+        return {
+            "legs": per_leg,
+            "by_underlying": by_underlying,
+            "portfolio": portfolio,
+            "scenarios": self.scenario_matrix(spot, strike, t, vol, is_call, qty, greeks["price"],
+                                              underlying_idx, underlyings)
+        }
+
+    def scenario_matrix(self, spot, strike, t, vol, is_call, qty, base_price, underlying_idx, underlyings):
+        """
+        Reprices every leg on the full (vol shock, spot shock) grid in one broadcast call.
+        Spot shocks are applied as the same % move to every underlying.
+        """
+        # Shapes: (vol shocks, spot shocks, legs)
+        shocked_spot = spot[None, None, :] * (1.0 + self.spot_shocks[None, :, None])
+        shocked_vol = vol[None, None, :] * (1.0 + self.vol_shocks[:, None, None])
+
+        shocked = bs_greeks(shocked_spot, strike, t, shocked_vol, is_call)["price"]
+        leg_pnl = (shocked - base_price) * qty
+
+        # One-hot projection sums leg P&L into each underlying without a Python loop
+        membership = np.zeros((len(spot), len(underlyings)))
+        membership[np.arange(len(spot)), underlying_idx] = 1.0
+        underlying_pnl = leg_pnl @ membership
+
+        return {
+            "spot_shocks_pct": np.round(self.spot_shocks * 100, 2).tolist(),
+            "vol_shocks_pct": np.round(self.vol_shocks * 100, 2).tolist(),
+            "portfolio_pnl": np.round(leg_pnl.sum(axis=2), 2).tolist(),
+            "by_underlying_pnl": {
+                str(u): np.round(underlying_pnl[:, :, k], 2).tolist() for k, u in enumerate(underlyings)
+            }
+        }
+
+    def _empty(self):
+        return {
+            "legs": [],
+            "by_underlying": {},
+            "portfolio": {name: 0.0 for name in self.GREEKS},
+            "scenarios": {
+                "spot_shocks_pct": np.round(self.spot_shocks * 100, 2).tolist(),
+                "vol_shocks_pct": np.round(self.vol_shocks * 100, 2).tolist(),
+                "portfolio_pnl": [],
+                "by_underlying_pnl": {}
+            }
+        }
+
+
+# Initialize singleton
+risk_engine = PortfolioRiskEngine()
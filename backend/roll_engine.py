@@ -0,0 +1,156 @@
+import os
+import time
+import logging
+
+import numpy as np
+
+from probability_engine import probability_engine
+from vol_surface import atm_implied_vol
+from trading_calendar import trading_calendar
+from metrics import registry, timer
+
+# Exit reasons (prefixes) that make a short leg a roll candidate: the P&L stop and trend breaks
+ROLL_REASONS = ("Hard Stop Loss", "Trend Breakdown", "Trend Reversal")
+# Wall-clock budget for all roll suggestions of one /positions call; underlyings not
+# reached in time get no suggestions and the response is flagged
+ROLL_BUDGET_SEC = float(os.getenv("ROLL_BUDGET_MS", "150")) / 1000.0
+# Suggestions returned per leg
+ROLL_SUGGESTIONS = 3
+# Further-OTM strikes tried per leg, both for rolling away and for spread wings
+ROLL_STRIKE_STEPS = 6
+# Strike window fetched around spot, as in /analyze
+CHAIN_RANGE = 0.20
+
+ROLL_CANDIDATES = registry.counter("optrec_roll_candidates_total", "Roll/adjustment candidates scored, by kind.")
+
+
+def is_rollable(bias, decision):
+    """True for a short leg whose EXIT came from the P&L stop or a trend break."""
+    return bias == "SHORT" and decision["action"] == "EXIT" and decision["reason"].startswith(ROLL_REASONS)
+
+
+class RollEngine:
+    """
+    Adjustment suggestions for short option legs the exit rules flagged: roll out (same
+    strike, next expiry), roll away (further OTM, same expiry) or convert to a credit
+    spread (buy a further OTM wing).
+
+    Chains come through KiteService (instrument master + shared quote cache). Every
+    candidate is scored as the whole trade including the original credit, with the
+    probability engine at the ATM implied vol of its expiry, so candidates of one underlying
+    are scored in one vectorized call per expiry. A suggestion is returned only when it
+    beats holding the leg on EV.
+    """
+
+    def __init__(self, budget=ROLL_BUDGET_SEC, suggestions=ROLL_SUGGESTIONS, strike_steps=ROLL_STRIKE_STEPS):
+        self.budget = budget
+        self.suggestions = suggestions
+        self.strike_steps = strike_steps
+
+    def suggest(self, legs, kite_service, budget=None):
+        """
+        legs: dicts with symbol, name, spot, strike, option_type, expiry, quantity (signed
+        shares), entry_price and ltp. Returns ({symbol: [suggestion, ...]}, truncated).
+        """
+        deadline = time.perf_counter() + (self.budget if budget is None else budget)
+        by_name = {}
+        for leg in legs:
+            if leg.get("name") and leg.get("expiry") and leg.get("spot"):
+                by_name.setdefault(leg["name"], []).append(leg)
+
+        results = {}
+        truncated = False
+        with timer("roll.suggest"):
+            expiries = kite_service.instrument_master.expiries() if by_name else {}
+            for name, group in by_name.items():
+                if time.perf_counter() > deadline:
+                    truncated = True
+                    break
+                try:
+                    results.update(self._suggest_underlying(name, group, expiries.get(name, []), kite_service))
+                except Exception as e:
+                    logging.warning(f"Roll suggestions failed for {name}: {e}")
+        return results, truncated
+
+    def _suggest_underlying(self, name, legs, expiries, kite_service):
+        spot = legs[0]["spot"]
+        chains = {}
+
+        def chain_for(expiry):
+            if expiry not in chains:
+                chains[expiry] = kite_service.get_option_chain(name, spot, spot * (1 - CHAIN_RANGE),
+                                                               spot * (1 + CHAIN_RANGE), expiry=expiry)
+            return chains[expiry]
+
+        # Candidate rows: (leg index, kind, description, expiry, strikes, types, qty, credit, adjustment)
+        # strikes/types/qty are two legs wide (unused leg: quantity 0); credit is the whole
+        # trade's premium per share including the original sale, adjustment the cash of the change
+        candidates = []
+        for i, leg in enumerate(legs):
+            strike, opt_type, expiry = leg["strike"], leg["option_type"], leg["expiry"]
+            price_key = "ce_price" if opt_type == "CE" else "pe_price"
+            entry, ltp = leg["entry_price"], leg["ltp"]
+            prices = {row["strike"]: row[price_key] for row in chain_for(expiry)}
+            further = sorted((k for k in prices if (k > strike if opt_type == "CE" else k < strike)),
+                             key=lambda k: abs(k - strike))[:self.strike_steps]
+
+            candidates.append((i, "hold", f"Hold {strike:g} {opt_type}", expiry,
+                               [strike, strike], [opt_type, opt_type], [-1, 0], entry, 0.0))
+
+            later = [e for e in expiries if e > expiry]
+            if later:
+                next_price = {row["strike"]: row[price_key] for row in chain_for(later[0])}.get(strike, 0)
+                if next_price > 0:
+                    candidates.append((i, "roll_out", f"Buy back {strike:g} {opt_type}, sell {strike:g} {opt_type} {later[0].isoformat()}",
+                                       later[0], [strike, strike], [opt_type, opt_type], [-1, 0],
+                                       entry - ltp + next_price, next_price - ltp))
+
+            for k in further:
+                if prices[k] <= 0:
+                    continue
+                candidates.append((i, "roll_away", f"Buy back {strike:g} {opt_type}, sell {k:g} {opt_type}",
+                                   expiry, [k, k], [opt_type, opt_type], [-1, 0],
+                                   entry - ltp + prices[k], prices[k] - ltp))
+                candidates.append((i, "convert_to_spread", f"Keep {strike:g} {opt_type}, buy {k:g} {opt_type}",
+                                   expiry, [strike, k], [opt_type, opt_type], [-1, 1],
+                                   entry - prices[k], -prices[k]))
+
+        # One vectorized probability-engine pass per expiry
+        pop = np.zeros(len(candidates))
+        ev = np.zeros(len(candidates))
+        for expiry in {c[3] for c in candidates}:
+            rows = [j for j, c in enumerate(candidates) if c[3] == expiry]
+            t = trading_calendar.calendar_days_to_expiry(expiry) / 365.0
+            scored = probability_engine.evaluate(
+                spot, t,
+                [candidates[j][4] for j in rows], [candidates[j][5] for j in rows],
+                [candidates[j][6] for j in rows], [candidates[j][7] for j in rows],
+                vol=atm_implied_vol(spot, chains.get(expiry), t)
+            )
+            pop[rows] = scored["pop"]
+            ev[rows] = scored["expected_payoff"]
+
+        hold_ev = {c[0]: ev[j] for j, c in enumerate(candidates) if c[1] == "hold"}
+        results = {leg["symbol"]: [] for leg in legs}
+        for j in np.argsort(-ev):
+            i, kind, description, expiry, _, _, _, _, adjustment = candidates[j]
+            ROLL_CANDIDATES.inc(kind=kind)
+            leg = legs[i]
+            suggestions = results[leg["symbol"]]
+            if kind == "hold" or ev[j] <= hold_ev[i] or len(suggestions) >= self.suggestions:
+                continue
+            shares = abs(leg["quantity"])
+            suggestions.append({
+                "action": kind,
+                "description": description,
+                "expiry": expiry.isoformat(),
+                "net_credit": round(float(adjustment * shares), 2),
+                "pop": round(float(pop[j] * 100), 1),
+                "ev": round(float(ev[j] * shares), 2),
+                "ev_gain": round(float((ev[j] - hold_ev[i]) * shares), 2)
+            })
+        return results
+
+
+# Initialize singleton
+roll_engine = RollEngine()
@@ -1,89 +1,164 @@
-import yfinance as yf
-from textblob import TextBlob
+import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import timed
+from shared_cache import get_shared_cache
+from market_data import yf_symbol, yfinance_breaker
+from sentiment_models import HeadlineScorer, create_backend
+import session_replay
+
+# News sentiment changes slowly; share each symbol's result between workers for this long
+SENTIMENT_CACHE_TTL = float(os.getenv("SENTIMENT_CACHE_TTL_SEC", "900"))
+# Most recent headlines scored per symbol
+SENTIMENT_HEADLINES = int(os.getenv("SENTIMENT_HEADLINES", "5"))
+# Parallel news requests when several symbols are analyzed together
+NEWS_FETCH_CONCURRENCY = int(os.getenv("NEWS_FETCH_CONCURRENCY", "8"))
+
+# Keywords to watch out for in options trading
+CATALYSTS = ["earnings", "dividend", "acquisition", "merger", "lawsuit", "resigns", "guidance"]
 
 class SentimentAnalyzer:
     """
-    Fetches real-time news headlines using yfinance and scores them
-    using Natural Language Processing (TextBlob) to determine market sentiment.
+    Fetches real-time news headlines using yfinance and scores them with a pluggable
+    backend (see sentiment_models: TextBlob's lexicon or a local CPU model) to determine
+    market sentiment.
     """
-    
+
     def __init__(self):
-        pass
-        
+        self._scorer = None
+        self._scorer_lock = threading.Lock()
+
+    @property
+    def scorer(self):
+        """The headline scorer, built on first use (loading a backend is not free)."""
+        if self._scorer is None:
+            with self._scorer_lock:
+                if self._scorer is None:
+                    self._scorer = HeadlineScorer(create_backend())
+        return self._scorer
+
+    def warm_up(self):
+        """Imports the news stack and loads the scoring backend ahead of the first request."""
+        session_replay.yfinance()
+        self.scorer.backend.score(["warm up"])
+
+    def stats(self):
+        """Scoring backend, headlines scored, cache hits and inference throughput."""
+        return self.scorer.stats()
+
+    @timed("analyze_ticker")
     def analyze_ticker(self, symbol):
         """
         Fetches the latest news for a ticker and calculates a blended sentiment score.
         Returns a dict with mood, score, top headlines, and keywords.
         """
-        # Format for yfinance (e.g., RELIANCE.NS)
-        yf_symbol = symbol
-        if "NSE:" in symbol:
-            yf_symbol = symbol.replace("NSE:", "") + ".NS"
-        elif not symbol.endswith(".NS") and symbol != "NIFTY 50" and symbol != "BANKNIFTY":
-            yf_symbol = f"{symbol}.NS"
-            
-        try:
-            ticker = yf.Ticker(yf_symbol)
-            news = ticker.news
-            
-            if not news:
-                return self._default_neutral()
-                
-            headlines = []
-            total_polarity = 0.0
-            keywords = set()
-            
-            # Keywords to watch out for in options trading
-            catalysts = ["earnings", "dividend", "acquisition", "merger", "lawsuit", "resigns", "guidance"]
-            
-            for item in news[:5]: # Analyze top 5 recent articles
-                title = item.get('title', '')
-                if not title:
-                    continue
-                    
-                # NLP Sentiment Scoring
-                blob = TextBlob(title)
-                polarity = blob.sentiment.polarity
-                total_polarity += polarity
-                
-                headlines.append({
-                    "title": title,
-                    "sentiment": "Positive" if polarity > 0.1 else "Negative" if polarity < -0.1 else "Neutral"
-                })
-                
-                # Catalyst extraction
-                lower_title = title.lower()
-                for cat in catalysts:
-                    if cat in lower_title:
-                        keywords.add(cat.title())
-                        
-            
-            avg_polarity = total_polarity / len(headlines) if headlines else 0
-            
-            # Determine Mood
-            if avg_polarity > 0.15:
-                mood = "Highly Positive"
-            elif avg_polarity > 0.05:
-                mood = "Slightly Positive"
-            elif avg_polarity < -0.15:
-                mood = "Highly Negative"
-            elif avg_polarity < -0.05:
-                mood = "Slightly Negative"
-            else:
-                mood = "Neutral"
-
-            return {
-                "score": round(avg_polarity, 2),
-                "mood": mood,
-                "headlines": headlines,
-                "catalysts": list(keywords)
-            }
-            
-        except Exception as e:
-            logging.error(f"Failed to fetch sentiment for {yf_symbol}: {e}")
+        return self.analyze_many([symbol])[symbol]
+
+    @timed("sentiment.analyze_many")
+    def analyze_many(self, symbols):
+        """
+        {symbol: sentiment} for a whole scan. Results are shared through the shared cache for
+        SENTIMENT_CACHE_TTL seconds; the remaining symbols have their news fetched concurrently
+        and every new headline scored in one batched call. Only one worker fetches a given
+        set of symbols at a time. When a news fetch fails, the symbol's last good result is
+        served (stale, not re-cached).
+        """
+        symbols = list(dict.fromkeys(symbols))
+        cache = get_shared_cache()
+        keys = {symbol: f"sentiment:{symbol}" for symbol in symbols}
+
+        results = self._cached(cache, keys)
+        missing = [symbol for symbol in symbols if symbol not in results]
+        if missing:
+            with cache.lock(f"sentiment:{','.join(sorted(missing))}", ttl=60, timeout=60) as acquired:
+                if acquired:
+                    results.update(self._cached(cache, {symbol: keys[symbol] for symbol in missing}))
+                    missing = [symbol for symbol in missing if symbol not in results]
+                fresh = self._analyze(missing) if missing else {}
+
+            if fresh:
+                if SENTIMENT_CACHE_TTL > 0:
+                    cache.set_many({keys[symbol]: result for symbol, result in fresh.items()}, SENTIMENT_CACHE_TTL)
+                yfinance_breaker.remember({keys[symbol]: result for symbol, result in fresh.items()})
+            results.update(fresh)
+
+            failed = [symbol for symbol in missing if symbol not in fresh]
+            if failed:
+                fallback = yfinance_breaker.last_good([keys[symbol] for symbol in failed])
+                results.update({symbol: fallback[keys[symbol]] for symbol in failed if keys[symbol] in fallback})
+
+        return {symbol: results.get(symbol) or self._default_neutral() for symbol in symbols}
+
+    def _cached(self, cache, keys):
+        if SENTIMENT_CACHE_TTL <= 0:
+            return {}
+        found = cache.get_many(list(keys.values()))
+        return {symbol: found[key] for symbol, key in keys.items() if key in found}
+
+    def _analyze(self, symbols):
+        """Fetches and scores the symbols' headlines; symbols whose news fetch failed are left out."""
+        # Deferred import: yfinance dominates cold-start time
+        yf = session_replay.yfinance()
+
+        def fetch(symbol):
+            try:
+                return symbol, yfinance_breaker.call(lambda: yf.Ticker(yf_symbol(symbol)).news)
+            except Exception as e:
+                logging.error(f"Failed to fetch sentiment for {symbol}: {e}")
+                return symbol, None
+
+        with ThreadPoolExecutor(max_workers=min(NEWS_FETCH_CONCURRENCY, len(symbols))) as pool:
+            news = {symbol: items for symbol, items in pool.map(fetch, symbols) if items is not None}
+
+        titles = {
+            symbol: [title for title in (item.get('title', '') for item in items[:SENTIMENT_HEADLINES]) if title]
+            for symbol, items in news.items()
+        }
+        # NLP sentiment scoring: all symbols' headlines in one batch
+        scores = self.scorer.score([title for symbol_titles in titles.values() for title in symbol_titles])
+        return {symbol: self._summarize(symbol_titles, scores) for symbol, symbol_titles in titles.items()}
+
+    def _summarize(self, titles, scores):
+        if not titles:
             return self._default_neutral()
-            
+
+        headlines = []
+        keywords = set()
+        for title in titles:
+            polarity = scores[title]
+            headlines.append({
+                "title": title,
+                "sentiment": "Positive" if polarity > 0.1 else "Negative" if polarity < -0.1 else "Neutral"
+            })
+
+            # Catalyst extraction
+            lower_title = title.lower()
+            for cat in CATALYSTS:
+                if cat in lower_title:
+                    keywords.add(cat.title())
+
+        avg_polarity = sum(scores[title] for title in titles) / len(titles)
+
+        # Determine Mood
+        if avg_polarity > 0.15:
+            mood = "Highly Positive"
+        elif avg_polarity > 0.05:
+            mood = "Slightly Positive"
+        elif avg_polarity < -0.15:
+            mood = "Highly Negative"
+        elif avg_polarity < -0.05:
+            mood = "Slightly Negative"
+        else:
+            mood = "Neutral"
+
+        return {
+            "score": round(avg_polarity, 2),
+            "mood": mood,
+            "headlines": headlines,
+            "catalysts": sorted(keywords)
+        }
+
     def _default_neutral(self):
         return {
             "score": 0.0,
@@ -92,4 +167,11 @@ class SentimentAnalyzer:
             "catalysts": []
         }
 
-sentiment_service = SentimentAnalyzer()
+# Lazily-built singleton (created during app startup, see main.lifespan)
+_sentiment_service = None
+
+def get_sentiment_service():
+    global _sentiment_service
+    if _sentiment_service is None:
+        _sentiment_service = SentimentAnalyzer()
+    return _sentiment_service
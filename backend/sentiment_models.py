@@ -0,0 +1,162 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+from shared_cache import get_shared_cache
+from metrics import registry
+import session_replay
+
+# Headline scorer: "lexicon" (TextBlob's pattern lexicon, no model download) or "transformer"
+# (a local Hugging Face text-classification model on CPU; needs transformers + torch)
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "lexicon")
+# Model for the transformer backend; any positive/negative(/neutral) classifier works
+SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL", "ProsusAI/finbert")
+# Headlines per forward pass of the transformer backend
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+# A headline's score never changes for a given backend, so it is kept for a week
+HEADLINE_CACHE_TTL_SEC = float(os.getenv("HEADLINE_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+
+HEADLINES_SCORED = registry.counter("optrec_sentiment_headlines_total",
+                                    "Headlines scored, by backend and cache result.")
+INFERENCE_SECONDS = registry.counter("optrec_sentiment_inference_seconds_total",
+                                     "Seconds spent in sentiment inference, by backend.")
+INFERENCE_THROUGHPUT = registry.gauge("optrec_sentiment_headlines_per_second",
+                                      "Inference throughput of the most recent batch, by backend.")
+
+
+class LexiconBackend:
+    """TextBlob's pattern lexicon (polarity in [-1, 1]); pure Python, no batching gains."""
+
+    name = "lexicon"
+
+    def __init__(self):
+        # Deferred import: TextBlob (nltk) dominates cold-start time
+        from textblob.en.sentiments import PatternAnalyzer
+        self._analyzer = PatternAnalyzer()
+
+    def score(self, texts):
+        return [self._analyzer.analyze(text).polarity for text in texts]
+
+
+class TransformerBackend:
+    """
+    A local text-classification model on CPU, run over whole batches. Polarity is
+    P(positive) - P(negative), so it lands on the same [-1, 1] scale as the lexicon.
+    """
+
+    def __init__(self, model=SENTIMENT_MODEL, batch_size=SENTIMENT_BATCH_SIZE):
+        try:
+            from transformers import pipeline
+        except ImportError:
+            raise RuntimeError("SENTIMENT_BACKEND=transformer requires the 'transformers' and 'torch' packages "
+                               "(pip install transformers torch)")
+        self.name = f"transformer:{model}"
+        self.batch_size = batch_size
+        self._pipeline = pipeline("text-classification", model=model, device=-1, top_k=None)
+
+    def score(self, texts):
+        outputs = self._pipeline(list(texts), batch_size=self.batch_size, truncation=True)
+        return [_polarity(labels) for labels in outputs]
+
+
+def _polarity(labels):
+    polarity = 0.0
+    for item in labels:
+        label = item["label"].lower()
+        if label.startswith("pos"):
+            polarity += item["score"]
+        elif label.startswith("neg"):
+            polarity -= item["score"]
+    return polarity
+
+
+class ReplayBackend:
+    """Headline scores from a recorded session; headlines it never saw fall back to the lexicon."""
+
+    name = "replay"
+
+    def __init__(self):
+        self._fallback = None
+
+    def score(self, texts):
+        scores = [session_replay.session.get("headlines", session_replay.headline_key(text)) for text in texts]
+        unseen = [text for text, score in zip(texts, scores) if score is None]
+        if unseen:
+            logging.warning(f"{len(unseen)} headlines not in the replayed session; scoring them with the lexicon")
+            if self._fallback is None:
+                self._fallback = LexiconBackend()
+            fallback = iter(self._fallback.score(unseen))
+            scores = [next(fallback) if score is None else score for score in scores]
+        return scores
+
+
+def create_backend(backend=SENTIMENT_BACKEND):
+    if session_replay.replaying():
+        return ReplayBackend()
+    if backend == "lexicon":
+        return LexiconBackend()
+    if backend == "transformer":
+        return TransformerBackend()
+    raise ValueError(f"Unknown SENTIMENT_BACKEND: {backend}")
+
+
+class HeadlineScorer:
+    """
+    Scores headlines through a backend with a shared cache keyed by backend and headline
+    hash: only headlines no worker has scored before reach the model, all of them in one
+    batched call. Keeps running totals for throughput reporting.
+    """
+
+    def __init__(self, backend, ttl=HEADLINE_CACHE_TTL_SEC):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._scored = 0
+        self._seconds = 0.0
+        self._hits = 0
+
+    def _key(self, text):
+        return f"headline:{self.backend.name}:{hashlib.sha1(text.encode('utf-8')).hexdigest()[:20]}"
+
+    def score(self, texts):
+        """{text: polarity} for the distinct texts."""
+        keys = {text: self._key(text) for text in dict.fromkeys(texts)}
+        cache = get_shared_cache()
+        found = cache.get_many(list(keys.values()))
+        scores = {text: found[key] for text, key in keys.items() if key in found}
+        missing = [text for text in keys if text not in scores]
+        HEADLINES_SCORED.inc(len(scores), backend=self.backend.name, result="hit")
+
+        elapsed = 0.0
+        if missing:
+            start = time.perf_counter()
+            fresh = self.backend.score(missing)
+            elapsed = time.perf_counter() - start
+            scores.update(zip(missing, fresh))
+            session_replay.record("headlines", {session_replay.headline_key(text): score
+                                                for text, score in zip(missing, fresh)})
+            cache.set_many({keys[text]: score for text, score in zip(missing, fresh)}, self.ttl)
+
+            HEADLINES_SCORED.inc(len(missing), backend=self.backend.name, result="miss")
+            INFERENCE_SECONDS.inc(elapsed, backend=self.backend.name)
+            INFERENCE_THROUGHPUT.set(len(missing) / elapsed if elapsed else 0.0, backend=self.backend.name)
+            logging.debug(f"Scored {len(missing)} headlines with {self.backend.name} in {elapsed * 1000:.1f} ms")
+
+        with self._lock:
+            self._hits += len(keys) - len(missing)
+            self._scored += len(missing)
+            self._seconds += elapsed
+        return scores
+
+    def stats(self):
+        """Headlines run through the model, cache hits and model throughput since startup."""
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "headlines_scored": self._scored,
+                "cache_hits": self._hits,
+                "inference_seconds": round(self._seconds, 4),
+                "headlines_per_second": round(self._scored / self._seconds, 1) if self._seconds else None,
+            }
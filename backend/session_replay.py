@@ -0,0 +1,339 @@
+"""
+Record/replay of every upstream response the API depends on.
+
+    REPLAY_MODE=record REPLAY_SESSION_FILE=bad_call.json.gz uvicorn main:app   # capture a session
+    REPLAY_MODE=replay REPLAY_SESSION_FILE=bad_call.json.gz uvicorn main:app   # serve it offline
+
+Recording keeps the latest Kite instrument dump, quotes and positions, yfinance bars, news
+and calendars, the headline sentiment scores and each underlying's IV history as seen by
+the app. Replay serves those from the file instead of the network, uses a process-local
+cache and freezes the market clock at the recording time, so /analyze and /positions
+return the same data on every run, with no credentials or network access.
+"""
+import os
+import gzip
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from datetime import date, datetime
+
+from instrument_master import CACHE_DIR
+from shared_cache import get_shared_cache
+from token_manager import IST
+from trading_calendar import trading_calendar
+
+# off | record | replay
+REPLAY_MODE = os.getenv("REPLAY_MODE", "off")
+REPLAY_SESSION_FILE = os.getenv("REPLAY_SESSION_FILE", os.path.join(CACHE_DIR, "session.json.gz"))
+# Seconds between incremental saves while recording (the session is also saved at shutdown)
+RECORD_FLUSH_SEC = 10
+
+SECTIONS = ("instruments", "quotes", "positions", "history", "news", "calendar", "headlines", "ivhist")
+SESSION_VERSION = 1
+
+
+def headline_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+
+def _encode(value):
+    """JSON fallback for the non-JSON values upstreams return (dates, DataFrames, numpy scalars)."""
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if hasattr(value, "to_dict") and hasattr(value, "columns"):
+        return {"__frame__": {
+            "index": [ts.isoformat() if hasattr(ts, "isoformat") else ts for ts in value.index],
+            "columns": [str(column) for column in value.columns],
+            "data": value.to_numpy().tolist(),
+        }}
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+        if "__frame__" in obj:
+            import pandas as pd
+            frame = obj["__frame__"]
+            return pd.DataFrame(frame["data"], index=pd.DatetimeIndex(pd.to_datetime(frame["index"])),
+                                columns=frame["columns"])
+    return obj
+
+
+class Session:
+    """The recorded upstream responses, by section and key, stored as gzipped JSON."""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.data = {"version": SESSION_VERSION, "recorded_at": None, **{section: {} for section in SECTIONS}}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def load(self):
+        with gzip.open(self.path, "rt") as f:
+            data = json.load(f, object_hook=_decode)
+        if data.get("version") != SESSION_VERSION:
+            raise ValueError(f"Unsupported session version {data.get('version')} in {self.path}")
+        self.data = {**self.data, **data}
+
+    def get(self, section, key, default=None):
+        return self.data[section].get(key, default)
+
+    def record(self, section, values, first_only=False):
+        """Stores {key: value} in `section` (first_only keeps values already recorded)."""
+        if not values:
+            return
+        with self._lock:
+            if self.data["recorded_at"] is None:
+                self.data["recorded_at"] = datetime.now(IST)
+            target = self.data[section]
+            for key, value in values.items():
+                if not (first_only and key in target):
+                    target[key] = value
+            self._dirty = True
+        if time.monotonic() - self._saved_at > RECORD_FLUSH_SEC:
+            self.flush()
+
+    def flush(self):
+        """Writes the recording if anything changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps(self.data, default=_encode)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with gzip.open(tmp_path, "wt") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Failed to save replay session {self.path}: {e}")
+
+
+# --- Kite ---
+
+class RecordingKite:
+    """KiteConnect proxy that records the responses the app reads."""
+
+    def __init__(self, kite, session):
+        self._kite = kite
+        self._session = session
+
+    def instruments(self, exchange=None):
+        result = self._kite.instruments(exchange) if exchange else self._kite.instruments()
+        self._session.record("instruments", {exchange or "all": result})
+        return result
+
+    def quote(self, instruments):
+        result = self._kite.quote(instruments)
+        self._session.record("quotes", result)
+        return result
+
+    def positions(self):
+        result = self._kite.positions()
+        self._session.record("positions", {"book": result})
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._kite, name)
+
+
+class ReplayKite:
+    """The subset of KiteConnect used by KiteService, answered from a recorded session."""
+
+    def __init__(self, session):
+        self._session = session
+
+    def set_access_token(self, access_token):
+        pass
+
+    def instruments(self, exchange=None):
+        return [dict(inst) for inst in self._session.get("instruments", exchange or "all", [])]
+
+    def quote(self, instruments):
+        instruments = [instruments] if isinstance(instruments, str) else instruments
+        quotes = self._session.data["quotes"]
+        return {inst: quotes[inst] for inst in instruments if inst in quotes}
+
+    def positions(self):
+        return self._session.get("positions", "book", {"net": [], "day": []})
+
+
+# --- yfinance ---
+
+def _history_key(ticker, period, interval):
+    return f"{ticker}|{period}|{interval}"
+
+
+class RecordingYFinance:
+    """Wraps the yfinance module, recording bulk downloads, news and calendars."""
+
+    def __init__(self, yf, session):
+        self._yf = yf
+        self._session = session
+
+    def download(self, tickers, period="5d", interval="15m", **kwargs):
+        data = self._yf.download(tickers, period=period, interval=interval, **kwargs)
+        if data is not None and not data.empty:
+            names = [tickers] if isinstance(tickers, str) else list(tickers)
+            if data.columns.nlevels > 1:
+                frames = {name: data[name] for name in names if name in data.columns.get_level_values(0)}
+            else:
+                frames = {names[0]: data}
+            self._session.record("history", {_history_key(name, period, interval): frame.dropna(how="all")
+                                             for name, frame in frames.items()})
+        return data
+
+    def Ticker(self, symbol):
+        return _RecordingTicker(self._yf.Ticker(symbol), symbol, self._session)
+
+    def __getattr__(self, name):
+        return getattr(self._yf, name)
+
+
+class _RecordingTicker:
+    def __init__(self, ticker, symbol, session):
+        self._ticker = ticker
+        self._symbol = symbol
+        self._session = session
+
+    @property
+    def news(self):
+        news = self._ticker.news
+        self._session.record("news", {self._symbol: news})
+        return news
+
+    @property
+    def calendar(self):
+        calendar = self._ticker.calendar
+        self._session.record("calendar", {self._symbol: calendar})
+        return calendar
+
+    def __getattr__(self, name):
+        return getattr(self._ticker, name)
+
+
+class ReplayYFinance:
+    """Stand-in for the yfinance module serving a recorded session."""
+
+    def __init__(self, session):
+        self._session = session
+
+    def download(self, tickers, period="5d", interval="15m", **kwargs):
+        import pandas as pd
+
+        names = [tickers] if isinstance(tickers, str) else list(tickers)
+        frames = {name: self._session.get("history", _history_key(name, period, interval)) for name in names}
+        frames = {name: frame for name, frame in frames.items() if frame is not None}
+        return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+    def Ticker(self, symbol):
+        return _ReplayTicker(symbol, self._session)
+
+
+class _ReplayTicker:
+    def __init__(self, symbol, session):
+        self._symbol = symbol
+        self._session = session
+
+    @property
+    def news(self):
+        return self._session.get("news", self._symbol, [])
+
+    @property
+    def calendar(self):
+        return self._session.get("calendar", self._symbol)
+
+
+# --- Activation ---
+
+def _activate(mode, path):
+    if mode == "off":
+        return None
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown REPLAY_MODE: {mode}")
+
+    active = Session(path, mode)
+    if mode == "record":
+        atexit.register(active.flush)
+        logging.info(f"Recording upstream responses to {path}")
+        return active
+
+    active.load()
+    recorded_at = active.data["recorded_at"]
+    if recorded_at:
+        trading_calendar.freeze(recorded_at.astimezone(IST))
+    # IV rank reads its history from the (process-local, see shared_cache) cache
+    history = active.data["ivhist"]
+    if history:
+        get_shared_cache().set_many({f"ivhist:{underlying}": dict(days) for underlying, days in history.items()},
+                                    24 * 3600)
+    logging.info(f"Replaying upstream responses from {path} (recorded {recorded_at})")
+    return active
+
+
+session = _activate(REPLAY_MODE, REPLAY_SESSION_FILE)
+
+
+def active():
+    """True while a session is recorded or replayed."""
+    return session is not None
+
+
+def recording():
+    return session is not None and session.mode == "record"
+
+
+def replaying():
+    return session is not None and session.mode == "replay"
+
+
+def record(section, values, first_only=False):
+    if recording():
+        session.record(section, values, first_only)
+
+
+def flush():
+    if recording():
+        session.flush()
+
+
+def wrap_kite(kite):
+    """The KiteConnect client to use: recorded through when recording, as is otherwise."""
+    return RecordingKite(kite, session) if recording() else kite
+
+
+def replay_kite():
+    return ReplayKite(session)
+
+
+_replay_yfinance = None
+
+
+def yfinance():
+    """
+    The yfinance module the app should call: the session stand-in when replaying, a
+    recording wrapper when recording, the real module otherwise. Imported lazily, like
+    the deferred `import yfinance` it replaces.
+    """
+    global _replay_yfinance
+    if replaying():
+        if _replay_yfinance is None:
+            _replay_yfinance = ReplayYFinance(session)
+        return _replay_yfinance
+    import yfinance as yf
+    return RecordingYFinance(yf, session) if recording() else yf
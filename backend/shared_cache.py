@@ -0,0 +1,315 @@
+import os
+import time
+import uuid
+import pickle
+import sqlite3
+import logging
+import threading
+
+from instrument_master import CACHE_DIR
+from metrics import registry
+
+# memory: per-process (single worker) | sqlite: shared by the workers of one host | redis: shared across hosts
+CONFIGURED_CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+# While a session is recorded or replayed (REPLAY_MODE, see session_replay.py) the cache is
+# process-local: a recording must see every upstream response it serves, and a replay must
+# neither read nor overwrite live shared state
+REPLAY_MODE = os.getenv("REPLAY_MODE", "off")
+CACHE_BACKEND = "memory" if REPLAY_MODE in ("record", "replay") else CONFIGURED_CACHE_BACKEND
+# Put this on a tmpfs (e.g. /dev/shm) to keep the SQLite backend in shared memory
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(CACHE_DIR, "shared_cache.sqlite"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Polling interval while waiting for a lock held by another worker
+LOCK_POLL_INTERVAL = 0.05
+
+CACHE_REQUESTS = registry.counter("optrec_shared_cache_requests_total", "Shared cache lookups by namespace and result.")
+
+
+def _namespace(key):
+    return key.split(":", 1)[0]
+
+
+class CacheLock:
+    """
+    Context manager around a backend lease lock. `with cache.lock(name) as acquired:` waits
+    up to `timeout` seconds; `acquired` is False if the lock could not be taken in time.
+    The lease expires after `ttl` seconds so a crashed worker cannot hold it forever.
+    """
+
+    def __init__(self, backend, name, ttl, timeout):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.timeout = timeout
+        self.owner = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex}"
+        self.acquired = False
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self.backend._try_lock(self.name, self.owner, self.ttl):
+                self.acquired = True
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def __exit__(self, *exc):
+        if self.acquired:
+            self.backend._unlock(self.name, self.owner)
+            self.acquired = False
+        return False
+
+
+class CacheBackend:
+    """
+    Key/value cache with TTLs and lease locks, shared by every worker that points at the
+    same backend. Values are arbitrary picklable objects.
+    """
+
+    # True when the backend spans hosts, so large payloads that already live in the local
+    # disk cache (e.g. the instrument dump) are worth sharing through it
+    distributed = False
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def get_many(self, keys):
+        raise NotImplementedError
+
+    def set_many(self, mapping, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def lock(self, name, ttl=60, timeout=60):
+        return CacheLock(self, name, ttl, timeout)
+
+    def _try_lock(self, name, owner, ttl):
+        raise NotImplementedError
+
+    def _unlock(self, name, owner):
+        raise NotImplementedError
+
+    def _count(self, keys, found):
+        for key in keys:
+            CACHE_REQUESTS.inc(namespace=_namespace(key), result="hit" if key in found else "miss")
+
+
+class MemoryCache(CacheBackend):
+    """Process-local backend; the default for a single worker."""
+
+    def __init__(self):
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._values.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._values[key]
+                    continue
+                found[key] = entry[0]
+        self._count(keys, found)
+        return found
+
+    def set_many(self, mapping, ttl):
+        expires_at = time.time() + ttl
+        with self._lock:
+            for key, value in mapping.items():
+                self._values[key] = (value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def _try_lock(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            holder = self._locks.get(name)
+            if holder and holder[1] > now:
+                return False
+            self._locks[name] = (owner, now + ttl)
+            return True
+
+    def _unlock(self, name, owner):
+        with self._lock:
+            if self._locks.get(name, (None,))[0] == owner:
+                del self._locks[name]
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Backend for several workers on one host. One SQLite file (WAL mode) holds the entries
+    and the lock leases; put it on a tmpfs to keep it in shared memory.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self._conn().execute(
+            f"SELECT key, value FROM entries WHERE key IN ({placeholders}) AND expires_at > ?",
+            [*keys, time.time()]
+        ).fetchall()
+        found = {key: pickle.loads(value) for key, value in rows}
+        self._count(keys, found)
+        return found
+
+    def set_many(self, mapping, ttl):
+        now = time.time()
+        rows = [(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now + ttl) for key, value in mapping.items()]
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)", rows)
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _try_lock(self, name, owner, ttl):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM locks WHERE name = ? AND expires_at <= ?", (name, now))
+            cursor = conn.execute("INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                                  (name, owner, now + ttl))
+            return cursor.rowcount == 1
+
+    def _unlock(self, name, owner):
+        self._conn().execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+
+class RedisCache(CacheBackend):
+    """Backend for workers spread over several hosts (any Redis-compatible server)."""
+
+    distributed = True
+
+    _UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url=REDIS_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self._unlock_script = self.client.register_script(self._UNLOCK_SCRIPT)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        values = self.client.mget(keys)
+        found = {key: pickle.loads(value) for key, value in zip(keys, values) if value is not None}
+        self._count(keys, found)
+        return found
+
+    def set_many(self, mapping, ttl):
+        pipe = self.client.pipeline()
+        for key, value in mapping.items():
+            pipe.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), px=max(int(ttl * 1000), 1))
+        pipe.execute()
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def _try_lock(self, name, owner, ttl):
+        return bool(self.client.set(f"lock:{name}", owner, nx=True, px=max(int(ttl * 1000), 1)))
+
+    def _unlock(self, name, owner):
+        self._unlock_script(keys=[f"lock:{name}"], args=[owner])
+
+
+def get_or_compute(cache, key, compute, ttl, lock_timeout=60):
+    """
+    Returns the cached value for `key`, or computes and stores it. Only one worker computes
+    at a time; the others wait for the lock and then read its result. If the lock cannot be
+    taken in time the value is computed locally rather than failing the request.
+    A compute() result of None is returned but not cached.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with cache.lock(key, ttl=lock_timeout, timeout=lock_timeout) as acquired:
+        if acquired:
+            value = cache.get(key)
+            if value is not None:
+                return value
+        else:
+            logging.warning(f"Timed out waiting for another worker to compute {key}; computing locally.")
+        value = compute()
+        if value is not None:
+            cache.set(key, value, ttl)
+        return value
+
+
+def create_cache(backend=CACHE_BACKEND):
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "sqlite":
+        return SQLiteCache()
+    if backend == "redis":
+        return RedisCache()
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+
+
+# Lazily-built singleton (created on first use, so importing never opens a connection)
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache():
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = create_cache()
+    return _shared_cache
+
+
+_history_cache = None
+
+def get_history_cache():
+    """
+    The cache for state accumulated across days (e.g. IV history) rather than cached
+    upstream responses: the configured backend even while a session is recorded, so the
+    recording captures the real history. Same as get_shared_cache() otherwise.
+    """
+    global _history_cache
+    if REPLAY_MODE != "record" or CONFIGURED_CACHE_BACKEND == CACHE_BACKEND:
+        return get_shared_cache()
+    if _history_cache is None:
+        with _shared_cache_lock:
+            if _history_cache is None:
+                _history_cache = create_cache(CONFIGURED_CACHE_BACKEND)
+    return _history_cache
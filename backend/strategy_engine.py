@@ -1,10 +1,25 @@
-def calculate_strategy(strategy, options, spot_price):
+from margin_engine import margin_engine
+from instrument_master import DEFAULT_LOT_SIZE
+from trading_calendar import trading_calendar
+from vol_surface import atm_implied_vol
+
+# Margin scenario horizon when the chain carries no expiry (the estimator's default)
+DEFAULT_DAYS_TO_EXPIRY = 7
+
+
+def calculate_strategy(strategy, options, spot_price, symbol=None, iv=None):
     """
     Calculates payoffs for various options strategies based on mock/real option chain data.
+    Margin comes from the local SPAN-like estimator for the legs involved, on the chain's
+    days to expiry and ATM implied vol (`iv`, solved from the chain when not given), and all
+    quantities are scaled by the lot size carried on the chain.
     """
     if not options or len(options) < 2:
         return {"error": "Not enough option strikes available for strategy"}
         
+    # Contract spec travels with the chain (see instrument_master.OptionChain)
+    lot_size = getattr(options, "lot_size", None) or DEFAULT_LOT_SIZE
+    
     # Sort options by strike price
     options.sort(key=lambda x: x['strike'])
     
@@ -15,6 +30,7 @@ def calculate_strategy(strategy, options, spot_price):
     result = {
         "strategy_name": strategy,
         "spot": spot_price,
+        "lot_size": lot_size,
         "margin": 0,
         "roi": 0.0,
         "premium_paid": 0,
@@ -26,8 +42,7 @@ def calculate_strategy(strategy, options, spot_price):
     }
     
     # Common strategies logic
-    # Lot size is usually 50 or 25 for indices, keeping 50 for simplicity for all mock calculations
-    lot_size = 50
+    legs = []
     
     if strategy == "Bull Call":
         # Buy ATM Call, Sell OTM Call
@@ -42,8 +57,7 @@ def calculate_strategy(strategy, options, spot_price):
             strike_diff = sell_leg['strike'] - buy_leg['strike']
             result["max_profit"] = (strike_diff * lot_size) - net_premium
             result["max_loss"] = net_premium
-            result["margin"] = net_premium + 10000 # Margin approximation
-            result["roi"] = (result["max_profit"] / result["margin"]) * 100 if result["margin"] > 0 else 0
+            legs = [_leg(buy_leg, 'CE', lot_size), _leg(sell_leg, 'CE', -lot_size)]
             
             result["strikes_involved"] = [f"Buy {buy_leg['strike']} CE", f"Sell {sell_leg['strike']} CE"]
             result["commentary"] = f"Bullish strategy with capped risk and capped reward. Max loss is net premium {net_premium:.2f}."
@@ -61,8 +75,7 @@ def calculate_strategy(strategy, options, spot_price):
             strike_diff = buy_leg['strike'] - sell_leg['strike']
             result["max_profit"] = (strike_diff * lot_size) - net_premium
             result["max_loss"] = net_premium
-            result["margin"] = net_premium + 10000 
-            result["roi"] = (result["max_profit"] / result["margin"]) * 100 if result["margin"] > 0 else 0
+            legs = [_leg(buy_leg, 'PE', lot_size), _leg(sell_leg, 'PE', -lot_size)]
             
             result["strikes_involved"] = [f"Buy {buy_leg['strike']} PE", f"Sell {sell_leg['strike']} PE"]
             result["commentary"] = f"Bearish strategy limiting risk to the net premium {net_premium:.2f}."
@@ -80,8 +93,7 @@ def calculate_strategy(strategy, options, spot_price):
             strike_diff = buy_leg['strike'] - sell_leg['strike']
             result["max_profit"] = net_credit
             result["max_loss"] = (strike_diff * lot_size) - net_credit
-            result["margin"] = 35000 # Higher margin for credit spreads
-            result["roi"] = (result["max_profit"] / result["margin"]) * 100 if result["margin"] > 0 else 0
+            legs = [_leg(sell_leg, 'CE', -lot_size), _leg(buy_leg, 'CE', lot_size)]
             
             result["strikes_involved"] = [f"Sell {sell_leg['strike']} CE", f"Buy {buy_leg['strike']} CE"]
             result["commentary"] = f"Bearish to neutral strategy collecting credit. Max profit is net credit {net_credit:.2f}."
@@ -99,8 +111,7 @@ def calculate_strategy(strategy, options, spot_price):
             strike_diff = sell_leg['strike'] - buy_leg['strike']
             result["max_profit"] = net_credit
             result["max_loss"] = (strike_diff * lot_size) - net_credit
-            result["margin"] = 35000 
-            result["roi"] = (result["max_profit"] / result["margin"]) * 100 if result["margin"] > 0 else 0
+            legs = [_leg(sell_leg, 'PE', -lot_size), _leg(buy_leg, 'PE', lot_size)]
             
             result["strikes_involved"] = [f"Sell {sell_leg['strike']} PE", f"Buy {buy_leg['strike']} PE"]
             result["commentary"] = f"Bullish to neutral strategy collecting credit. Max profit is net credit {net_credit:.2f}."
@@ -115,8 +126,7 @@ def calculate_strategy(strategy, options, spot_price):
         
         result["max_profit"] = float('inf') # Theoretically unlimited
         result["max_loss"] = result["premium_paid"]
-        result["margin"] = result["premium_paid"]
-        result["roi"] = 0 # Cannot calculate fixed ROI for unlimited profit
+        legs = [_leg(buy_call, 'CE', lot_size), _leg(buy_put, 'PE', lot_size)]
         
         result["strikes_involved"] = [f"Buy {buy_call['strike']} CE", f"Buy {buy_put['strike']} PE"]
         result["commentary"] = f"Highly volatile directional strategy. Requires strong movement in either direction to overcome net premium paid {result['premium_paid']:.2f}."
@@ -124,11 +134,30 @@ def calculate_strategy(strategy, options, spot_price):
     else:
         return {"error": "Unsupported strategy"}
         
+    if legs:
+        # Scenario basis of the chain itself: its expiry and ATM implied vol (None: estimator default)
+        expiry = getattr(options, "expiry", None)
+        days = trading_calendar.calendar_days_to_expiry(expiry) if expiry else DEFAULT_DAYS_TO_EXPIRY
+        if iv is None:
+            iv = atm_implied_vol(spot_price, options, days / 365.0)
+        result["margin"] = margin_engine.estimate(symbol, spot_price, legs, days_to_expiry=days, iv=iv)["total"]
+        # Cannot calculate fixed ROI for unlimited profit
+        if result["max_profit"] != float('inf') and result["margin"] > 0:
+            result["roi"] = (result["max_profit"] / result["margin"]) * 100
+        
     # Format numerical values for UI
     result["premium_paid"] = round(result["premium_paid"], 2)
     result["premium_received"] = round(result["premium_received"], 2)
-    result["max_profit"] = round(result["max_profit"], 2) if result["max_profit"] != float('inf') else "Unlimited"
+    # Unbounded profit is flagged rather than written into the numeric field
+    result["max_profit_unlimited"] = result["max_profit"] == float('inf')
+    result["max_profit"] = None if result["max_profit_unlimited"] else round(result["max_profit"], 2)
     result["max_loss"] = round(result["max_loss"], 2)
     result["roi"] = round(result["roi"], 2)
     
     return result
+
+
+def _leg(option, option_type, quantity):
+    """Leg description in the shape expected by the margin estimator."""
+    price_key = 'ce_price' if option_type == 'CE' else 'pe_price'
+    return {"strike": option['strike'], "option_type": option_type, "quantity": quantity, "price": option[price_key]}
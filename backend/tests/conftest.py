@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Benchmark helpers (synthetic market, fakes, import budget) are shared with the tests
+sys.path.insert(1, os.path.join(BACKEND_DIR, "benchmarks"))
+
+# Keep instrument/token caches out of the working tree (and away from a live server's)
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="optrec-tests-"))
@@ -0,0 +1,35 @@
+"""Seller-strategy screening on synthetic chains."""
+import numpy as np
+import pytest
+
+from synthetic import SyntheticMarket
+from advanced_analyzer import AdvancedOptionsAnalyzer
+from margin_engine import margin_engine
+from trading_calendar import trading_calendar
+
+
+def test_seller_margins_use_the_chain_expiry(monkeypatch):
+    market = SyntheticMarket(expiry_count=5)
+    chain = market.chain("NIFTY", 4)
+    days = trading_calendar.calendar_days_to_expiry(chain.expiry)
+    assert days > 25
+
+    calls = []
+    estimate_batch = margin_engine.estimate_batch
+
+    def recording(*args, **kwargs):
+        result = estimate_batch(*args, **kwargs)
+        calls.append((args, kwargs, result))
+        return result
+
+    monkeypatch.setattr(margin_engine, "estimate_batch", recording)
+    # A model vol under the chain's 16% makes the credit spreads worth selling
+    result = AdvancedOptionsAnalyzer().recommend_seller_strategy(2, market.spot_for("NIFTY"), chain,
+                                                                 symbol="NIFTY", vol=0.12)
+
+    assert result["options"] and len(calls) == 1
+    args, kwargs, margins = calls[0]
+    assert kwargs["days_to_expiry"] == pytest.approx(days, abs=0.01)
+    assert [trade["margin"] for trade in result["options"]] == [round(float(m), 2) for m in margins["total"]]
+    weekly = estimate_batch(*args, iv=kwargs["iv"])["total"]
+    assert not np.allclose(margins["total"], weekly)
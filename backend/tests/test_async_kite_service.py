@@ -0,0 +1,89 @@
+"""AsyncKiteService against the mock broker, served in-process over httpx.ASGITransport."""
+import asyncio
+from datetime import date
+
+import httpx
+import pytest
+import kiteconnect.exceptions
+
+import mock_broker
+from async_kite_service import AsyncKiteService, TokenBucket
+from risk_engine import bs_greeks
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_service(test):
+    service = AsyncKiteService(api_key="mock", access_token="mock", root="http://mock-broker",
+                               transport=httpx.ASGITransport(app=mock_broker.app))
+    # The published 1 quote/s limit would only slow the tests down
+    service.limiters["quote"] = TokenBucket(1000)
+    try:
+        return await test(service)
+    finally:
+        await service.close()
+
+
+def test_instruments_parse_the_mock_dump():
+    instruments = run(with_service(lambda service: service.instruments("NFO")))
+
+    assert len(instruments) == len(mock_broker.market.instruments)
+    assert len({inst["tradingsymbol"] for inst in instruments}) == len(instruments)
+    first = instruments[0]
+    assert isinstance(first["instrument_token"], int)
+    assert isinstance(first["strike"], float)
+    assert isinstance(first["expiry"], date)
+
+
+def test_option_chain_prices_the_nearest_expiry():
+    spot = mock_broker.market.spot_for("NIFTY")
+    chain = run(with_service(lambda service: service.get_option_chain("NIFTY", spot, spot * 0.95, spot * 1.05)))
+
+    expiry = mock_broker.expiries()[0]
+    assert chain.expiry == expiry
+    assert chain.lot_size == mock_broker.UNIVERSE["NIFTY"][3]
+    atm = min(chain, key=lambda row: abs(row["strike"] - spot))
+    days = max((expiry - date.today()).days, 0)
+    expected = float(bs_greeks(spot, atm["strike"], days / 365.0, mock_broker.MOCK_IV, True)["price"])
+    # The mock spot drifts a little on every quote call
+    assert atm["ce_price"] == pytest.approx(expected, rel=0.1)
+
+
+def test_concurrent_quotes_are_coalesced():
+    fetched = []
+
+    async def test(service):
+        fetch = service.quotes.fetch
+
+        async def counting_fetch(instruments):
+            fetched.append(list(instruments))
+            return await fetch(instruments)
+
+        service.quotes.fetch = counting_fetch
+        return await asyncio.gather(*(service.get_ltp([symbol]) for symbol in ("NIFTY 50", "NIFTY BANK", "RELIANCE")))
+
+    results = run(with_service(test))
+
+    assert len(fetched) == 1
+    assert sorted(fetched[0]) == ["NSE:NIFTY 50", "NSE:NIFTY BANK", "NSE:RELIANCE"]
+    assert [list(result) for result in results] == [["NSE:NIFTY 50"], ["NSE:NIFTY BANK"], ["NSE:RELIANCE"]]
+
+
+def test_positions_cover_index_and_stock_underlyings():
+    positions = run(with_service(lambda service: service.get_positions()))
+
+    by_symbol = {inst["tradingsymbol"]: inst for inst in mock_broker.market.instruments}
+    names = {by_symbol[pos["tradingsymbol"]]["name"] for pos in positions}
+    assert names == set(mock_broker.POSITION_UNDERLYINGS)
+    assert any(pos["quantity"] < 0 for pos in positions)
+
+
+def test_expired_token_raises_token_exception():
+    mock_broker.market.token_expired = True
+    try:
+        with pytest.raises(kiteconnect.exceptions.TokenException):
+            run(with_service(lambda service: service.get_positions()))
+    finally:
+        mock_broker.market.token_expired = False
@@ -0,0 +1,25 @@
+"""Regression gate of the benchmark runner."""
+from run import compare
+
+BASELINE = {"api.positions": {"mean_ms": 20.0, "p50_ms": 18.0, "p99_ms": 30.0}}
+
+
+def test_p99_outlier_alone_is_not_a_regression():
+    # One slow (GC) sample out of 50 moves p99 but barely the mean
+    results = {"api.positions": {"mean_ms": 21.5, "p50_ms": 18.2, "p99_ms": 95.0}}
+
+    assert compare(results, BASELINE, 0.5) == []
+
+
+def test_p50_and_mean_regressions_are_reported():
+    results = {"api.positions": {"mean_ms": 40.0, "p50_ms": 36.0, "p99_ms": 31.0}}
+
+    regressions = compare(results, BASELINE, 0.5)
+
+    assert len(regressions) == 2
+    assert regressions[0].startswith("api.positions: p50_ms")
+    assert regressions[1].startswith("api.positions: mean_ms")
+
+
+def test_cases_without_a_baseline_are_skipped():
+    assert compare({"engine.new": {"mean_ms": 1.0, "p50_ms": 1.0, "p99_ms": 1.0}}, BASELINE, 0.5) == []
@@ -0,0 +1,10 @@
+"""Import-time budget for the API module (see benchmarks/import_budget.py)."""
+from import_budget import DEFAULT_BUDGET_MS, DEFERRED_MODULES, measure
+
+
+def test_main_imports_within_budget():
+    elapsed_ms, imported = measure("main")
+
+    leaked = sorted(name for name in DEFERRED_MODULES if name in imported)
+    assert not leaked, f"deferred dependencies imported eagerly: {', '.join(leaked)}"
+    assert elapsed_ms <= DEFAULT_BUDGET_MS, f"import main took {elapsed_ms:.0f} ms (budget {DEFAULT_BUDGET_MS:.0f} ms)"
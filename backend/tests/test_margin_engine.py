@@ -0,0 +1,99 @@
+"""SPAN-like margins for batches of option structures."""
+import json
+
+import numpy as np
+import pytest
+
+from margin_engine import MarginEstimator
+from risk_engine import bs_greeks
+
+SPOT = 24000.0
+PARAMS = {
+    "price_scan_pct": 0.06,
+    "vol_scan": 0.04,
+    "exposure_pct": 0.02,
+    "short_option_min_pct": 0.0,
+    "extreme_move_multiple": 2.0,
+    "extreme_move_cover": 0.35,
+}
+
+
+@pytest.fixture
+def estimator(tmp_path):
+    params_file = tmp_path / "risk_params.json"
+    params_file.write_text(json.dumps({"default": PARAMS, "BANKNIFTY": {"exposure_pct": 0.05}}))
+    return MarginEstimator(params_file=str(params_file))
+
+
+def worst_scenario_loss(strike, is_call, qty, days, iv):
+    """Repriced loss of one leg over the SPAN scenarios, written out independently."""
+    t = days / 365.0
+    base = float(bs_greeks(SPOT, strike, t, iv, is_call)["price"])
+    psr, vol_scan = PARAMS["price_scan_pct"], PARAMS["vol_scan"]
+    scenarios = [(fraction * psr, vol_dir * vol_scan, 1.0)
+                 for fraction in (0.0, 1 / 3, -1 / 3, 2 / 3, -2 / 3, 1.0, -1.0) for vol_dir in (1, -1)]
+    extreme = PARAMS["extreme_move_multiple"] * psr
+    scenarios += [(extreme, 0.0, PARAMS["extreme_move_cover"]), (-extreme, 0.0, PARAMS["extreme_move_cover"])]
+    losses = [-(float(bs_greeks(SPOT * (1 + move), strike, t, iv + vol_move, is_call)["price"]) - base) * qty * cover
+              for move, vol_move, cover in scenarios]
+    return max(max(losses), 0.0)
+
+
+@pytest.mark.parametrize("days, iv", [(2, 0.12), (7, 0.20), (30, 0.12), (60, 0.30)])
+def test_span_is_the_worst_scenario_at_the_given_expiry_and_iv(estimator, days, iv):
+    margins = estimator.estimate_batch("NIFTY", SPOT, [[23000.0], [24000.0]], [["PE"], ["CE"]], [[-75], [-75]],
+                                       [[40.0], [250.0]], days_to_expiry=days, iv=iv)
+
+    assert margins["span"][0] == pytest.approx(worst_scenario_loss(23000.0, False, -75, days, iv), rel=1e-9)
+    assert margins["span"][1] == pytest.approx(worst_scenario_loss(24000.0, True, -75, days, iv), rel=1e-9)
+    np.testing.assert_allclose(margins["exposure"], PARAMS["exposure_pct"] * SPOT * 75)
+    np.testing.assert_allclose(margins["total"], margins["span"] + margins["exposure"])
+
+
+def test_padding_legs_do_not_change_the_margin(estimator):
+    plain = estimator.estimate_batch("NIFTY", SPOT, [[24500.0, 24700.0]], [["CE", "CE"]], [[-75, 75]], [[80.0, 30.0]])
+    # Padding repeats a real strike, as the seller screener does
+    padded = estimator.estimate_batch("NIFTY", SPOT, [[24500.0, 24700.0, 24500.0, 24500.0]], [["CE", "CE", "CE", "PE"]],
+                                      [[-75, 75, 0, 0]], [[80.0, 30.0, 0.0, 0.0]])
+
+    for key in ("span", "exposure", "premium", "total"):
+        assert padded[key][0] == pytest.approx(plain[key][0])
+
+
+def test_hedged_spread_needs_less_margin_than_a_naked_short(estimator):
+    margins = estimator.estimate_batch("NIFTY", SPOT, [[24500.0, 24700.0], [24500.0, 24500.0]], [["CE", "CE"], ["CE", "CE"]],
+                                       [[-75, 75], [-75, 0]], [[80.0, 30.0], [80.0, 0.0]], days_to_expiry=14, iv=0.15)
+
+    assert margins["span"][0] < margins["span"][1]
+    # The hedge cannot lose more than the strike width
+    assert margins["span"][0] <= 200.0 * 75
+    # Exposure is charged on the short notional whether hedged or not
+    assert margins["exposure"][0] == pytest.approx(margins["exposure"][1])
+
+
+def test_long_only_structures_pay_the_premium(estimator):
+    margins = estimator.estimate_batch("NIFTY", SPOT, [[24000.0, 24000.0]], [["CE", "PE"]], [[75, 75]], [[210.0, 190.0]])
+
+    assert margins["span"][0] == 0.0
+    assert margins["exposure"][0] == 0.0
+    assert margins["total"][0] == pytest.approx(400.0 * 75)
+
+
+def test_single_estimate_matches_the_batch(estimator):
+    legs = [
+        {"strike": 23500.0, "option_type": "PE", "quantity": -75, "price": 60.0},
+        {"strike": 23300.0, "option_type": "PE", "quantity": 75, "price": 35.0},
+    ]
+    single = estimator.estimate("NIFTY", SPOT, legs, days_to_expiry=21, iv=0.14)
+    batch = estimator.estimate_batch("NIFTY", SPOT, [[23500.0, 23300.0]], [["PE", "PE"]], [[-75, 75]], [[60.0, 35.0]],
+                                     days_to_expiry=21, iv=0.14)
+
+    assert single == {key: round(float(value[0]), 2) for key, value in batch.items()}
+    assert estimator.estimate("NIFTY", SPOT, []) == {"span": 0.0, "exposure": 0.0, "premium": 0.0, "total": 0.0}
+
+
+def test_symbol_overrides_apply_on_top_of_defaults(estimator):
+    params = estimator.params_for("BANKNIFTY")
+
+    assert params["exposure_pct"] == 0.05
+    assert params["price_scan_pct"] == PARAMS["price_scan_pct"]
@@ -0,0 +1,83 @@
+"""POP and expected payoff against closed forms, and Monte Carlo reproducibility."""
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+from probability_engine import ProbabilityEngine
+from risk_engine import RISK_FREE_RATE
+
+SPOT, T, VOL = 24000.0, 30 / 365.0, 0.15
+FORWARD = SPOT * np.exp(RISK_FREE_RATE * T)
+STD = VOL * np.sqrt(T)
+
+
+def prob_above(x):
+    """Risk-neutral P(S_T > x) under the lognormal model."""
+    return norm.cdf((np.log(FORWARD / x) - 0.5 * STD ** 2) / STD)
+
+
+def forward_put(strike):
+    """Undiscounted E[(K - S_T)+]."""
+    d1 = (np.log(FORWARD / strike) + 0.5 * STD ** 2) / STD
+    return strike * norm.cdf(-(d1 - STD)) - FORWARD * norm.cdf(-d1)
+
+
+def forward_call(strike):
+    return forward_put(strike) + FORWARD - strike
+
+
+def test_short_put_matches_closed_form():
+    strike, credit = 23500.0, 120.0
+    result = ProbabilityEngine().evaluate(SPOT, T, [[strike]], [["PE"]], [[-1]], [credit], vol=VOL, model="lognormal")
+
+    assert result["pop"][0] == pytest.approx(prob_above(strike - credit), abs=1e-9)
+    assert result["expected_payoff"][0] == pytest.approx(credit - forward_put(strike), abs=1e-6)
+
+
+def test_iron_condor_matches_closed_form():
+    # Long 23000 PE, short 23500 PE, short 24500 CE, long 25000 CE; last column is padding
+    strikes = [[23000.0, 23500.0, 24500.0, 25000.0, 0.0]]
+    types = [["PE", "PE", "CE", "CE", "CE"]]
+    quantities = [[1, -1, -1, 1, 0]]
+    credit = 90.0
+    result = ProbabilityEngine().evaluate(SPOT, T, strikes, types, quantities, [credit], vol=VOL, model="lognormal")
+
+    pop = prob_above(23500.0 - credit) - prob_above(24500.0 + credit)
+    expected = (credit + forward_put(23000.0) - forward_put(23500.0)
+                - forward_call(24500.0) + forward_call(25000.0))
+    assert result["pop"][0] == pytest.approx(pop, abs=1e-9)
+    assert result["expected_payoff"][0] == pytest.approx(expected, abs=1e-6)
+
+
+def test_candidates_are_scored_independently():
+    strikes = [[23500.0, 23000.0], [24500.0, 25000.0]]
+    types = [["PE", "PE"], ["CE", "CE"]]
+    quantities = [[-1, 1], [-1, 1]]
+    credit = [110.0, 95.0]
+    engine = ProbabilityEngine()
+    batch = engine.evaluate(SPOT, T, strikes, types, quantities, credit, vol=VOL, model="lognormal")
+
+    for i in range(2):
+        single = engine.evaluate(SPOT, T, strikes[i:i + 1], types[i:i + 1], quantities[i:i + 1], credit[i:i + 1],
+                                 vol=VOL, model="lognormal")
+        assert batch["pop"][i] == pytest.approx(single["pop"][0])
+        assert batch["expected_payoff"][i] == pytest.approx(single["expected_payoff"][0])
+
+
+def test_montecarlo_is_reproducible_for_a_seed():
+    args = (SPOT, T, [[23500.0, 23000.0]], [["PE", "PE"]], [[-1, 1]], [110.0])
+    first = ProbabilityEngine(paths=20000, seed=11).evaluate(*args, vol=VOL, model="montecarlo")
+    second = ProbabilityEngine(paths=20000, seed=11).evaluate(*args, vol=VOL, model="montecarlo")
+    other = ProbabilityEngine(paths=20000, seed=12).evaluate(*args, vol=VOL, model="montecarlo")
+    closed = ProbabilityEngine().evaluate(*args, vol=VOL, model="lognormal")
+
+    np.testing.assert_array_equal(first["pop"], second["pop"])
+    np.testing.assert_array_equal(first["expected_payoff"], second["expected_payoff"])
+    assert first["expected_payoff"][0] != other["expected_payoff"][0]
+    assert first["pop"][0] == pytest.approx(closed["pop"][0], abs=0.01)
+    assert first["expected_payoff"][0] == pytest.approx(closed["expected_payoff"][0], abs=3.0)
+
+
+def test_unknown_model_is_rejected():
+    with pytest.raises(ValueError):
+        ProbabilityEngine().distribution(SPOT, T, VOL, model="binomial")
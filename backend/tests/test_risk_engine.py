@@ -0,0 +1,83 @@
+"""Black-Scholes Greeks and option tradingsymbol parsing."""
+from datetime import date
+
+import numpy as np
+import pytest
+
+from risk_engine import bs_greeks, parse_option_symbol, option_symbol
+
+
+def test_prices_match_the_textbook_example():
+    # Hull, Options, Futures and Other Derivatives: S=42, K=40, r=10%, vol=20%, six months
+    call = bs_greeks(42.0, 40.0, 0.5, 0.2, True, r=0.10)
+    put = bs_greeks(42.0, 40.0, 0.5, 0.2, False, r=0.10)
+
+    assert float(call["price"]) == pytest.approx(4.7594, abs=1e-4)
+    assert float(put["price"]) == pytest.approx(0.8086, abs=1e-4)
+    assert float(call["delta"]) - float(put["delta"]) == pytest.approx(1.0)
+    assert float(call["gamma"]) == pytest.approx(float(put["gamma"]))
+
+
+def test_greeks_match_finite_differences():
+    spot, strike, t, vol = 24000.0, 24200.0, 20 / 365.0, 0.14
+    for is_call in (True, False):
+        greeks = bs_greeks(spot, strike, t, vol, is_call)
+
+        def price(s=spot, tt=t, v=vol):
+            return float(bs_greeks(s, strike, tt, v, is_call)["price"])
+
+        h = 1.0
+        assert float(greeks["delta"]) == pytest.approx((price(s=spot + h) - price(s=spot - h)) / (2 * h), abs=1e-4)
+        assert float(greeks["gamma"]) == pytest.approx(
+            (price(s=spot + h) - 2 * price() + price(s=spot - h)) / h ** 2, rel=1e-3)
+        # Per vol point and per calendar day
+        assert float(greeks["vega"]) == pytest.approx((price(v=vol + 1e-4) - price(v=vol - 1e-4)) / 2e-4 / 100, rel=1e-4)
+        dt = 1e-5
+        assert float(greeks["theta"]) == pytest.approx(-(price(tt=t + dt) - price(tt=t - dt)) / (2 * dt) / 365, rel=1e-3)
+
+
+def test_greeks_broadcast_over_a_book():
+    strikes = np.array([23500.0, 24000.0, 24500.0])
+    is_call = np.array([False, True, True])
+    book = bs_greeks(24000.0, strikes, 10 / 365.0, 0.15, is_call)
+
+    assert book["price"].shape == (3,)
+    for i in range(3):
+        single = bs_greeks(24000.0, strikes[i], 10 / 365.0, 0.15, is_call[i])
+        assert book["price"][i] == pytest.approx(float(single["price"]))
+        assert book["delta"][i] == pytest.approx(float(single["delta"]))
+
+
+def test_expiry_day_does_not_divide_by_zero():
+    greeks = bs_greeks(24000.0, 23900.0, 0.0, 0.15, True)
+
+    assert all(np.isfinite(float(value)) for value in greeks.values())
+    assert float(greeks["price"]) == pytest.approx(100.0, abs=1.0)
+
+
+@pytest.mark.parametrize("symbol, expected", [
+    ("NIFTY24FEB22000CE", ("NIFTY", 22000.0, "CE")),
+    ("NIFTY2421522000PE", ("NIFTY", 22000.0, "PE")),
+    ("BANKNIFTY24O0951500CE", ("BANKNIFTY", 51500.0, "CE")),
+    ("M&M24MAR1552.5PE", ("M&M", 1552.5, "PE")),
+    ("BAJAJ-AUTO24MAR9000CE", ("BAJAJ-AUTO", 9000.0, "CE")),
+])
+def test_option_symbols_are_parsed(symbol, expected):
+    assert parse_option_symbol(symbol) == expected
+
+
+@pytest.mark.parametrize("symbol", ["RELIANCE", "NIFTY24FEBFUT", "NIFTY 50", "NIFTY24FEB22000XX"])
+def test_non_options_are_not_parsed(symbol):
+    assert parse_option_symbol(symbol) is None
+
+
+@pytest.mark.parametrize("expiry, expected", [
+    (date(2024, 2, 29), "NIFTY24FEB22000CE"),
+    (date(2024, 2, 15), "NIFTY2421522000CE"),
+    (date(2024, 10, 10), "NIFTY24O1022000CE"),
+])
+def test_option_symbol_round_trips(expiry, expected):
+    symbol = option_symbol("NIFTY", expiry, 22000.0, "CE")
+
+    assert symbol == expected
+    assert parse_option_symbol(symbol) == ("NIFTY", 22000.0, "CE")
@@ -0,0 +1,220 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from instrument_master import CACHE_DIR
+from shared_cache import get_shared_cache
+
+IST = timezone(timedelta(hours=5, minutes=30))
+# Kite access tokens are invalidated every day at 06:00 IST
+TOKEN_EXPIRY_HOUR_IST = 6
+TOKEN_FILE = os.getenv("KITE_TOKEN_FILE", os.path.join(CACHE_DIR, "kite_token.json"))
+# How long after the daily rollover the background renewal logs in again
+RENEWAL_DELAY = timedelta(minutes=int(os.getenv("KITE_TOKEN_RENEWAL_DELAY_MIN", "5")))
+# Shared-cache key holding the current token for every worker
+SHARED_TOKEN_KEY = "kite:token"
+
+
+def next_expiry(issued_at):
+    """The first 06:00 IST boundary after a token was issued."""
+    issued_ist = issued_at.astimezone(IST)
+    expiry = issued_ist.replace(hour=TOKEN_EXPIRY_HOUR_IST, minute=0, second=0, microsecond=0)
+    if expiry <= issued_ist:
+        expiry += timedelta(days=1)
+    return expiry
+
+
+class TokenManager:
+    """
+    Owns the Kite access token for the whole process.
+
+    - refresh() is single-flight: one Selenium login runs at a time and concurrent callers
+      wait for its result instead of launching their own browser. Across workers the login
+      runs under a shared-cache lock, and the new token is published to the shared cache so
+      the other workers adopt it instead of logging in again.
+    - Tokens are persisted to disk, so restarts within the same trading day skip the login.
+    - A background thread renews the token right after the daily 06:00 IST rollover, before
+      the first request of the day can run into a TokenException.
+    - The Selenium login (generate_token) is imported only when a login actually happens.
+    """
+
+    def __init__(self, token_file=TOKEN_FILE):
+        self.token_file = token_file
+        self.access_token = None
+        self.issued_at = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._refresh_done = threading.Condition(self._lock)
+        self._refreshing = False
+        self._renewal_thread = None
+        self._stop = threading.Event()
+
+        self._load()
+        if not self.access_token and os.getenv("KITE_ACCESS_TOKEN"):
+            # Token handed in via environment; its issue time is unknown, assume today.
+            self.access_token = os.getenv("KITE_ACCESS_TOKEN")
+            self.issued_at = datetime.now(IST)
+
+    def subscribe(self, listener):
+        """listener(access_token) is called after every successful refresh."""
+        self._listeners.append(listener)
+
+    def get_token(self):
+        # Workers on other hosts do not share the token file, only the cache
+        if not self.is_valid():
+            shared = self._read_shared()
+            if shared:
+                with self._lock:
+                    self.access_token, self.issued_at = shared
+        return self.access_token
+
+    def is_valid(self, now=None):
+        if not self.access_token or not self.issued_at:
+            return False
+        return (now or datetime.now(IST)) < next_expiry(self.issued_at)
+
+    def refresh(self, stale_token=None, timeout=180):
+        """
+        Fetches a new token. If another thread is already refreshing, waits for it and
+        returns its result. If the token already changed since the caller saw `stale_token`,
+        returns the current one without logging in again.
+        """
+        with self._lock:
+            if stale_token is not None and self.access_token and self.access_token != stale_token:
+                return self.access_token
+
+            if self._refreshing:
+                token_before = self.access_token
+                self._refresh_done.wait(timeout)
+                # None when the login we waited on failed
+                return self.access_token if self.access_token != token_before else None
+
+            self._refreshing = True
+
+        new_token, issued_at = None, None
+        try:
+            new_token, issued_at = self._refresh_across_workers(stale_token or self.access_token, timeout)
+        finally:
+            with self._lock:
+                if new_token:
+                    self.access_token = new_token
+                    self.issued_at = issued_at
+                self._refreshing = False
+                self._refresh_done.notify_all()
+
+        if new_token:
+            self._persist()
+            for listener in self._listeners:
+                try:
+                    listener(new_token)
+                except Exception as e:
+                    logging.error(f"Token listener failed: {e}")
+        return self.access_token if new_token else None
+
+    def _refresh_across_workers(self, stale_token, timeout):
+        """
+        Returns (token, issued_at). Holds the shared refresh lock while checking whether
+        another worker already published a newer token, and logs in only if none did.
+        """
+        cache = get_shared_cache()
+        with cache.lock(SHARED_TOKEN_KEY, ttl=timeout, timeout=timeout) as acquired:
+            if not acquired:
+                logging.error("Timed out waiting for another worker's Kite login.")
+                return None, None
+
+            shared = self._read_shared()
+            if shared and shared[0] != stale_token:
+                logging.info("Adopted Kite access token refreshed by another worker.")
+                return shared
+
+            token = self._login()
+            if not token:
+                return None, None
+            issued_at = datetime.now(IST)
+            ttl = (next_expiry(issued_at) - issued_at).total_seconds()
+            cache.set(SHARED_TOKEN_KEY, {"access_token": token, "issued_at": issued_at.isoformat()}, ttl)
+            return token, issued_at
+
+    def _read_shared(self):
+        """(token, issued_at) from the shared cache if a still-valid token is published there."""
+        try:
+            data = get_shared_cache().get(SHARED_TOKEN_KEY)
+        except Exception as e:
+            logging.warning(f"Shared token lookup failed: {e}")
+            return None
+        if not data:
+            return None
+        issued_at = datetime.fromisoformat(data["issued_at"])
+        if datetime.now(IST) >= next_expiry(issued_at):
+            return None
+        return data["access_token"], issued_at
+
+    def _login(self):
+        if not os.getenv("ZERODHA_TOTP_SECRET"):
+            logging.warning("Cannot auto-refresh token: ZERODHA_TOTP_SECRET not found in environment.")
+            return None
+
+        logging.info("Triggering automated TOTP login to refresh Kite Token...")
+        try:
+            # Deferred import: Selenium and webdriver_manager are only needed for a login
+            from generate_token import generate_token
+            return generate_token()
+        except (Exception, SystemExit) as e:
+            # generate_token() calls exit(1) on failure; never let that take the server down
+            logging.error(f"Failed to auto-refresh token: {e}")
+            return None
+
+    def _load(self):
+        try:
+            with open(self.token_file) as f:
+                data = json.load(f)
+            issued_at = datetime.fromisoformat(data["issued_at"])
+            if datetime.now(IST) < next_expiry(issued_at):
+                self.access_token = data["access_token"]
+                self.issued_at = issued_at
+                logging.info("Loaded persisted Kite access token.")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable token file {self.token_file}: {e}")
+
+    def _persist(self):
+        try:
+            os.makedirs(os.path.dirname(self.token_file), exist_ok=True)
+            tmp_path = f"{self.token_file}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"access_token": self.access_token, "issued_at": self.issued_at.isoformat()}, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.token_file)
+        except Exception as e:
+            logging.warning(f"Failed to persist Kite access token: {e}")
+
+    def start_background_renewal(self):
+        """Starts the daemon thread that renews the token after each daily rollover."""
+        if self._renewal_thread and self._renewal_thread.is_alive():
+            return
+        self._stop.clear()
+        self._renewal_thread = threading.Thread(target=self._renewal_loop, name="kite-token-renewal", daemon=True)
+        self._renewal_thread.start()
+
+    def stop_background_renewal(self):
+        self._stop.set()
+
+    def _renewal_loop(self):
+        while not self._stop.is_set():
+            if not self.is_valid():
+                self.refresh(stale_token=self.access_token)
+
+            now = datetime.now(IST)
+            if self.is_valid(now):
+                wake_at = next_expiry(self.issued_at) + RENEWAL_DELAY
+            else:
+                # Login failed or is not configured; retry later without hammering Zerodha
+                wake_at = now + timedelta(minutes=15)
+            self._stop.wait(max((wake_at - now).total_seconds(), 1))
+
+
+# Initialize singleton
+token_manager = TokenManager()
@@ -0,0 +1,98 @@
+import os
+import json
+import logging
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+
+from token_manager import IST
+
+NSE_HOLIDAYS_FILE = os.getenv(
+    "NSE_HOLIDAYS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nse_holidays.json")
+)
+
+MARKET_OPEN = dt_time(9, 15)
+MARKET_CLOSE = dt_time(15, 30)
+
+
+class TradingCalendar:
+    """
+    NSE trading sessions: weekdays minus the exchange holidays in NSE_HOLIDAYS_FILE.
+    Day counts go through numpy's business-day routines, so a whole book's days to
+    expiry is one vectorized call.
+
+    The file covers whole years and has to be extended from NSE's holiday circular each
+    year; dates past its last year are counted as if they had no holidays, with a warning.
+    """
+
+    def __init__(self, holidays_file=NSE_HOLIDAYS_FILE):
+        self.holidays_file = holidays_file
+        self.holidays, self.last_year = self._load()
+        self._warned_years = set()
+        self._holiday_array = np.array(sorted(self.holidays), dtype="datetime64[D]")
+        # Set by freeze(): the market clock stops here (session replays)
+        self._frozen_now = None
+
+    def _load(self):
+        try:
+            with open(self.holidays_file) as f:
+                data = json.load(f)
+            years = {year: days for year, days in data.items() if not year.startswith("_")}
+            return {date.fromisoformat(day) for days in years.values() for day in days}, max(map(int, years), default=None)
+        except Exception as e:
+            logging.warning(f"Exchange holiday file not loaded ({self.holidays_file}): {e}. Using weekends only.")
+            return set(), None
+
+    def _check_coverage(self, year):
+        """Warns (once per year) when `year` is past the last year of the holiday file."""
+        if self.last_year is not None and year > self.last_year and year not in self._warned_years:
+            self._warned_years.add(year)
+            logging.warning(f"No NSE holidays for {year} in {self.holidays_file}; counting its weekdays as "
+                            f"trading days. Add the exchange's {year} holiday circular.")
+
+    def now(self):
+        """Current time in IST, or the frozen time during a replay."""
+        return self._frozen_now or datetime.now(IST)
+
+    def freeze(self, moment):
+        """Stops the market clock at `moment` (an aware datetime); None restarts it."""
+        self._frozen_now = moment
+
+    def is_trading_day(self, day):
+        self._check_coverage(day.year)
+        return day.weekday() < 5 and day not in self.holidays
+
+    def next_trading_day(self, day):
+        """The first trading session strictly after `day`."""
+        day += timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return day
+
+    def is_market_open(self, now=None):
+        """True during the 09:15-15:30 IST session of a trading day."""
+        now = (now or self.now()).astimezone(IST)
+        return self.is_trading_day(now.date()) and MARKET_OPEN <= now.time() <= MARKET_CLOSE
+
+    def trading_days_to_expiry(self, expiry, today=None):
+        """
+        Trading sessions left after today, up to and including the expiry session
+        (0 on expiry day). `expiry` may be a date or an array of dates.
+        """
+        today = today or self.now().date()
+        start = np.datetime64(today + timedelta(days=1), "D")
+        end = np.asarray(expiry, dtype="datetime64[D]") + np.timedelta64(1, "D")
+        if end.size:
+            self._check_coverage(int(str(np.max(end) - np.timedelta64(1, "D"))[:4]))
+        days = np.busday_count(start, np.maximum(end, start), holidays=self._holiday_array)
+        return int(days) if np.ndim(days) == 0 else days
+
+    def calendar_days_to_expiry(self, expiry, now=None):
+        """Calendar days (fractional) until the expiry session closes at 15:30 IST; the Greeks' time input."""
+        now = (now or self.now()).astimezone(IST)
+        close = datetime.combine(expiry, MARKET_CLOSE, tzinfo=IST)
+        return max((close - now).total_seconds() / 86400.0, 0.0)
+
+
+# Initialize singleton
+trading_calendar = TradingCalendar()
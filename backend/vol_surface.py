@@ -0,0 +1,315 @@
+import os
+import threading
+import importlib
+from collections import OrderedDict
+
+import numpy as np
+
+from risk_engine import RISK_FREE_RATE, MIN_TIME_TO_EXPIRY, bs_greeks
+from shared_cache import get_history_cache
+from trading_calendar import trading_calendar
+import session_replay
+from metrics import registry, timer
+
+# Smile model per expiry: "svi" (raw SVI) or "spline" (least-squares cubic spline), both
+# fitted to total implied variance against log-moneyness
+VOL_SURFACE_MODEL = os.getenv("VOL_SURFACE_MODEL", "svi")
+# Fitted smiles kept per (underlying, expiry)
+SURFACE_CACHE_SIZE = 256
+# Time to expiry is bucketed to this many seconds, so a fit is reused until the clock
+# (rather than the market) has moved it
+SURFACE_TIME_STEP_SEC = 300
+# When at most this share of a smile's quotes changed (same spot, same strikes), only those
+# strikes are re-inverted; any refit on an unchanged strike grid is warm-started from the
+# previous parameters
+INCREMENTAL_REFIT_FRACTION = 0.25
+# Quotes below this (per share) are too coarse to invert reliably
+MIN_OPTION_PRICE = 0.5
+# Daily ATM IV history behind IV rank: one year of sessions, kept in the shared cache
+IV_HISTORY_DAYS = 252
+IV_HISTORY_TTL_SEC = 400 * 24 * 3600
+
+SURFACE_FITS = registry.counter("optrec_vol_surface_fits_total",
+                                "Smile lookups by outcome (cached, incremental or full fit).")
+
+
+def implied_vols(spot, strikes, t, prices, is_call, r=RISK_FREE_RATE, iterations=30):
+    """
+    Black-Scholes implied volatility for a whole strip of quotes at once (safeguarded
+    Newton: a step that leaves the current bracket falls back to bisection).
+    NaN where the price has no time value or breaks the no-arbitrage bounds.
+    """
+    strikes = np.asarray(strikes, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    is_call = np.asarray(is_call, dtype=bool)
+    t = max(t, MIN_TIME_TO_EXPIRY)
+
+    discounted = strikes * np.exp(-r * t)
+    intrinsic = np.where(is_call, np.maximum(spot - discounted, 0.0), np.maximum(discounted - spot, 0.0))
+    upper = np.where(is_call, spot, discounted)
+    valid = (prices > intrinsic + 1e-6) & (prices < upper)
+
+    lo = np.full(prices.shape, 1e-3)
+    hi = np.full(prices.shape, 5.0)
+    # Brenner-Subrahmanyam starting point
+    vol = np.clip(np.sqrt(2 * np.pi / t) * prices / spot, 0.05, 2.0)
+    for _ in range(iterations):
+        greeks = bs_greeks(spot, strikes, t, vol, is_call, r)
+        diff = greeks["price"] - prices
+        if np.all(np.abs(diff[valid]) < 1e-6):
+            break
+        hi = np.where(diff > 0, vol, hi)
+        lo = np.where(diff <= 0, vol, lo)
+        step = vol - diff / np.maximum(greeks["vega"] * 100.0, 1e-12)
+        vol = np.where((step > lo) & (step < hi), step, 0.5 * (lo + hi))
+    return np.where(valid, vol, np.nan)
+
+
+def atm_implied_vol(spot, chain, t):
+    """
+    Implied vol of the out-of-the-money option at the strike nearest spot, or None when the
+    chain has no usable quote there. A single-strike solve, for callers that need the level
+    but not the smile.
+    """
+    if not chain:
+        return None
+    row = min(chain, key=lambda row: abs(row["strike"] - spot))
+    is_call = row["strike"] >= spot
+    price = row["ce_price"] if is_call else row["pe_price"]
+    if price < MIN_OPTION_PRICE:
+        return None
+    iv = implied_vols(spot, [row["strike"]], t, [price], [is_call])[0]
+    return float(iv) if np.isfinite(iv) else None
+
+
+def svi_total_variance(params, k):
+    """Raw SVI: w(k) = a + b * (rho * (k - m) + sqrt((k - m)^2 + sigma^2))."""
+    a, b, rho, m, sigma = params
+    return a + b * (rho * (k - m) + np.sqrt((k - m) ** 2 + sigma ** 2))
+
+
+def svi_jacobian(params, k):
+    """d w / d (a, b, rho, m, sigma), one row per strike."""
+    _, b, rho, m, sigma = params
+    root = np.sqrt((k - m) ** 2 + sigma ** 2)
+    return np.column_stack([np.ones_like(k), rho * (k - m) + root, b * (k - m),
+                            -b * (rho + (k - m) / root), b * sigma / root])
+
+
+class Smile:
+    """One expiry's fitted smile: total implied variance as a function of log-moneyness."""
+
+    def __init__(self, model, params, forward, t, k_range, rmse, points):
+        self.model = model
+        self.params = params
+        self.forward = forward
+        self.t = t
+        self.k_range = k_range
+        self.rmse = rmse
+        self.points = points
+
+    def total_variance(self, k):
+        if self.model == "svi":
+            w = svi_total_variance(self.params, k)
+        elif self.model == "spline":
+            # Flat extrapolation beyond the quoted wings
+            w = self.params(np.clip(k, *self.k_range))
+        else:
+            w = np.full(np.shape(k), self.params)
+        return np.maximum(w, 1e-8)
+
+    def vol(self, strikes):
+        """Implied volatility (decimal) at the given strikes; broadcasts."""
+        k = np.log(np.asarray(strikes, dtype=float) / self.forward)
+        return np.sqrt(self.total_variance(k) / self.t)
+
+
+class VolSurface:
+    """
+    Per-expiry implied volatility smiles fitted from option chains, plus the skew, ATM IV
+    and IV-rank analytics built on them.
+
+    Every smile is inverted from the out-of-the-money side of the chain (puts below the
+    forward, calls above) in one vectorized pass and fitted by least squares. Fits are
+    cached per (underlying, expiry) together with the snapshot they came from: an
+    identical snapshot is a cache hit, a snapshot on the same strikes warm-starts from the
+    previous parameters (keeping them outright while they still fit), and when only a few
+    quotes moved just those strikes are re-inverted.
+    """
+
+    def __init__(self, model=VOL_SURFACE_MODEL, cache_size=SURFACE_CACHE_SIZE):
+        self.model = model
+        self.cache_size = cache_size
+        self._fits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """Imports the least-squares stack ahead of the first fit (it is deferred otherwise)."""
+        importlib.import_module("scipy.optimize")
+        importlib.import_module("scipy.interpolate")
+
+    # --- Fitting ---
+
+    def smile(self, underlying, spot, chain, t, r=RISK_FREE_RATE):
+        """The fitted Smile for a chain (one expiry), or None when too few strikes are quoted."""
+        step = SURFACE_TIME_STEP_SEC / (365.0 * 86400.0)
+        t = max(round(t / step) * step, MIN_TIME_TO_EXPIRY)
+        forward = spot * np.exp(r * t)
+        strikes = np.array([row["strike"] for row in chain], dtype=float)
+        is_call = strikes >= forward
+        prices = np.array([row["ce_price"] if call else row["pe_price"] for row, call in zip(chain, is_call)],
+                          dtype=float)
+        quoted = prices >= MIN_OPTION_PRICE
+        strikes, is_call, prices = strikes[quoted], is_call[quoted], prices[quoted]
+
+        key = (underlying, getattr(chain, "expiry", None))
+        snapshot = (round(float(spot), 4), round(float(t), 8))
+        with self._lock:
+            previous = self._fits.get(key)
+            if previous is not None:
+                self._fits.move_to_end(key)
+
+        if (previous is not None and previous["snapshot"] == snapshot
+                and np.array_equal(previous["strikes"], strikes) and np.array_equal(previous["prices"], prices)):
+            SURFACE_FITS.inc(mode="cached")
+            return previous["smile"]
+
+        with timer("vol_surface.fit"):
+            warm_start = None
+            ivs = None
+            if previous is not None and np.array_equal(previous["strikes"], strikes):
+                warm_start = previous["smile"]
+                changed = previous["prices"] != prices
+                if previous["snapshot"] == snapshot and changed.mean() <= INCREMENTAL_REFIT_FRACTION:
+                    ivs = previous["ivs"].copy()
+                    ivs[changed] = implied_vols(spot, strikes[changed], t, prices[changed], is_call[changed], r)
+            if ivs is None:
+                ivs = implied_vols(spot, strikes, t, prices, is_call, r)
+
+            fitted = self._fit(np.log(strikes / forward), ivs, forward, t, warm_start)
+        SURFACE_FITS.inc(mode="incremental" if warm_start is not None else "full")
+
+        with self._lock:
+            self._fits[key] = {"snapshot": snapshot, "strikes": strikes, "prices": prices, "ivs": ivs,
+                               "smile": fitted}
+            self._fits.move_to_end(key)
+            while len(self._fits) > self.cache_size:
+                self._fits.popitem(last=False)
+        return fitted
+
+    def _fit(self, k, ivs, forward, t, warm_start=None):
+        ok = np.isfinite(ivs)
+        k, w = k[ok], ivs[ok] ** 2 * t
+        if len(k) == 0:
+            return None
+        k_range = (float(k.min()), float(k.max()))
+
+        if warm_start is not None and warm_start.model in (self.model, "flat"):
+            # A few moved quotes rarely move the smile: keep the previous parameters while
+            # they still fit about as well as they did
+            kept = Smile(warm_start.model, warm_start.params, forward, t, k_range, 0.0, len(k))
+            kept.rmse = self._rmse(kept, k, w)
+            if kept.rmse <= warm_start.rmse * 1.25 + 1e-4:
+                return kept
+
+        if self.model == "svi" and len(k) >= 5:
+            params = self._fit_svi(k, w, warm_start.params if warm_start and warm_start.model == "svi" else None)
+            smile = Smile("svi", params, forward, t, k_range, 0.0, len(k))
+        elif self.model == "spline" and len(k) >= 5:
+            from scipy.interpolate import LSQUnivariateSpline
+            # Interior knots on quantiles of the quoted moneyness keep every segment populated
+            knots = np.quantile(k, np.linspace(0, 1, min(len(k) // 3, 6) + 1)[1:-1])
+            smile = Smile("spline", LSQUnivariateSpline(k, w, knots, k=3), forward, t, k_range, 0.0, len(k))
+        else:
+            # Too few quotes for a smile: flat at the quote nearest the money
+            smile = Smile("flat", float(w[np.argmin(np.abs(k))]), forward, t, k_range, 0.0, len(k))
+
+        smile.rmse = self._rmse(smile, k, w)
+        return smile
+
+    def _rmse(self, smile, k, w):
+        """Fit error in volatility terms."""
+        return float(np.sqrt(np.mean((np.sqrt(smile.total_variance(k) / smile.t) - np.sqrt(w / smile.t)) ** 2)))
+
+    def _fit_svi(self, k, w, initial=None):
+        """Least-squares raw SVI over all quoted strikes of one expiry."""
+        from scipy.optimize import least_squares
+
+        w_max = float(w.max())
+        lower = [-w_max, 0.0, -0.999, 2 * k.min() - k.max(), 1e-4]
+        upper = [w_max, 10.0, 0.999, 2 * k.max() - k.min(), 5.0]
+        if initial is None:
+            initial = [float(w.min()) * 0.5, 0.1, -0.3, float(k[np.argmin(w)]), 0.1]
+        initial = np.clip(initial, np.add(lower, 1e-9), np.subtract(upper, 1e-9))
+        result = least_squares(lambda p: svi_total_variance(p, k) - w, initial,
+                               jac=lambda p: svi_jacobian(p, k), bounds=(lower, upper), method="trf",
+                               x_scale="jac")
+        return result.x
+
+    # --- Analytics ---
+
+    def analytics(self, underlying, spot, chain, t, r=RISK_FREE_RATE):
+        """
+        ATM IV, 25-delta skew and IV rank for a chain, or None when no smile can be fitted.
+        Volatilities are decimals; skew_25d is the 25-delta put IV minus the 25-delta call
+        IV (positive when puts are bid over calls).
+        """
+        smile = self.smile(underlying, spot, chain, t, r)
+        if smile is None:
+            return None
+
+        atm_iv = float(smile.vol(smile.forward))
+        # Strike grid spanning +/-4 standard deviations, then read off the 25-delta strikes
+        grid = smile.forward * np.exp(np.linspace(-4, 4, 161) * atm_iv * np.sqrt(smile.t))
+        grid_vol = smile.vol(grid)
+        call_delta = bs_greeks(spot, grid, smile.t, grid_vol, True, r)["delta"]
+        # Call delta falls with strike (reversed for interp); put delta is call delta - 1
+        call_25d = float(np.interp(0.25, call_delta[::-1], grid_vol[::-1]))
+        put_25d = float(np.interp(-0.25, call_delta[::-1] - 1.0, grid_vol[::-1]))
+
+        iv_rank, history_days = self.iv_rank(underlying, atm_iv)
+        return {
+            "atm_iv": round(atm_iv, 4),
+            "put_25d_iv": round(put_25d, 4),
+            "call_25d_iv": round(call_25d, 4),
+            "skew_25d": round(put_25d - call_25d, 4),
+            "iv_rank": iv_rank,
+            "iv_history_days": history_days,
+            "model": smile.model,
+            "fit_rmse": round(smile.rmse, 5),
+            "points": smile.points
+        }
+
+    def iv_rank(self, underlying, atm_iv):
+        """
+        Records today's ATM IV in the shared daily history and returns (IV rank 0-100 or
+        None, days of history). The rank needs at least two sessions with different IVs.
+        """
+        if underlying is None:
+            return None, 0
+        cache = get_history_cache()
+        key = f"ivhist:{underlying}"
+        today = trading_calendar.now().date().isoformat()
+        history = cache.get(key) or {}
+        # The history as it stood before today, for replays of this session
+        session_replay.record("ivhist", {underlying: {day: iv for day, iv in history.items() if day != today}},
+                              first_only=True)
+        if abs(history.get(today, -1.0) - atm_iv) > 5e-4:
+            with cache.lock(key, ttl=10, timeout=1) as acquired:
+                if acquired:
+                    history = cache.get(key) or {}
+                    history[today] = atm_iv
+                    history = dict(sorted(history.items())[-IV_HISTORY_DAYS:])
+                    cache.set(key, history, IV_HISTORY_TTL_SEC)
+                else:
+                    history = {**history, today: atm_iv}
+
+        values = np.array(list(history.values()), dtype=float)
+        low, high = values.min(), values.max()
+        if len(values) < 2 or high - low < 1e-9:
+            return None, len(values)
+        return round(float((atm_iv - low) / (high - low) * 100), 1), len(values)
+
+
+# Initialize singleton
+vol_surface = VolSurface()
@@ -159,7 +159,7 @@ export default function StrategyCard({ result }) {
           <div className="stat-box">
             <div className="stat-label">Max Profit</div>
             <div className="stat-value text-success">
-              {stats.max_profit === 'Unlimited' ? 'Unlimited' : `₹${stats.max_profit.toLocaleString()}`}
+              {stats.max_profit_unlimited ? 'Unlimited' : `₹${stats.max_profit.toLocaleString()}`}
             </div>
           </div>
           <div className="stat-box">